@@ -0,0 +1,100 @@
+import os
+import sys
+import shutil
+import argparse
+import tempfile
+import threading
+import subprocess
+
+## the shared modules live in scripts
+sys.path.insert(0,os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                               "scripts"))
+
+from archesio import getCompression, stripCompression, relationsPath, \
+    copyDecompressed
+
+def feedPipe(in_path,pipe_path):
+    """ decompresses in_path into the named pipe, this blocks until the
+    loader opens the pipe for reading """
+    with open(pipe_path,"wb") as pipe:
+        copyDecompressed(in_path,pipe)
+
+def stageFiles(arches_file,work_dir,stream):
+    """ makes the decompressed .arches and .relations available under their
+    plain names in work_dir, either as named pipes that are fed on the fly
+    (stream) or as decompressed temporary files.  returns the new .arches
+    path. """
+
+    pairs = [(arches_file,os.path.join(work_dir,
+        os.path.basename(stripCompression(arches_file))))]
+    relations = relationsPath(arches_file)
+    if os.path.isfile(relations):
+        pairs.append((relations,os.path.join(work_dir,
+            os.path.basename(stripCompression(relations)))))
+
+    for in_path, out_path in pairs:
+        if stream:
+            os.mkfifo(out_path)
+            feeder = threading.Thread(target=feedPipe,args=(in_path,out_path))
+            feeder.daemon = True
+            feeder.start()
+        else:
+            with open(out_path,"wb") as out:
+                copyDecompressed(in_path,out)
+
+    return pairs[0][1]
+
+def loadResources(arches_file,manage_py,python_exe,stream):
+    """ runs the arches load_resources command on a compressed .arches file
+    (and its .relations file) without leaving decompressed copies behind """
+
+    if not getCompression(arches_file):
+        raise Exception("{0} is not a compressed .arches file".format(
+            arches_file))
+    if stream and not hasattr(os,"mkfifo"):
+        print "named pipes are not available here, decompressing to a "\
+            "temporary file instead"
+        stream = False
+
+    work_dir = tempfile.mkdtemp(prefix="loadarches_")
+    try:
+        source = stageFiles(arches_file,work_dir,stream)
+        cmd = [python_exe,manage_py,"packages","-o","load_resources",
+               "-s",source]
+        print " ".join(cmd)
+        return subprocess.call(cmd)
+    finally:
+        shutil.rmtree(work_dir,ignore_errors=True)
+
+def makeParser():
+    """ builds the command line parser """
+    parser = argparse.ArgumentParser(description=
+            """Loads a gzip or zstd compressed .arches file (and the .relations
+file next to it) into an Arches (v3.0) installation, decompressing it on the
+fly for the load_resources command.""")
+
+    parser.add_argument("arches_file",
+                        help="path to .arches.gz or .arches.zst file")
+
+    parser.add_argument("-m",dest="manage_py",required=True,
+                        help="path to the manage.py of the Arches project")
+
+    parser.add_argument("-p",dest="python_exe",default=sys.executable,
+                        help="python interpreter of the Arches project "\
+                        "(default=this interpreter)")
+
+    parser.add_argument("-s",dest="stream",action="store_true",
+                        help="feed the loader through named pipes instead "\
+                        "of temporary files.  only use this if the loader "\
+                        "reads each file once, from start to end.")
+
+    return parser
+
+def main(argv=None):
+    """ runs the command line tool, returns the loader's exit code """
+    args = makeParser().parse_args(argv)
+    return loadResources(os.path.abspath(args.arches_file),args.manage_py,
+                         args.python_exe,args.stream)
+
+if __name__ == "__main__":
+    sys.exit(main())
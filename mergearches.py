@@ -0,0 +1,242 @@
+import os
+import sys
+import json
+import argparse
+
+## the shared modules live in scripts
+sys.path.insert(0,os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                               "scripts"))
+
+from archesio import openInput, relationsPath, ArchesWriter
+from jobs import FIRST_RESOURCEID, FIRST_GROUPID
+
+def splitResourceid(resourceid):
+    """ returns the dataset prefix of a resourceid (with its "-", or "" for a
+    plain number) and its number """
+    prefix, dash, number = resourceid.rpartition("-")
+    return prefix+dash, int(number)
+
+def listInputFiles(path):
+    """ returns the .arches files of one input and the .relations files that
+    go with them: the shards and cross shard relations listed in a .manifest,
+    or a single .arches file and the .relations file next to it """
+
+    if path.endswith(".manifest"):
+        with open(path) as f:
+            manifest = json.load(f)
+        folder = os.path.dirname(path)
+        arches = [os.path.join(folder,str(shard["ARCHES"]))
+                  for shard in manifest["SHARDS"]]
+        relations = [os.path.join(folder,str(shard["RELATIONS"]))
+                     for shard in manifest["SHARDS"]]
+        if "CROSS_SHARD" in manifest:
+            relations.append(os.path.join(folder,
+                str(manifest["CROSS_SHARD"]["RELATIONS"])))
+    else:
+        arches = [path]
+        relations = [relationsPath(path)]
+    return arches, [rel for rel in relations if os.path.isfile(rel)]
+
+def readRows(path):
+    """ yields the rows of a (possibly compressed) .arches or .relations
+    file, without the header and line endings """
+    infile = openInput(path)
+    try:
+        for num, line in enumerate(infile):
+            line = line.rstrip("\r\n")
+            if num == 0 and line.startswith("RESOURCEID"):
+                continue
+            if line:
+                yield line
+    finally:
+        infile.close()
+
+class Renumbering(object):
+    """ moves the ids of one input into the merged output.  the converters
+    give the resources of a file increasing numbers and its groups groupids
+    after the first, so every id can be moved by the same amount, which puts
+    the input's first id at the next free id of the output.  the gaps left
+    by skipped records are kept, and only the first and last ids of the
+    input (and the prefixes of its ids) are needed to map any of them,
+    however large it is. """
+    def __init__(self,path,next_resourceid,next_groupid):
+        self.path = path
+        self.next_resourceid = next_resourceid
+        self.next_groupid = next_groupid
+        self.first = None
+        self.last = None
+        self.first_groupid = None
+        self.last_groupid = None
+        self.prefixes = set()
+        self.resources = 0
+
+    def resourceid(self,resourceid):
+        """ the new id of a resource of the input's .arches rows """
+        prefix, number = splitResourceid(resourceid)
+        if self.first is None:
+            self.first = number
+        elif number < self.last:
+            raise Exception("{0}: resource {1} comes after resource {2}, "\
+                "the resources of an .arches file must be in the order "\
+                "they were numbered".format(self.path,resourceid,self.last))
+        if number != self.last:
+            self.resources += 1
+        self.last = number
+        self.prefixes.add(prefix)
+        return prefix+str(number-self.first+self.next_resourceid)
+
+    def groupid(self,groupid):
+        """ the new groupid of one of the input's .arches rows """
+        groupid = int(groupid)
+        if self.first_groupid is None:
+            self.first_groupid = self.last_groupid = groupid
+        elif groupid < self.first_groupid:
+            raise Exception("{0}: groupid {1} comes after groupid {2}, "\
+                "the first groupid of an .arches file must be its "\
+                "lowest".format(self.path,groupid,self.first_groupid))
+        self.last_groupid = max(self.last_groupid,groupid)
+        return groupid-self.first_groupid+self.next_groupid
+
+    def holds(self,resourceid):
+        """ whether a resource id is in the range of the input's ids """
+        prefix, number = splitResourceid(resourceid)
+        return self.first is not None and prefix in self.prefixes and \
+            self.first <= number <= self.last
+
+    def relatedid(self,resourceid):
+        """ the new id of a resource of the input named in a .relations """
+        prefix, number = splitResourceid(resourceid)
+        return prefix+str(number-self.first+self.next_resourceid)
+
+    def nextIds(self):
+        """ the first resource number and groupid free after this input """
+        if self.first is None:
+            return self.next_resourceid, self.next_groupid
+        return (self.last-self.first+self.next_resourceid+1,
+                self.last_groupid-self.first_groupid+self.next_groupid+1)
+
+def relatedId(resourceid,ids,renumberings,path):
+    """ the new id of a resource named in the .relations file at path, which
+    belongs to the input renumbered by ids.  the resource is looked for in
+    that input first, then in whichever other input holds it, as the
+    relations between the datasets of a job file (JOBFILE_cross.relations)
+    name resources of the other .arches files. """
+    if ids.holds(resourceid):
+        return ids.relatedid(resourceid)
+    holders = [other for other in renumberings if other.holds(resourceid)]
+    if not holders:
+        raise Exception("{0}: the relations name resource {1}, which is "\
+            "not in any of the merged .arches files".format(path,resourceid))
+    if len(holders) > 1:
+        raise Exception("{0}: the relations name resource {1}, which is in "\
+            "more than one of the merged .arches files: {2}".format(path,
+            resourceid,", ".join([other.path for other in holders])))
+    return holders[0].relatedid(resourceid)
+
+def mergeArches(inputs,out_file,first_ids=None,max_resources=None,
+                max_bytes=None):
+    """ merges the .arches files (or .manifest files of sharded output) of
+    separate conversions, and their .relations, into one .arches file, in
+    the order given.  every row is streamed from the inputs to the output,
+    renumbered on the way (see Renumbering), so memory use doesn't grow with
+    the size of the inputs.  the output is compressed and sharded the way
+    ArchesWriter does.  returns the Renumbering of each input. """
+
+    out_path = os.path.abspath(out_file)
+    for path in inputs:
+        arches_files = listInputFiles(path)[0]
+        if out_path in [os.path.abspath(f) for f in arches_files]:
+            raise Exception("the merged file can't be one of the inputs: "\
+                "{0}".format(out_file))
+
+    resourceid, groupid = first_ids or (FIRST_RESOURCEID,FIRST_GROUPID)
+    renumberings = []
+    with ArchesWriter(out_file,max_resources,max_bytes) as arches:
+
+        ## write every resource first, so the output's shards are known
+        ## before the relations are sorted into them
+        for path in inputs:
+            arches_files, relations_files = listInputFiles(path)
+            ids = Renumbering(path,resourceid,groupid)
+            for arches_file in arches_files:
+                for line in readRows(arches_file):
+                    old_id, resource_type, attribute, rest = line.split("|",3)
+                    value, old_groupid = rest.rsplit("|",1)
+                    arches.writeRow(ids.resourceid(old_id),resource_type,
+                                    attribute,value,ids.groupid(old_groupid))
+            renumberings.append((ids,relations_files))
+            resourceid, groupid = ids.nextIds()
+
+        ## a relation may name resources of another input, they are moved
+        ## by the renumbering of the input that holds them
+        all_ids = [ids for ids, relations_files in renumberings]
+        with arches.openRelations() as relations:
+            for ids, relations_files in renumberings:
+                for path in relations_files:
+                    for line in readRows(path):
+                        id_from, id_to, start, end, rel_type, notes = \
+                            line.split("|",5)
+                        relations.writeRelation(
+                            relatedId(id_from,ids,all_ids,path),
+                            relatedId(id_to,ids,all_ids,path),
+                            rel_type,start,end,notes)
+
+    return [ids for ids, relations_files in renumberings]
+
+def makeParser():
+    """ builds the command line parser """
+    parser = argparse.ArgumentParser(description=
+            """Merges .arches files (and the .relations files next to them)
+made by separate conversions into one .arches file, renumbering the resources
+and groups of each input so their ids don't collide.""")
+
+    parser.add_argument("arches_files",nargs="+",
+                        help="paths to .arches files (compressed or not) or "\
+                        "to the .manifest files of sharded output, in the "\
+                        "order they are merged")
+
+    parser.add_argument("-o",dest="out_file",required=True,
+                        help="path of the merged .arches file, ending with "\
+                        ".gz or .zst to compress it")
+
+    parser.add_argument("-fr",dest="first_resourceid",type=int,
+                        default=FIRST_RESOURCEID,
+                        help="number of the first resource of the merged "\
+                        "file (default={0})".format(FIRST_RESOURCEID))
+
+    parser.add_argument("-fg",dest="first_groupid",type=int,
+                        default=FIRST_GROUPID,
+                        help="first groupid of the merged file "\
+                        "(default={0})".format(FIRST_GROUPID))
+
+    parser.add_argument("-sr",dest="shard_resources",type=int,
+                        help="split the output into shards of at most this "\
+                        "many resources, described by a .manifest file")
+
+    parser.add_argument("-sb",dest="shard_mb",type=float,
+                        help="split the output into shards of at most this "\
+                        "many megabytes (uncompressed), described by a "\
+                        ".manifest file")
+
+    return parser
+
+def main(argv=None):
+    """ runs the command line tool """
+    args = makeParser().parse_args(argv)
+    shard_bytes = None
+    if args.shard_mb:
+        shard_bytes = int(args.shard_mb*1024*1024)
+    renumberings = mergeArches(args.arches_files,args.out_file,
+        (args.first_resourceid,args.first_groupid),args.shard_resources,
+        shard_bytes)
+    for ids in renumberings:
+        if ids.first is None:
+            print "{0}: no resources".format(ids.path)
+            continue
+        print "{0}: {1} resources, {2}-{3} renumbered {4}-{5}".format(
+            ids.path,ids.resources,ids.first,ids.last,ids.next_resourceid,
+            ids.nextIds()[0]-1)
+    print "merged into {0}".format(args.out_file)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,369 @@
+import os
+import io
+import gzip
+import json
+import bisect
+
+## zstandard is optional, gzip is always available.  it is only imported
+## once zstd compression is asked for, to keep it out of the startup time
+zstandard = None
+
+def _loadZstandard():
+    """ imports zstandard on first use, returns None if it isn't installed """
+    global zstandard
+    if zstandard is None:
+        try:
+            import zstandard as module
+            zstandard = module
+        except ImportError:
+            pass
+    return zstandard
+
+ARCHES_HEADER = \
+    "RESOURCEID|RESOURCETYPE|ATTRIBUTENAME|ATTRIBUTEVALUE|GROUPID\r\n"
+RELATIONS_HEADER = "RESOURCEID_FROM|RESOURCEID_TO|START_DATE"\
+    "|END_DATE|RELATION_TYPE|NOTES\r\n"
+
+COMPRESSION_EXTENSIONS = {
+    "gzip":".gz",
+    "zstd":".zst"
+}
+
+class _ZstdFile(object):
+    """ minimal writable file object around a zstandard stream writer, which
+    makes sure the underlying file is closed along with the stream """
+    def __init__(self,path,mode):
+        self._fh = open(path,mode)
+        self._stream = _loadZstandard().ZstdCompressor(level=3).stream_writer(
+            self._fh)
+
+    def write(self,data):
+        self._stream.write(data)
+
+    def flush(self):
+        self._stream.flush()
+
+    def tell(self):
+        return self._fh.tell()
+
+    def close(self):
+        self._stream.close()
+        if not self._fh.closed:
+            self._fh.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self,*args):
+        self.close()
+
+def checkCompression(compression):
+    """ makes sure the requested compression is available """
+    if not compression:
+        return None
+    if not compression in COMPRESSION_EXTENSIONS:
+        raise Exception("unknown compression type: {0}".format(compression))
+    if compression == "zstd" and _loadZstandard() is None:
+        raise Exception("the zstandard package must be installed to write "\
+                        "zstd compressed output")
+    return compression
+
+def getCompression(path):
+    """ returns the compression implied by the file extension, or None """
+    ext = os.path.splitext(path)[1].lower()
+    for compression, comp_ext in COMPRESSION_EXTENSIONS.iteritems():
+        if ext == comp_ext:
+            return compression
+    return None
+
+def compressedPath(path,compression):
+    """ adds the extension for the compression type to the path """
+    if not compression:
+        return path
+    return path+COMPRESSION_EXTENSIONS[compression]
+
+def stripCompression(path):
+    """ returns the path without its compression extension, if any """
+    if getCompression(path):
+        return os.path.splitext(path)[0]
+    return path
+
+def relationsPath(arches_file):
+    """ returns the path of the .relations file that accompanies the input
+    .arches file, compressed the same way """
+    compression = getCompression(arches_file)
+    base = os.path.splitext(stripCompression(arches_file))[0]
+    return compressedPath(base+".relations",compression)
+
+def openOutput(path,mode="wb"):
+    """ opens a .arches or .relations file for writing, compressing it if the
+    path ends with .gz or .zst.  appending ("ab") adds a new gzip member or
+    zstd frame, both of which decompress as one continuous stream. """
+    compression = checkCompression(getCompression(path))
+    if compression == "gzip":
+        return gzip.open(path,mode)
+    if compression == "zstd":
+        return _ZstdFile(path,mode)
+    return open(path,mode)
+
+def openInput(path):
+    """ opens a (possibly compressed) .arches or .relations file for reading,
+    iterating it returns its lines """
+    compression = checkCompression(getCompression(path))
+    if compression == "gzip":
+        return gzip.open(path,"rb")
+    if compression == "zstd":
+        reader = zstandard.ZstdDecompressor().stream_reader(open(path,"rb"),
+            read_across_frames=True)
+        return io.BufferedReader(reader)
+    return open(path,"rb")
+
+def copyDecompressed(in_path,out_file,chunk_size=1024*1024):
+    """ streams the decompressed contents of in_path to the open out_file """
+    src = openInput(in_path)
+    try:
+        while True:
+            chunk = src.read(chunk_size)
+            if not chunk:
+                break
+            out_file.write(chunk)
+    finally:
+        src.close()
+
+def resourceNumber(resourceid):
+    """ returns the numeric part of a resourceid, which may be a plain number
+    or a dataset prefixed id such as bldg_points-100001 """
+    if isinstance(resourceid,(int,long)):
+        return resourceid
+    return int(str(resourceid).split("-")[-1])
+
+class ArchesWriter(object):
+    """ writes .arches rows, optionally split into shards that each hold at
+    most max_resources resources or max_bytes bytes (uncompressed).  shards
+    are only split between resources, each gets its own header row and is
+    named <name>_<n>.arches next to the requested path, and a <name>.manifest
+    file describes them.  resource numbers must increase in the order they
+    are written, which is how both converters assign them.  resume is the
+    state returned by checkpoint(), writing then carries on from that point
+    and anything written after it is discarded. """
+    def __init__(self,arches_file,max_resources=None,max_bytes=None,
+                 resume=None):
+        self.path = arches_file
+        self.max_resources = max_resources
+        self.max_bytes = max_bytes
+        self.sharded = bool(max_resources or max_bytes)
+        self.shards = []
+        self._starts = []
+        self._out = None
+        self._current = None
+        self._last_id = None
+        self._last_groupid = None
+        self.relations_info = None
+        if resume:
+            self._resume(resume)
+        else:
+            self._newShard()
+
+    def _shardPath(self,index,ext):
+        """ path of shard number index (1 based) with the given extension """
+        base = os.path.splitext(stripCompression(self.path))[0]
+        name = "{0}_{1}{2}".format(base,index,ext)
+        return compressedPath(name,getCompression(self.path))
+
+    def _newShard(self,first_number=None):
+        """ closes the current shard and starts the next one """
+        if self._out:
+            self._out.close()
+        if self.sharded:
+            path = self._shardPath(len(self.shards)+1,".arches")
+        else:
+            path = self.path
+        self._current = path
+        self._out = openOutput(path)
+        self._out.write(ARCHES_HEADER)
+        self.shards.append({
+            "ARCHES":os.path.basename(path),
+            "RELATIONS":os.path.basename(relationsPath(path)),
+            "RESOURCES":0,
+            "BYTES":len(ARCHES_HEADER),
+            "RELATIONS_COUNT":0
+        })
+        self._starts.append(first_number)
+
+    def writeRow(self,resourceid,resource_type,attribute,value,groupid):
+        """ writes one row, starting a new shard first if this row begins a
+        resource that would not fit in the current one """
+        shard = self.shards[-1]
+        if resourceid != self._last_id:
+            number = resourceNumber(resourceid)
+            if self.sharded and shard["RESOURCES"] > 0 and (
+                (self.max_resources and
+                 shard["RESOURCES"] >= self.max_resources) or
+                (self.max_bytes and shard["BYTES"] >= self.max_bytes)):
+                self._newShard(number)
+                shard = self.shards[-1]
+            if self._starts[-1] is None:
+                self._starts[-1] = number
+            shard["RESOURCES"] += 1
+            self._last_id = resourceid
+        self._last_groupid = groupid
+        line = "{0}|{1}|{2}|{3}|{4}\r\n".format(resourceid,resource_type,
+                                               attribute,value,groupid)
+        shard["BYTES"] += len(line)
+        self._out.write(line)
+
+    def counts(self):
+        """ returns (resource number, groupid) of the last row written, or
+        None if no rows have been written """
+        if self._last_id is None:
+            return None
+        return (resourceNumber(self._last_id),int(self._last_groupid))
+
+    def checkpoint(self):
+        """ makes sure everything written so far is on disk and returns the
+        state needed to resume writing from this point.  compressed output is
+        closed and reopened, which starts a new gzip member or zstd frame, so
+        the file can be cut back to its current size. """
+        if getCompression(self._current):
+            self._out.close()
+            size = os.path.getsize(self._current)
+            self._out = openOutput(self._current,"ab")
+        else:
+            self._out.flush()
+            os.fsync(self._out.fileno())
+            size = os.path.getsize(self._current)
+        return {
+            "PATH":os.path.basename(self._current),
+            "SIZE":size,
+            "SHARDS":[dict(shard) for shard in self.shards],
+            "STARTS":list(self._starts),
+            "LAST_ID":self._last_id,
+            "LAST_GROUPID":self._last_groupid
+        }
+
+    def _resume(self,state):
+        """ restores the state saved by checkpoint(), truncating the current
+        file back to its checkpointed size and removing any later shards """
+        self.shards = [dict(shard) for shard in state["SHARDS"]]
+        self._starts = list(state["STARTS"])
+        self._last_id = state["LAST_ID"]
+        self._last_groupid = state["LAST_GROUPID"]
+        self._current = os.path.join(os.path.dirname(self.path),state["PATH"])
+        if not os.path.isfile(self._current):
+            raise Exception("can't resume, {0} is missing".format(
+                self._current))
+        with open(self._current,"r+b") as out:
+            out.truncate(state["SIZE"])
+        if self.sharded:
+            index = len(self.shards)+1
+            while os.path.isfile(self._shardPath(index,".arches")):
+                os.remove(self._shardPath(index,".arches"))
+                index += 1
+        self._out = openOutput(self._current,"ab")
+
+    def shardFor(self,resourceid):
+        """ returns the index of the shard that holds resourceid """
+        if not self.sharded or self._starts[0] is None:
+            return 0
+        number = resourceNumber(resourceid)
+        return max(bisect.bisect_right(self._starts,number)-1,0)
+
+    def openRelations(self):
+        """ returns a RelationsWriter for the relations of these resources """
+        return RelationsWriter(self)
+
+    def writeManifest(self):
+        """ writes the manifest describing the shards, load order included """
+        if not self.sharded:
+            return None
+        base = os.path.splitext(stripCompression(self.path))[0]
+        manifest_path = base+".manifest"
+        manifest = {
+            "ARCHES_FILE":os.path.basename(self.path),
+            "SHARDS":self.shards
+        }
+        if self.relations_info:
+            manifest["CROSS_SHARD"] = self.relations_info
+        with open(manifest_path,"w") as out:
+            out.write(json.dumps(manifest,indent=4,sort_keys=True))
+        return manifest_path
+
+    def close(self):
+        if self._out:
+            self._out.close()
+            self._out = None
+        self.writeManifest()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self,*args):
+        self.close()
+
+class RelationsWriter(object):
+    """ writes relations for the resources of an ArchesWriter.  when the
+    output is sharded, a relation goes to the .relations file of the shard
+    holding both of its resources, so each shard can be loaded on its own.
+    relations between resources in different shards can't be resolved by
+    any one load, they are written to <name>_cross.relations (with an empty
+    <name>_cross.arches) and listed in the manifest. """
+    def __init__(self,arches_writer):
+        self.arches = arches_writer
+        self.count = 0
+        self._files = []
+        self._cross = None
+        if not arches_writer.sharded:
+            self._files.append(openOutput(relationsPath(arches_writer.path)))
+        else:
+            for i in range(len(arches_writer.shards)):
+                self._files.append(openOutput(
+                    arches_writer._shardPath(i+1,".relations")))
+        for rel in self._files:
+            rel.write(RELATIONS_HEADER)
+
+    def _crossFile(self):
+        """ opens the cross shard relations file (and its empty .arches) """
+        if self._cross is None:
+            arches_path = self.arches._shardPath("cross",".arches")
+            with openOutput(arches_path) as arches:
+                arches.write(ARCHES_HEADER)
+            path = relationsPath(arches_path)
+            self._cross = openOutput(path)
+            self._cross.write(RELATIONS_HEADER)
+            self.arches.relations_info = {
+                "ARCHES":os.path.basename(arches_path),
+                "RELATIONS":os.path.basename(path),
+                "RELATIONS_COUNT":0,
+                "NOTE":"relations between resources in different shards, "\
+                    "no single shard load can resolve these"
+            }
+        return self._cross
+
+    def writeRelation(self,resourceid_from,resourceid_to,relation_type,
+                      start_date="",end_date="",notes=""):
+        line = "{0}|{1}|{2}|{3}|{4}|{5}\r\n".format(resourceid_from,
+            resourceid_to,start_date,end_date,relation_type,notes)
+        self.count += 1
+        shard = self.arches.shardFor(resourceid_from)
+        if shard != self.arches.shardFor(resourceid_to):
+            self._crossFile().write(line)
+            self.arches.relations_info["RELATIONS_COUNT"] += 1
+            return
+        self._files[shard].write(line)
+        if self.arches.sharded:
+            self.arches.shards[shard]["RELATIONS_COUNT"] += 1
+
+    def close(self):
+        for rel in self._files:
+            rel.close()
+        self._files = []
+        if self._cross is not None:
+            self._cross.close()
+            self._cross = None
+        self.arches.writeManifest()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self,*args):
+        self.close()
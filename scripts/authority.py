@@ -0,0 +1,185 @@
+import os
+import re
+import unicodedata
+
+AUTHORITY_FIELDS = ['conceptid','Preflabel','altlabels','ParentConceptid',
+                    'ConceptType','Provider']
+
+## character that separates several altlabels in one cell
+ALTLABEL_SEPARATOR = ";"
+
+## indexes that have been built, keyed by path: ((mtime, size), index)
+_cache = {}
+
+class ReconcileError(Exception):
+    """ raised when a value matches no concept of an authority document, or
+    more than one.  reason is a one line description of the problem. """
+    def __init__(self,message,value,conceptids=()):
+        Exception.__init__(self,message)
+        self.value = value
+        self.conceptids = conceptids
+        if conceptids:
+            self.kind = "matches several concepts"
+            self.reason = "{0} matches several concepts: {1}".format(
+                value,", ".join(conceptids))
+        else:
+            self.kind = "not in the authority document"
+            self.reason = "{0} is not in the authority document".format(value)
+
+def toUnicode(value):
+    """ returns value as unicode, decoding byte strings as utf-8 or, failing
+    that, latin-1 """
+    if isinstance(value,unicode):
+        return value
+    if not isinstance(value,str):
+        return unicode(value)
+    try:
+        return value.decode("utf-8")
+    except UnicodeDecodeError:
+        return value.decode("latin-1")
+
+def normalizeLabel(value):
+    """ the key used for loose matching: accents removed, case folded and
+    runs of whitespace collapsed to a single space """
+    value = unicodedata.normalize("NFKD",toUnicode(value))
+    value = u"".join([c for c in value if not unicodedata.combining(c)])
+    return re.sub(r"\s+",u" ",value.lower()).strip()
+
+class AuthorityIndex(object):
+    """ the concepts of one authority document, indexed so a dataset value
+    can be reconciled with a single dictionary lookup per matching level.
+    labels is the {conceptid: Preflabel} dictionary used in messages. """
+    def __init__(self,auth_doc_path):
+        self.path = auth_doc_path
+        self.labels = {}
+        self._preflabels = {}
+        self._altlabels = {}
+        self._normal = {}
+
+        ## prefer site-packages modules, use local ones if necessary
+        try:
+            import unicodecsv
+        except:
+            import unicodecsv_local as unicodecsv
+
+        with open(auth_doc_path,'rU') as f:
+            rows = unicodecsv.DictReader(f,fieldnames=AUTHORITY_FIELDS,
+                encoding='utf-8-sig',delimiter=',',restkey='ADDITIONAL',
+                restval='MISSING')
+            rows.next()
+            for row in rows:
+                self.add(row['conceptid'],row['Preflabel'],row['altlabels'])
+
+    def add(self,conceptid,preflabel,altlabels=""):
+        """ adds one concept to the index """
+        self.labels[conceptid] = preflabel
+        self._preflabels.setdefault(preflabel.rstrip(),set()).add(conceptid)
+        keys = set([normalizeLabel(preflabel)])
+        if altlabels and altlabels != 'MISSING':
+            for alt in altlabels.split(ALTLABEL_SEPARATOR):
+                alt = alt.strip()
+                if alt == "":
+                    continue
+                self._altlabels.setdefault(alt,set()).add(conceptid)
+                keys.add(normalizeLabel(alt))
+        for key in keys:
+            self._normal.setdefault(key,set()).add(conceptid)
+
+    def lookup(self,value):
+        """ returns the sorted conceptids that value matches.  the value is
+        tried, in order, as a conceptid, a Preflabel, an altlabel, and then
+        as the normalized form of any label; the first level with a match
+        wins.  more than one conceptid means the value is ambiguous. """
+        value = toUnicode(value)
+        if value in self.labels:
+            return [value]
+        for index, key in ((self._preflabels,value.rstrip()),
+                           (self._altlabels,value.strip()),
+                           (self._normal,normalizeLabel(value))):
+            if key in index:
+                return sorted(index[key])
+        return []
+
+    def sortedConceptids(self):
+        """ the conceptids in numeric order, for listing the document """
+        def number(conceptid):
+            num = conceptid.split(":")[-1]
+            if num.isdigit():
+                return (0,int(num))
+            return (1,conceptid)
+        return sorted(self.labels.keys(),key=number)
+
+def loadAuthorityIndex(auth_doc_path):
+    """ returns the AuthorityIndex for a document, built once and reused
+    until the document changes """
+    path = os.path.abspath(auth_doc_path)
+    st = os.stat(path)
+    stamp = (st.st_mtime,st.st_size)
+    cached = _cache.get(path)
+    if cached and cached[0] == stamp:
+        return cached[1]
+    index = AuthorityIndex(path)
+    _cache[path] = (stamp,index)
+    return index
+
+class AuthorityRegistry(object):
+    """ the authority documents of a whole run, by entity name, created once
+    and shared by every dataset (and, when they are forked, every worker
+    process) of the run.  each document is indexed once, and the concepts a
+    raw value resolves to are remembered per (entity, value), so a value
+    repeated through the datasets is only reconciled once. """
+    def __init__(self,entity_auth=None):
+        self.entity_auth = {}
+        self._indexes = {}
+        self._resolved = {}
+        for entity, path in (entity_auth or {}).iteritems():
+            self.add(entity,path)
+
+    def add(self,entity,auth_doc_path):
+        """ sets the authority document of an entity, forgetting what was
+        resolved with another document """
+        path = os.path.abspath(auth_doc_path)
+        if self.entity_auth.get(entity) != path:
+            self.entity_auth[entity] = path
+            self._forget(entity)
+
+    def _forget(self,entity):
+        self._indexes.pop(entity,None)
+        for key in self._resolved.keys():
+            if key[0] == entity:
+                self._resolved.pop(key,None)
+
+    def __contains__(self,entity):
+        return entity in self.entity_auth
+
+    def index(self,entity):
+        """ the AuthorityIndex of an entity's document """
+        index = self._indexes.get(entity)
+        if index is None:
+            index = loadAuthorityIndex(self.entity_auth[entity])
+            self._indexes[entity] = index
+        return index
+
+    def lookup(self,entity,value):
+        """ the sorted conceptids (a tuple) that a value of the entity
+        matches, see AuthorityIndex.lookup """
+        key = (entity,value)
+        conceptids = self._resolved.get(key)
+        if conceptids is None:
+            conceptids = tuple(self.index(entity).lookup(value))
+            self._resolved[key] = conceptids
+        return conceptids
+
+    def load(self):
+        """ indexes every document now, before worker processes are forked
+        from this one """
+        for entity in self.entity_auth:
+            self.index(entity)
+
+    def refresh(self):
+        """ forgets what was resolved with documents that have changed on
+        disk since, for registries that outlive a single conversion """
+        for entity, path in self.entity_auth.items():
+            if entity in self._indexes and \
+               loadAuthorityIndex(path) is not self._indexes[entity]:
+                self._forget(entity)
@@ -0,0 +1,48 @@
+import os
+import json
+
+from archesio import stripCompression
+
+## number of input records converted between checkpoints
+CHECKPOINT_INTERVAL = 10000
+
+def checkpointPath(arches_file):
+    """ returns the path of the checkpoint file kept next to a .arches file """
+    return os.path.splitext(stripCompression(arches_file))[0]+".checkpoint"
+
+def readCheckpoint(path):
+    """ returns the state saved in a checkpoint file, or None if there is no
+    checkpoint to resume from """
+    if not os.path.isfile(path):
+        ## a crash between removing the old checkpoint and renaming the new
+        ## one leaves only the (complete) temporary file
+        path = path+".tmp"
+    if not os.path.isfile(path):
+        return None
+    with open(path) as cp:
+        return json.loads(cp.read())
+
+def writeCheckpoint(path,state):
+    """ saves the state of a conversion.  the state is written to a temporary
+    file that then replaces the old checkpoint, so a crash while writing it
+    leaves the previous checkpoint intact. """
+    tmp_path = path+".tmp"
+    with open(tmp_path,"w") as cp:
+        cp.write(json.dumps(state,indent=4,sort_keys=True))
+        cp.flush()
+        os.fsync(cp.fileno())
+    ## os.rename won't replace an existing file on windows
+    if os.path.isfile(path):
+        os.remove(path)
+    os.rename(tmp_path,path)
+
+def removeCheckpoint(path):
+    """ removes the checkpoint once the conversion has finished """
+    for p in (path,path+".tmp"):
+        if os.path.isfile(p):
+            os.remove(p)
+
+def checkpointDue(count,interval=CHECKPOINT_INTERVAL):
+    """ true when count records have been converted and a checkpoint should
+    be written """
+    return bool(interval) and count % interval == 0
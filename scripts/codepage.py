@@ -0,0 +1,80 @@
+import os
+import codecs
+
+## the codepages of the language driver ids (byte 29 of a .dbf header) that
+## are common in shapefiles, for .dbf files that have no .cpg file
+LDID_CODEPAGES = {
+    0x01:"cp437",
+    0x02:"cp850",
+    0x03:"cp1252",
+    0x57:"cp1252",
+    0x58:"cp1252",
+    0x59:"cp1252",
+    0x64:"cp852",
+    0x65:"cp866",
+    0x66:"cp865",
+    0x67:"cp861",
+    0x6a:"cp737",
+    0x6b:"cp857",
+    0x78:"cp950",
+    0x79:"cp949",
+    0x7a:"cp936",
+    0x7b:"cp932",
+    0x7c:"cp874",
+    0x7d:"cp1255",
+    0x7e:"cp1256",
+    0xc8:"cp1250",
+    0xc9:"cp1251",
+    0xca:"cp1254",
+    0xcb:"cp1253",
+}
+
+## .cpg names that aren't python codec names, or are windows codepage numbers
+## that python spells differently
+CPG_NAMES = {
+    "65001":"utf-8",
+    "ansi":"cp1252",
+    "oem":"cp437",
+    "28591":"latin-1",
+    "28592":"iso8859-2",
+    "28595":"iso8859-5",
+    "28605":"iso8859-15",
+    "20127":"ascii",
+}
+
+def normalizeCodepage(name):
+    """ the python codec name of a .cpg codepage such as "UTF-8", "1252",
+    "ANSI 1252" or "ISO-8859-1", or None if it isn't known """
+    name = name.strip().lower()
+    if not name:
+        return None
+    if name in CPG_NAMES:
+        name = CPG_NAMES[name]
+    else:
+        last = name.split()[-1]
+        if last.isdigit():
+            name = CPG_NAMES.get(last,"cp"+last)
+    try:
+        return codecs.lookup(name).name
+    except LookupError:
+        return None
+
+def getCodepage(shapefile_path):
+    """ the codepage of a shapefile's text fields: from its .cpg file if it
+    has one, otherwise from the language driver id of the .dbf.  returns a
+    python codec name, or None if neither says. """
+    base = os.path.splitext(shapefile_path)[0]
+    if os.path.isfile(base+".cpg"):
+        with open(base+".cpg","rb") as f:
+            codepage = normalizeCodepage(f.read())
+        if codepage:
+            return codepage
+    with open(base+".dbf","rb") as f:
+        header = f.read(32)
+    if len(header) < 30:
+        return None
+    return LDID_CODEPAGES.get(ord(header[29]))
+
+def isUtf8(codepage):
+    """ whether text in the codepage is already utf-8, as it is written """
+    return codepage is None or codepage in ("utf-8","ascii")
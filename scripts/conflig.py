@@ -0,0 +1,192 @@
+import os
+import json
+import collections
+
+## parsed conflig files, keyed by path: ((mtime, size), json, plan).  they
+## are kept for the life of the process only: a conflig is a small json file,
+## so a copy on disk would take as long to read as the file itself
+_cache = {}
+
+## a group entry whose field starts with this holds a constant instead: the
+## rest of the name is the value written for every record, as in
+## "=Primary": "NAME_TYPE.E55"
+CONSTANT_PREFIX = "="
+
+## the compiled, read-only form of a conflig file.  groups is a tuple of
+## groups, each a tuple of (field name, entity name) pairs, fields lists the
+## mapped field of every pair that isn't a constant and entities the
+## distinct entity names.
+ConfligPlan = collections.namedtuple("ConfligPlan",["path","resource_type",
+    "geom_type","dataset_path","groups","fields","entities"])
+
+def _stamp(conflig_path):
+    """ the modification time and size that identify a version of the file """
+    st = os.stat(conflig_path)
+    return (st.st_mtime,st.st_size)
+
+def isConstant(field):
+    """ whether a group entry holds a constant value rather than a field """
+    return field.startswith(CONSTANT_PREFIX)
+
+def constantValue(field):
+    """ the value of a constant group entry """
+    return field[len(CONSTANT_PREFIX):].strip()
+
+def readConflig(conflig_path):
+    """ returns the parsed json of a .conflig file.  the result is cached
+    until the file changes, so treat it as read-only. """
+    path = os.path.abspath(conflig_path)
+    if not os.path.isfile(path):
+        raise Exception("conflig file not found: {0}".format(conflig_path))
+    stamp = _stamp(path)
+    cached = _cache.get(path)
+    if cached and cached[0] == stamp:
+        return cached[1]
+
+    with open(path) as con:
+        config_contents = con.read()
+    try:
+        config_json = json.loads(config_contents)
+    except ValueError as e:
+        raise Exception("""
+  This conflig file is not valid JSON.
+    CONFLIG: {0}
+    PROBLEM: {1}""".format(conflig_path,e))
+
+    _cache[path] = (stamp,config_json,None)
+    return config_json
+
+def compilePlan(conflig_path,config_json):
+    """ checks the structure of the conflig json and returns its plan """
+    problems = []
+    for key in ("RESOURCE_TYPE","FIELD_MAP"):
+        if not key in config_json:
+            problems.append("missing {0}".format(key))
+    field_map = config_json.get("FIELD_MAP",[])
+    if not isinstance(field_map,list):
+        problems.append("FIELD_MAP is not a list of groups")
+        field_map = []
+
+    groups = []
+    for item in field_map:
+        if not isinstance(item,dict):
+            problems.append("FIELD_MAP entry is not a group: {0}".format(item))
+            continue
+        for name, group in item.iteritems():
+            if not isinstance(group,dict) or len(group) == 0:
+                problems.append("{0} has no field:entity entries".format(name))
+                continue
+            pairs = []
+            for field, entity in group.iteritems():
+                if not isinstance(entity,basestring) or entity == "":
+                    problems.append("{0} maps {1} to no entity".format(
+                        name,field))
+                    continue
+                if isConstant(field) and constantValue(field) == "":
+                    problems.append("{0} has an empty constant for {1}"\
+                        .format(name,entity))
+                    continue
+                pairs.append((field,entity))
+            groups.append(tuple(pairs))
+
+    if problems:
+        raise Exception("""
+  This conflig file is not correctly formed.
+    CONFLIG: {0}
+    PROBLEMS:
+      {1}""".format(conflig_path,"\n      ".join(problems)))
+
+    fields = tuple([f for group in groups for f, e in group
+                    if not isConstant(f)])
+    entities = []
+    for group in groups:
+        for f, e in group:
+            if not e in entities:
+                entities.append(e)
+
+    return ConfligPlan(
+        path=os.path.abspath(conflig_path),
+        resource_type=config_json["RESOURCE_TYPE"],
+        geom_type=config_json.get("GEOM_TYPE"),
+        dataset_path=config_json.get("DATASET_PATH"),
+        groups=tuple(groups),
+        fields=fields,
+        entities=tuple(entities)
+    )
+
+def loadConflig(conflig_path):
+    """ returns the compiled ConfligPlan of a .conflig file.  the file is
+    parsed and checked once, later calls return the cached plan until the
+    file is modified. """
+    config_json = readConflig(conflig_path)
+    path = os.path.abspath(conflig_path)
+    stamp, config_json, plan = _cache[path]
+    if plan is None:
+        plan = compilePlan(conflig_path,config_json)
+        _cache[path] = (stamp,config_json,plan)
+    return plan
+
+def validatePlan(plan,dataset_fields=None,entity_auth=None,graph_index=None,
+                 auth_registry=None):
+    """ checks a plan against the things it refers to, before any conversion
+    starts: the mapped fields must be in dataset_fields, type (E55) entities
+    must have an authority document in entity_auth (entity name: document
+    path), the constant values of those entities must match one concept of
+    their document in auth_registry (the authority.AuthorityRegistry of the
+    run), and every group must fit the resource graph of the plan's resource
+    type in graph_index (see resourcegraph.loadGraphIndex).  checks whose
+    information is not given are skipped.  all problems are reported
+    together. """
+
+    problems = []
+    if dataset_fields is not None:
+        for field in plan.fields:
+            if not field in dataset_fields:
+                problems.append("field not in dataset: {0}".format(field))
+
+    if entity_auth is not None:
+        for entity in plan.entities:
+            if not entity.endswith(".E55"):
+                continue
+            if not entity in entity_auth:
+                problems.append("no authority document listed for {0}".format(
+                    entity))
+            elif not os.path.isfile(entity_auth[entity]):
+                problems.append("authority document for {0} not found: "\
+                    "{1}".format(entity,os.path.basename(entity_auth[entity])))
+
+    ## constants are reconciled once here rather than for every record, and
+    ## the registry remembers what they resolve to for the conversion
+    if auth_registry is not None:
+        for group in plan.groups:
+            for field, entity in group:
+                if not isConstant(field) or not entity in auth_registry or \
+                   not os.path.isfile(auth_registry.entity_auth[entity]):
+                    continue
+                value = constantValue(field)
+                conceptids = auth_registry.lookup(entity,value)
+                if not conceptids:
+                    problems.append("constant {0} is not in the authority "\
+                        "document for {1}".format(value,entity))
+                elif len(conceptids) > 1:
+                    problems.append("constant {0} matches several concepts "\
+                        "of {1}: {2}".format(value,entity,
+                        ", ".join(conceptids)))
+
+    if graph_index is not None:
+        if not plan.resource_type in graph_index:
+            problems.append("no resource graph for {0}".format(
+                plan.resource_type))
+        else:
+            from resourcegraph import checkGroups
+            problems += checkGroups(graph_index[plan.resource_type],
+                                    plan.groups)
+
+    if problems:
+        raise Exception("""
+  The conflig file below does not match its dataset, authority documents or
+  resource graph.  Fix these problems before trying again.
+    CONFLIG: {0}
+    PROBLEMS:
+      {1}""".format(plan.path,"\n      ".join(problems)))
+    return True
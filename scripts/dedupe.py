@@ -0,0 +1,96 @@
+import os
+import csv
+import math
+
+## meters in a degree of latitude, and in a degree of longitude at the equator
+METERS_PER_DEGREE = 111320.0
+
+## columns of the duplicates report
+REPORT_FIELDS = ["DATASET","RECORD","DUPLICATE_OF_DATASET",
+                 "DUPLICATE_OF_RECORD","DISTANCE_M"]
+
+class DuplicateIndex(object):
+    """ finds the features that duplicate one seen before: points within
+    tolerance meters of an earlier point, or lines or polygons whose bounding
+    box edges are all within tolerance meters of those of an earlier feature
+    of the same shape type.  features are hashed onto a grid of cells
+    tolerance meters wide by their point or bounding box centre, so each is
+    only compared with the features in its own cell and the eight around it,
+    and the whole check takes time linear in the number of features.
+    coordinates are WGS84 degrees, and distances are measured in meters
+    about each feature. """
+    def __init__(self,tolerance):
+        if not tolerance or tolerance <= 0:
+            raise Exception("the duplicate tolerance must be more than 0")
+        self.tolerance = float(tolerance)
+        self.cells = {}
+        self.found = []
+
+    def _column(self,x,row):
+        """ the grid column of longitude x in a row of the grid.  columns are
+        tolerance meters wide at the middle of the row, so a feature is
+        always looked for with the scale it was hashed with. """
+        lat = (row+0.5)*self.tolerance/METERS_PER_DEGREE
+        kx = METERS_PER_DEGREE*math.cos(math.radians(lat))
+        return int(math.floor(x*kx/self.tolerance))
+
+    def check(self,key,shp_type,box):
+        """ returns the key of the nearest earlier feature that this one
+        duplicates, given its (xmin, ymin, xmax, ymax) box, or None after
+        adding it to the index.  a duplicate isn't added, so later features
+        are only ever matched to ones that are kept. """
+        x, y = (box[0]+box[2])/2.0, (box[1]+box[3])/2.0
+        row = int(math.floor(y*METERS_PER_DEGREE/self.tolerance))
+        kx = METERS_PER_DEGREE*math.cos(math.radians(y))
+        ky = METERS_PER_DEGREE
+
+        best, best_distance = None, None
+        for r in (row-1,row,row+1):
+            col = self._column(x,r)
+            for c in (col-1,col,col+1):
+                for other_key, other_type, o in self.cells.get((r,c),()):
+                    if other_type != shp_type:
+                        continue
+                    if shp_type == "POINT":
+                        distance = math.hypot((box[0]-o[0])*kx,
+                                              (box[1]-o[1])*ky)
+                    else:
+                        distance = max(abs(box[0]-o[0])*kx,
+                                       abs(box[2]-o[2])*kx,
+                                       abs(box[1]-o[1])*ky,
+                                       abs(box[3]-o[3])*ky)
+                    if distance > self.tolerance:
+                        continue
+                    if best is None or distance < best_distance:
+                        best, best_distance = other_key, distance
+        if best is not None:
+            self.found.append((key,best,best_distance))
+            return best
+        self.cells.setdefault((row,self._column(x,row)),[]).append(
+            (key,shp_type,box))
+        return None
+
+    def writeReport(self,path):
+        """ writes each duplicate found, with the feature it duplicates and
+        how far apart they are, to a csv file.  keys are (dataset, record)
+        tuples.  an earlier report is removed if nothing was found. """
+        if not self.found:
+            if os.path.isfile(path):
+                os.remove(path)
+            return
+        with open(path,"wb") as f:
+            writer = csv.writer(f)
+            writer.writerow(REPORT_FIELDS)
+            for key, original, distance in self.found:
+                writer.writerow(list(key)+list(original)+
+                                ["{0:.2f}".format(distance)])
+
+    def summary(self):
+        """ lines that sum up the duplicates found, by dataset """
+        counts = {}
+        for key, original, distance in self.found:
+            counts[key[0]] = counts.get(key[0],0)+1
+        lines = ["{0} duplicate resources found".format(len(self.found))]
+        for dataset, count in sorted(counts.iteritems()):
+            lines.append("  {0} in {1}".format(count,dataset))
+        return lines
@@ -0,0 +1,130 @@
+import struct
+import collections
+
+## number of records converted to measure the rows and bytes per resource
+SAMPLE_SIZE = 1000
+
+## records read from the .dbf at a time when scanning key columns
+_BLOCK_RECORDS = 4096
+
+def readShxCount(shx_path):
+    """ the number of records in a shapefile, from the file length in the
+    .shx header.  after the 100 byte header each record has an 8 byte entry,
+    and the length is given in 16 bit words. """
+    with open(shx_path,"rb") as f:
+        header = f.read(100)
+    words = struct.unpack(">i",header[24:28])[0]
+    return (words*2-100)//8
+
+def readDbfHeader(dbf_path):
+    """ returns (number of records, header length, record length, fields)
+    from the header of a .dbf file.  fields is a list of (name, type, size,
+    decimal, offset) tuples, offset being where the field starts within a
+    record (after the deletion flag). """
+    with open(dbf_path,"rb") as f:
+        num_records, header_length, record_length = struct.unpack(
+            "<4xLHH20x",f.read(32))
+        fields = []
+        offset = 1
+        for i in range((header_length-33)//32):
+            desc = f.read(32)
+            if desc[:1] == "\r":
+                break
+            name, typ, size, decimal = struct.unpack("<11sc4xBB14x",desc)
+            fields.append((name.split("\0")[0].strip(),typ,size,decimal,
+                           offset))
+            offset += size
+    return num_records, header_length, record_length, fields
+
+def dbfKey(raw,typ,decimal):
+    """ turns the raw bytes of a .dbf field into the key that is related on,
+    or None if it is blank.  values are read the way the shapefile reader
+    does, so keys that only differ in padding are the same: only N fields
+    are parsed as numbers, and one filled with NULs is 0. """
+    if raw.strip() == "":
+        return None
+    if typ == "N":
+        value = raw.replace("\0","").strip()
+        if value == "":
+            return 0
+        try:
+            if decimal:
+                return float(value)
+            return int(value)
+        except ValueError:
+            return value
+    return raw.strip()
+
+def iterDbfColumns(dbf_path,field_names):
+    """ yields a tuple with the keys of the named fields for every record
+    that isn't deleted.  the .dbf is read in large blocks and only those
+    fields are sliced out of each record, the rest is never decoded. """
+    num_records, header_length, record_length, fields = \
+        readDbfHeader(dbf_path)
+    by_name = dict([(f[0],f) for f in fields])
+    missing = [name for name in field_names if not name in by_name]
+    if missing:
+        raise Exception("fields not in {0}: {1}".format(dbf_path,
+                        ", ".join(missing)))
+    columns = [by_name[name] for name in field_names]
+
+    with open(dbf_path,"rb") as f:
+        f.seek(header_length)
+        left = num_records
+        while left > 0:
+            count = min(left,_BLOCK_RECORDS)
+            left -= count
+            block = f.read(count*record_length)
+            for start in xrange(0,len(block)-record_length+1,record_length):
+                if block[start] != " ":
+                    continue
+                yield tuple([dbfKey(block[start+offset:start+offset+size],
+                                    typ,decimal)
+                             for name, typ, size, decimal, offset in columns])
+
+def bucketHistogram(key_counts):
+    """ returns {bucket size: number of keys}, given {key: resources} """
+    return collections.Counter(key_counts.itervalues())
+
+def pairCount(histogram):
+    """ the number of relations made by relating every pair of resources
+    that share a key, given the bucket size histogram """
+    return sum([keys*size*(size-1)//2 for size, keys in histogram.iteritems()])
+
+def joinCount(src_counts,tgt_counts,same_record=0):
+    """ the number of relations made by joining one key index to another:
+    every source resource to every target resource with the same key, less
+    same_record, the resources whose two keys match each other """
+    total = 0
+    for key, count in src_counts.iteritems():
+        if key in tgt_counts:
+            total += count*tgt_counts[key]
+    return total-same_record
+
+def histogramBins(histogram):
+    """ groups a bucket size histogram into power of two ranges for display,
+    returns (low, high, keys, resources, relations) tuples """
+    bins = collections.OrderedDict()
+    for size in sorted(histogram):
+        low = 1
+        while low*2 <= size:
+            low *= 2
+        b = bins.setdefault(low,[0,0,0,0])
+        b[0] = max(b[0],size)
+        b[1] += histogram[size]
+        b[2] += histogram[size]*size
+        b[3] += histogram[size]*size*(size-1)//2
+    return [(low,high,keys,resources,relations) for low,
+            (high,keys,resources,relations) in bins.iteritems()]
+
+def formatBytes(num):
+    """ a byte count in the largest unit that keeps it above one """
+    for unit in ("bytes","KB","MB","GB"):
+        if num < 1024:
+            break
+        num /= 1024.0
+    else:
+        unit = "TB"
+    if unit == "bytes":
+        return "{0} bytes".format(int(num))
+    return "{0:.1f} {1}".format(num,unit)
@@ -0,0 +1,176 @@
+import re
+import datetime
+
+from codepage import isUtf8
+
+## entities whose values are dates, written as YYYY-MM-DD
+DATE_ENTITY_SUFFIX = ".E49"
+
+## arcpy field types and the dbf field type their values are read like
+CURSOR_TYPES = {
+    "String":"C",
+    "GUID":"C",
+    "GlobalID":"C",
+    "OID":"N",
+    "Integer":"N",
+    "SmallInteger":"N",
+    "Double":"F",
+    "Single":"F",
+    "Date":"D",
+}
+
+## date text that can be turned into YYYY-MM-DD: year first (with or without
+## separators, and possibly a time after it), or month/day/year
+_YEAR_FIRST = re.compile(
+    r"^(\d{4})[-/.]?(\d{1,2})[-/.]?(\d{1,2})(?:[ T].*)?$")
+_MONTH_FIRST = re.compile(r"^(\d{1,2})/(\d{1,2})/(\d{4})$")
+
+## each formatter takes a value as read from the .dbf or cursor, and returns
+## the text written to the .arches file, or None if the value is blank
+
+def formatText(value):
+    """ text read from a .dbf, written as it is """
+    if value is None or value.rstrip() == "":
+        return None
+    return value
+
+def makeTextFormatter(codepage):
+    """ returns a formatter for text read from a .dbf in another codepage,
+    written as utf-8: each value is decoded once and encoded once """
+    def formatCodepageText(value):
+        if value is None or value.rstrip() == "":
+            return None
+        return value.decode(codepage,"replace").encode("utf8")
+    return formatCodepageText
+
+def formatUnicode(value):
+    """ text read by a cursor, written as utf-8 """
+    if value is None or value.rstrip() == u"":
+        return None
+    if isinstance(value,unicode):
+        return value.encode("utf8")
+    return value
+
+def _blank(value):
+    """ the stripped text of a number the reader left as text, or None """
+    value = value.replace("\0","").strip()
+    return value or None
+
+def formatInteger(value):
+    """ whole numbers """
+    if value is None:
+        return None
+    if isinstance(value,basestring):
+        return _blank(value)
+    return str(int(value))
+
+def makeDecimalFormatter(decimal):
+    """ returns a formatter for numbers with a fixed number of decimal places
+    (a .dbf N field), written with those places as they are in the .dbf """
+    def formatDecimal(value):
+        if value is None:
+            return None
+        if isinstance(value,basestring):
+            return _blank(value)
+        return "%.*f" % (decimal,value)
+    return formatDecimal
+
+def formatReal(value):
+    """ floating point numbers, whole numbers written without a decimal
+    point and others with as few digits as give back the same number """
+    if value is None:
+        return None
+    if isinstance(value,basestring):
+        return _blank(value)
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(value)
+
+def formatDate(value):
+    """ dates, as YYYY-MM-DD.  the .dbf reader gives [year, month, day] (or
+    the text, if it isn't a date), cursors give datetimes, which keep their
+    time of day if they have one. """
+    if value is None:
+        return None
+    if isinstance(value,list):
+        return "%04d-%02d-%02d" % tuple(value)
+    if isinstance(value,datetime.datetime):
+        if value.time() == datetime.time():
+            return value.date().isoformat()
+        return value.isoformat(" ")
+    if isinstance(value,datetime.date):
+        return value.isoformat()
+    return _blank(value)
+
+def formatLogical(value):
+    """ .dbf logical fields, read as T or F, or ? if not set """
+    if value is None or value == "?" or value.strip() == "":
+        return None
+    return value
+
+def makeConstant(value):
+    """ returns a formatter that writes the same value whatever it is given,
+    for the constant entries of a conflig group """
+    def formatConstant(ignored):
+        return value
+    return formatConstant
+
+def isoDate(text):
+    """ returns the YYYY-MM-DD form of date text, or the text as it is if it
+    isn't a date this recognizes """
+    match = _YEAR_FIRST.match(text.strip())
+    if match:
+        year, month, day = match.groups()
+    else:
+        match = _MONTH_FIRST.match(text.strip())
+        if not match:
+            return text
+        month, day, year = match.groups()
+    try:
+        return datetime.date(int(year),int(month),int(day)).isoformat()
+    except ValueError:
+        return text
+
+def _dateEntity(formatter):
+    """ wraps a formatter so dates it writes are YYYY-MM-DD """
+    def formatDateEntity(value):
+        text = formatter(value)
+        if text is None:
+            return None
+        return isoDate(text)
+    return formatDateEntity
+
+def makeFormatter(field_type,decimal=0,entity="",cursor=False,codepage=None):
+    """ returns the formatter for the values of one field, chosen once for
+    the field rather than for every value.  field_type is the .dbf field
+    type (C, N, F, D or L), or with cursor the arcpy field type, decimal the
+    number of decimal places of a .dbf N field.  .dbf text in a codepage
+    other than utf-8 (see codepage.getCodepage) is recoded to utf-8, text
+    that already is utf-8 is written as it is.  the values of date (E49)
+    entities are written as YYYY-MM-DD whatever the field type. """
+    if cursor:
+        field_type = CURSOR_TYPES.get(field_type,"C")
+        if field_type == "C":
+            formatter = formatUnicode
+        elif field_type == "N":
+            formatter = formatInteger
+        elif field_type == "F":
+            formatter = formatReal
+        else:
+            formatter = formatDate
+    elif field_type == "N":
+        formatter = makeDecimalFormatter(decimal) if decimal else \
+            formatInteger
+    elif field_type == "D":
+        formatter = formatDate
+    elif field_type == "L":
+        formatter = formatLogical
+    elif field_type == "C" and not isUtf8(codepage):
+        formatter = makeTextFormatter(codepage)
+    else:
+        ## F fields, like C fields, are read as text
+        formatter = formatText
+
+    if entity.endswith(DATE_ENTITY_SUFFIX):
+        formatter = _dateEntity(formatter)
+    return formatter
@@ -0,0 +1,289 @@
+import math
+
+from conflig import readConflig
+
+## boxes that would be listed in more cells than this are kept apart from the
+## grid of a BoxGrid and returned by every query
+MAX_BOX_CELLS = 64
+
+def getGeometryOptions(conflig_path,precision=None,tolerance=None):
+    """ reads the optional GEOMETRY entry of a .conflig file, returns
+    (precision, tolerance, remove duplicates).  for example:
+        "GEOMETRY": {
+            "PRECISION": 6,
+            "TOLERANCE": 0.000001,
+            "REMOVE_DUPLICATES": true
+        }
+    PRECISION is the number of decimal places written for each coordinate,
+    TOLERANCE is the Douglas-Peucker simplification tolerance in map units.
+    duplicate vertices are removed whenever either of the others is set.
+    precision and tolerance, if given, override the conflig file, and turn
+    on the removal of duplicates. """
+
+    options = readConflig(conflig_path).get("GEOMETRY",{})
+    if precision is not None or tolerance is not None:
+        if precision is None:
+            precision = options.get("PRECISION")
+        if tolerance is None:
+            tolerance = options.get("TOLERANCE")
+        return (precision,tolerance,True)
+    precision = options.get("PRECISION")
+    tolerance = options.get("TOLERANCE")
+    dedupe = options.get("REMOVE_DUPLICATES",
+                         precision is not None or tolerance is not None)
+    return (precision,tolerance,dedupe)
+
+def formatNumber(value,precision=None):
+    """ formats a coordinate with at most precision decimal places, without
+    trailing zeros.  with no precision the full str() value is written. """
+    if precision is None:
+        return str(value)
+    text = "%.*f" % (precision,value)
+    if "." in text:
+        text = text.rstrip("0").rstrip(".")
+    if text == "-0":
+        text = "0"
+    return text
+
+def removeDuplicates(points):
+    """ drops vertices that repeat the vertex before them """
+    if len(points) < 2:
+        return points
+    result = [points[0]]
+    for p in points[1:]:
+        last = result[-1]
+        if p[0] != last[0] or p[1] != last[1]:
+            result.append(p)
+    return result
+
+def simplifyPoints(points,tolerance):
+    """ Douglas-Peucker simplification of a list of (x, y) points.  the end
+    points are always kept, and the work is done with an explicit stack so
+    very long lines don't hit the recursion limit. """
+
+    n = len(points)
+    if not tolerance or n < 3:
+        return points
+
+    keep = [False]*n
+    keep[0] = keep[-1] = True
+    tol2 = float(tolerance)*tolerance
+    stack = [(0,n-1)]
+    while stack:
+        first, last = stack.pop()
+        ax, ay = points[first][0], points[first][1]
+        dx, dy = points[last][0]-ax, points[last][1]-ay
+        seg2 = dx*dx+dy*dy
+        max_d, index = 0.0, None
+        for i in xrange(first+1,last):
+            px, py = points[i][0]-ax, points[i][1]-ay
+            if seg2 == 0:
+                d = px*px+py*py
+            else:
+                t = (px*dx+py*dy)/seg2
+                if t < 0:
+                    t = 0.0
+                elif t > 1:
+                    t = 1.0
+                ex, ey = t*dx-px, t*dy-py
+                d = ex*ex+ey*ey
+            if d > max_d:
+                max_d, index = d, i
+        if index is not None and max_d > tol2:
+            keep[index] = True
+            stack.append((first,index))
+            stack.append((index,last))
+
+    return [p for p, k in zip(points,keep) if k]
+
+def roundPoints(points,precision):
+    """ rounds every coordinate to precision decimal places """
+    return [(round(p[0],precision),round(p[1],precision)) for p in points]
+
+def thinPoints(points,precision=None,tolerance=None,dedupe=False,ring=False):
+    """ post-processes the vertices of one path or ring before encoding:
+    duplicate removal, simplification, then rounding (which can create new
+    duplicates, so those are removed again).  rings are never thinned below
+    four vertices, the smallest valid closed ring. """
+
+    if precision is None and not tolerance and not dedupe:
+        return points
+
+    result = [(p[0],p[1]) for p in points]
+    if dedupe or tolerance:
+        result = removeDuplicates(result)
+    if tolerance:
+        result = simplifyPoints(result,tolerance)
+    if precision is not None:
+        result = roundPoints(result,precision)
+        if dedupe:
+            result = removeDuplicates(result)
+
+    if ring and len(result) < 4:
+        return [(p[0],p[1]) for p in points]
+    return result
+
+def formatPoints(points,precision=None):
+    """ returns the "x y, x y, ..." text for a list of points """
+    return ", ".join([formatNumber(p[0],precision)+" "+
+                      formatNumber(p[1],precision) for p in points])
+
+def splitParts(shape):
+    """ returns the points of a pyshp shape as a list of parts """
+    parts = list(getattr(shape,"parts",[0]) or [0])
+    ends = parts[1:]+[len(shape.points)]
+    return [shape.points[start:end] for start, end in zip(parts,ends)]
+
+def signedArea(ring):
+    """ the signed area of a ring (the shoelace formula), positive if the
+    ring runs counter-clockwise and negative if it runs clockwise """
+    area = 0.0
+    x0, y0 = ring[-1][0], ring[-1][1]
+    for p in ring:
+        area += x0*p[1]-p[0]*y0
+        x0, y0 = p[0], p[1]
+    return area/2.0
+
+def ringBounds(ring):
+    """ the (xmin, ymin, xmax, ymax) bounding box of a list of points """
+    xs = [p[0] for p in ring]
+    ys = [p[1] for p in ring]
+    return (min(xs),min(ys),max(xs),max(ys))
+
+def boxContains(outer,inner):
+    """ whether bounding box outer holds all of bounding box inner """
+    return outer[0] <= inner[0] and outer[1] <= inner[1] and \
+           outer[2] >= inner[2] and outer[3] >= inner[3]
+
+def pointInRing(x,y,ring):
+    """ even-odd ray casting test of whether x, y is inside a ring """
+    inside = False
+    x0, y0 = ring[-1][0], ring[-1][1]
+    for p in ring:
+        x1, y1 = p[0], p[1]
+        if (y1 > y) != (y0 > y) and x < (x0-x1)*(y-y1)/(y0-y1)+x1:
+            inside = not inside
+        x0, y0 = x1, y1
+    return inside
+
+class BoxGrid(object):
+    """ a uniform grid over a list of bounding boxes, for finding the boxes
+    that may hold a point without testing every box.  each box is listed in
+    the cells it overlaps, cell_size defaults to about one cell per box, and
+    boxes that would take more than MAX_BOX_CELLS cells are returned by every
+    query instead. """
+    def __init__(self,boxes,cell_size=None):
+        self.cells = {}
+        self.large = []
+        self.items = []
+        self.cell_size = cell_size or 1.0
+        if not boxes:
+            return
+        if cell_size is None:
+            span = max(max([b[2] for b in boxes])-min([b[0] for b in boxes]),
+                       max([b[3] for b in boxes])-min([b[1] for b in boxes]))
+            self.cell_size = span/math.sqrt(len(boxes)) or 1.0
+        for i, box in enumerate(boxes):
+            self.add(i,box)
+
+    def cell(self,x,y):
+        """ the (column, row) of the cell holding x, y """
+        return (int(math.floor(x/self.cell_size)),
+                int(math.floor(y/self.cell_size)))
+
+    def add(self,item,box):
+        self.items.append(item)
+        x0, y0 = self.cell(box[0],box[1])
+        x1, y1 = self.cell(box[2],box[3])
+        if (x1-x0+1)*(y1-y0+1) > MAX_BOX_CELLS:
+            self.large.append(item)
+            return
+        for cx in xrange(x0,x1+1):
+            for cy in xrange(y0,y1+1):
+                self.cells.setdefault((cx,cy),[]).append(item)
+
+    def query(self,x,y):
+        """ the items whose boxes may hold x, y """
+        return self.cells.get(self.cell(x,y),[])+self.large
+
+    def queryBox(self,box):
+        """ the items whose boxes may overlap box, each once """
+        x0, y0 = self.cell(box[0],box[1])
+        x1, y1 = self.cell(box[2],box[3])
+        if (x1-x0+1)*(y1-y0+1) > MAX_BOX_CELLS:
+            return set(self.items)
+        items = set(self.large)
+        for cx in xrange(x0,x1+1):
+            for cy in xrange(y0,y1+1):
+                items.update(self.cells.get((cx,cy),()))
+        return items
+
+def groupRings(rings):
+    """ groups the rings of a shapefile polygon into polygons, each a list of
+    rings with the outer ring first.  shapefile outer rings run clockwise and
+    holes counter-clockwise, which the signed area tells apart.  each hole
+    goes with the smallest outer ring that holds it.  outer rings whose
+    bounding box doesn't hold the hole's are passed over with a grid, and
+    the point-in-ring test is only needed if more than one is left.  a hole
+    that no outer ring holds is written as a polygon of its own. """
+
+    shells, holes = [], []
+    for ring in rings:
+        area = signedArea(ring)
+        if area > 0:
+            holes.append(ring)
+        else:
+            shells.append((-area,ring))
+    if not holes or not shells:
+        return [[ring] for area, ring in shells]+[[ring] for ring in holes]
+    if len(shells) == 1:
+        return [[shells[0][1]]+holes]
+
+    ## smallest first, so nested islands get the holes inside them
+    shells.sort(key=lambda shell: shell[0])
+    polygons = [[ring] for area, ring in shells]
+    bounds = [ringBounds(ring) for area, ring in shells]
+    grid = BoxGrid(bounds)
+    for hole in holes:
+        box = ringBounds(hole)
+        x, y = hole[0][0], hole[0][1]
+        candidates = sorted([i for i in grid.query(x,y)
+                             if boxContains(bounds[i],box)])
+        if len(candidates) > 1:
+            ## a hole's vertex may touch its outer ring, so if no ring
+            ## holds it the smallest box is the best guess
+            candidates = [i for i in candidates
+                          if pointInRing(x,y,polygons[i][0])] or candidates
+        if candidates:
+            polygons[candidates[0]].append(hole)
+        else:
+            polygons.append([hole])
+    return polygons
+
+def partsToWKT(shp_type,parts,precision=None):
+    """ encodes nested coordinates as WKT.  for POINT, parts is a list of
+    points; for POLYLINE a list of paths; for POLYGON a list of polygons,
+    each a list of rings with the outer ring first. """
+
+    if shp_type == "POINT":
+        if len(parts) == 1:
+            return "POINT ({0})".format(formatPoints(parts,precision))
+        return "MULTIPOINT ({0})".format(", ".join(["({0})".format(
+            formatPoints([p],precision)) for p in parts]))
+
+    if shp_type == "POLYLINE":
+        paths = ["({0})".format(formatPoints(path,precision))
+                 for path in parts]
+        if len(paths) == 1:
+            return "LINESTRING {0}".format(paths[0])
+        return "MULTILINESTRING ({0})".format(", ".join(paths))
+
+    if shp_type == "POLYGON":
+        polygons = ["({0})".format(", ".join(["({0})".format(formatPoints(
+            ring,precision)) for ring in polygon])) for polygon in parts]
+        if len(polygons) == 1:
+            return "POLYGON {0}".format(polygons[0])
+        return "MULTIPOLYGON ({0})".format(", ".join(polygons))
+
+    raise Exception("{0} shapetype not supported at this time".format(
+        shp_type))
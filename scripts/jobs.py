@@ -0,0 +1,120 @@
+import os
+import json
+
+## first ids of the first job, the same as those of a single conversion
+FIRST_RESOURCEID = 100000
+FIRST_GROUPID = 300000
+
+## settings a job (or DEFAULTS) may have, with the types allowed for each
+JOB_SETTINGS = {
+    "SHAPEFILE":basestring,
+    "CONFLIG":basestring,
+    "OUTPUT":basestring,
+    "RELATE_FIELD":basestring,
+    "RELATION_TYPE":basestring,
+    "RELATE_MEMORY":int,
+    "COMPRESSION":basestring,
+    "SHARD_RESOURCES":int,
+    "SHARD_MB":(int,float),
+    "PRECISION":int,
+    "TOLERANCE":(int,float),
+    "PIPELINED":bool,
+    "QUARANTINE":bool,
+}
+
+## settings that are paths, relative to the job file's directory
+PATH_SETTINGS = ("SHAPEFILE","CONFLIG","OUTPUT")
+
+def readJobFile(job_path):
+    """ returns the parsed contents of a .json or .yaml/.yml job file """
+    if not os.path.isfile(job_path):
+        raise Exception("job file not found: {0}".format(job_path))
+    with open(job_path) as f:
+        contents = f.read()
+    try:
+        if os.path.splitext(job_path)[1].lower() in (".yaml",".yml"):
+            ## yaml job files need PyYAML, json ones don't
+            try:
+                import yaml
+            except ImportError:
+                raise Exception("reading .yaml job files requires PyYAML")
+            return yaml.safe_load(contents)
+        return json.loads(contents)
+    except ValueError as e:
+        raise Exception("""
+  This job file can not be read.
+    JOB FILE: {0}
+    PROBLEM: {1}""".format(job_path,e))
+
+def loadJobFile(job_path):
+    """ reads and checks a job file, and returns its list of jobs.  the file
+    holds a JOBS list, each job a dictionary of JOB_SETTINGS with at least a
+    SHAPEFILE, and optionally DEFAULTS that every job starts from.  relative
+    paths are made absolute from the job file's directory. """
+
+    contents = readJobFile(job_path)
+    base_dir = os.path.dirname(os.path.abspath(job_path))
+
+    problems = []
+    if not isinstance(contents,dict) or \
+       not isinstance(contents.get("JOBS"),list):
+        contents = {"JOBS":[]}
+        problems.append("the file must hold a JOBS list")
+    defaults = contents.get("DEFAULTS",{})
+    if not isinstance(defaults,dict):
+        problems.append("DEFAULTS is not a dictionary of settings")
+        defaults = {}
+
+    jobs = []
+    for num, item in enumerate(contents["JOBS"],1):
+        if not isinstance(item,dict):
+            problems.append("job {0} is not a dictionary of settings".format(
+                num))
+            continue
+        job = dict(defaults)
+        job.update(item)
+        for key, value in sorted(job.iteritems()):
+            if not key in JOB_SETTINGS:
+                problems.append("job {0}: unknown setting {1}".format(num,key))
+            elif value is not None and \
+                 not isinstance(value,JOB_SETTINGS[key]):
+                problems.append("job {0}: {1} has the wrong type".format(
+                    num,key))
+            elif key in PATH_SETTINGS and value:
+                job[key] = os.path.normpath(os.path.join(base_dir,value))
+        if not job.get("SHAPEFILE"):
+            problems.append("job {0} has no SHAPEFILE".format(num))
+        jobs.append(job)
+
+    outputs = {}
+    for num, job in enumerate(jobs,1):
+        if not job.get("SHAPEFILE"):
+            continue
+        output = job.get("OUTPUT") or \
+                 os.path.splitext(job["SHAPEFILE"])[0]+".arches"
+        if output in outputs:
+            problems.append("jobs {0} and {1} write the same output".format(
+                outputs[output],num))
+        outputs[output] = num
+
+    if problems:
+        raise Exception("""
+  This job file is not correctly formed.
+    JOB FILE: {0}
+    PROBLEMS:
+      {1}""".format(job_path,"\n      ".join(problems)))
+    return jobs
+
+def assignIdRanges(sizes):
+    """ returns the (first resourceid, first groupid) of each job, given the
+    (number of records, number of groups) of each.  every record uses one
+    resourceid and one groupid per group plus one for its geometry, so the
+    jobs get consecutive, non-overlapping ranges in job file order no matter
+    which order they are converted in. """
+    ranges = []
+    resourceid, groupid = FIRST_RESOURCEID, FIRST_GROUPID
+    for records, groups in sizes:
+        ranges.append((resourceid,groupid))
+        resourceid += records
+        groupid += records*(groups+1)
+    return ranges
@@ -1,11 +1,21 @@
 import os
 import argparse
-import json
 import subprocess
 import csv
 import sys
 import arcpy
 import itertools
+from conflig import loadConflig, validatePlan, isConstant, constantValue
+from authority import AuthorityRegistry, ReconcileError
+from resourcegraph import loadGraphIndex, findGraphDirectory
+from archesio import ArchesWriter
+from quarantine import Quarantine, describeError
+from formatters import makeFormatter, makeConstant
+from geometry import getGeometryOptions, thinPoints, partsToWKT
+from relations import RelateIndex, parseRelationRules, getIndexFields, \
+    addToIndex, iterGroups
+from spatial import GeometryIndex, parseSpatialRules, getSpatialDatasets, \
+    joinAllRules
 
 ## prefer site-packages modules, use local ones if necessary
 try:
@@ -18,18 +28,23 @@ except:
     import unicodecsv_local as unicodecsv
 
 def checkSpatialReference(dataset):
-    """ makes sure the dataset is in EPSG: 4326 (GCS WGS84) """
+    """ returns None if the dataset is in EPSG: 4326 (GCS WGS84), otherwise
+    the EPSG: 4326 spatial reference that its cursor should project to """
     sr = arcpy.Describe(dataset).spatialReference
     wgs84 = arcpy.SpatialReference(4326)
 
-    if sr != wgs84:
+    if sr.factoryCode == wgs84.factoryCode:
+        return None
+
+    if sr.name == "Unknown":
         arcpy.AddError("""
-  This dataset does not have the correct spatial reference, EPSG 4326 (GCS
-  WSG 1984).  Project the dataset to this coordinate system before continuing.
+  This dataset has no defined spatial reference, so it can not be projected to
+  EPSG 4326 (GCS WSG 1984).  Define its coordinate system before continuing.
   """)
         exit()
 
-    return True
+    arcpy.AddMessage("projecting from {0} to EPSG 4326".format(sr.name))
+    return wgs84
 
 def getShapeType(feature_class):
     """ returns the shapetype of the input reader object """
@@ -42,6 +57,34 @@ def getShapeType(feature_class):
         exit()
     return shp_type.upper()
 
+def getGeometryWKT(geometry,shp_type,geom_options):
+    """ builds WKT from an arcpy geometry object, thinning the coordinates with
+    the (precision, tolerance, dedupe) options from the conflig file """
+
+    if geometry is None:
+        return None
+    precision, tolerance, dedupe = geom_options
+    if shp_type == "POINT":
+        pnt = geometry.firstPoint
+        return partsToWKT(shp_type,[(pnt.X,pnt.Y)],precision)
+
+    parts = []
+    for part in geometry:
+        ## the interior rings of a polygon part are separated by None
+        rings = [[]]
+        for pnt in part:
+            if pnt is None:
+                rings.append([])
+            else:
+                rings[-1].append((pnt.X,pnt.Y))
+        rings = [thinPoints(r,precision,tolerance,dedupe,shp_type=="POLYGON")
+                 for r in rings if r]
+        if shp_type == "POLYLINE":
+            parts.extend(rings)
+        else:
+            parts.append(rings)
+    return partsToWKT(shp_type,parts,precision)
+
 def getFieldNames(feature_class):
     """ return list of field names """
     fieldnames = [i[0] for i in reader.fields]
@@ -64,34 +107,6 @@ def makeFieldIndex(fields,reader):
             f_index[field[0]] = i-1
     return f_index
 
-def parseFieldMap(field_map_full):
-    """ take field map from json to list of group dictionaries """
-    groups = []
-    for item in field_map_full:
-        for k,v in item.iteritems():
-            groups.append(v)
-    return groups
-
-def parseConfligFile(conflig_path):
-    """ parses the input .conflig (augmented .config) file, return info set """
-    ## access config (conflig) file
-    with open(conflig_path) as con:
-        config_contents = con.read()
-    try:
-        config_json = json.loads(config_contents)
-    except:
-        arcpy.AddMessage(conflig_path)
-    
-    resource_type = config_json["RESOURCE_TYPE"]
-    full_field_map = config_json["FIELD_MAP"]
-    groups = parseFieldMap(full_field_map)
-    fields = []
-    for group in groups:
-        for k, v in group.iteritems():
-            fields.append(k)
-
-    return resource_type, fields, groups
-
 def notepadOpen(inputfile):
     """ opens the input file with notepad++ """
     ## path to notepad executable
@@ -99,68 +114,34 @@ def notepadOpen(inputfile):
     subprocess.call([notepad,inputfile])
     return
 
-def convertTypeValue(input_value,auth_dict,fieldname,dataset):
+def convertTypeValue(input_value,auth_registry,entity,fieldname,dataset):
     """ takes the input value, and compares it with the authority document
-    dictionary.  if the value is a Preflabel, the corresponding conceptid
-    is returned.  if it is already a conceptid, that id is returned."""
-    conceptids = auth_dict.keys()
-    conceptids.sort(key=lambda x: int(x.split(":")[-1]))
-    labels = auth_dict.values()
-
-    if labels.count(input_value) > 1:
-        arcpy.AddError("""
-  There are two or more corresponding concept ids for this Preflabel.
+    of the entity.  if the value is a conceptid, that id is returned;
+    otherwise it is matched with the Preflabels, then the altlabels, and then
+    with both ignoring case, accents and extra whitespace.  a value that
+    matches no concept, or several, raises ReconcileError. """
+    conceptids = auth_registry.lookup(entity,input_value)
+
+    if len(conceptids) > 1:
+        raise ReconcileError("""
+  There are two or more corresponding concept ids for this label.
   You'll have to find the correct conceptid and apply it to the original
   dataset.
     PROBLEM: {0}
-    AUTHORITY DOCUMENT CONTENTS:""".format(input_value))
-        for k in conceptids:
-            arcpy.AddError("      {0} | {1}".format(k,auth_dict[k])) 
-        exit()
-
-    conceptid = False
-    if input_value in auth_dict.keys():
-        conceptid = input_value
-
-    else:
-        for k,v in auth_dict.iteritems():
-            if v.rstrip() == input_value.rstrip():
-                conceptid = k
-                break
+    MATCHES: {1}""".format(input_value,", ".join(conceptids)),input_value,
+            conceptids)
 
-    if not conceptid:
+    if not conceptids:
         dataset_name = os.path.basename(dataset)
-        arcpy.AddError("""
-  The value listed below can not be reconciled with the Preflabels or
-  conceptids that are available for this entity type.  Double-check your
+        raise ReconcileError("""
+  The value listed below can not be reconciled with the Preflabels, altlabels
+  or conceptids that are available for this entity type.  Double-check your
   original data and conflig files before trying again.
     DATASET: {0}
     FIELD: {1}
-    VALUE: {2}
-    AUTHORITY DOCUMENT CONTENTS:
-      conceptid | Preflabel""".format(dataset_name,fieldname,input_value))
-        for k in conceptids:
-            arcpy.AddError("      {0} | {1}".format(k,auth_dict[k]))                                   
-        exit()
-                        
-    return conceptid
-
-def getAuthDict(auth_doc_path):
-    """ makes a dictionary for the accepted values present in an autority
-    document """
-
-    auth_dict = {}
-    with open(auth_doc_path, 'rU') as f:
-        fields = ['conceptid','Preflabel','altlabels','ParentConceptid',
-                      'ConceptType','Provider']
-        rows = unicodecsv.DictReader(f, fieldnames=fields,
-            encoding='utf-8-sig', delimiter=',', restkey='ADDITIONAL',
-                                     restval='MISSING')
-        rows.next()
-        for row in rows:
-            auth_dict[row['conceptid']] = row['Preflabel']
+    VALUE: {2}""".format(dataset_name,fieldname,input_value),input_value)
 
-    return auth_dict
+    return conceptids[0]
 
 def makeEntityAuthDocDict(auth_doc_directory):
     """ makes a dictionary of the items in the ENTITY_TYPE_X_ADOC.csv file """
@@ -198,55 +179,48 @@ def makeEntityAuthDocDict(auth_doc_directory):
 
     return entity_auth_dict
 
-def makeRelationsFile(arches_file,relation_dict):
-    """ makes an empty relations file to match the given arches file """
+def makeRelationsFile(arches,relation_dict,joined_relations=()):
+    """ makes the relations file(s) to match the given ArchesWriter.  all
+    resources that share a relate key value are related to each other, then
+    the relations produced by the relationship rules are added. """
 
     arcpy.AddMessage("\ncreating relations file")
     
     relation_type = "RELATIONSHIP_TYPE:1"
-    relations = os.path.splitext(arches_file)[0]+".relations"
-    with open(relations,"wb") as rel:
-        rel.write("RESOURCEID_FROM|RESOURCEID_TO|START_DATE"\
-            "|END_DATE|RELATION_TYPE|NOTES\r\n")
-        if len(relation_dict.keys()) == 0:
-            print "no relationships to write"
-            return
-
-        for k in sorted(relation_dict.keys()):
-            v = relation_dict[k]
+    with arches.openRelations() as rel:
+
+        for k, v in iterGroups(relation_dict):
             for a, b in itertools.combinations(v,2):
-                rel.write("{0}|{1}|||{2}|\r\n".format(
-                a,b,relation_type,""))
+                rel.writeRelation(a,b,relation_type)
+
+        for a, b, rule_type in joined_relations:
+            rel.writeRelation(a,b,rule_type)
+
+    if rel.count == 0:
+        print "no relationships to write"
+        return
+    arcpy.AddMessage("\n  {0} relationships written".format(rel.count))
     arcpy.AddMessage("\n  finished")
     return
 
 def createArchesFile(input_dataset,out_dir):
-    """ creates basic .arches file with only header rows printed """
+    """ creates basic .arches file with only header rows printed.  returns
+    the ArchesWriter that the datasets are written to. """
 
     ds_name = os.path.basename(input_dataset)
     if os.path.splitext(ds_name)[1] != "":
         ds_name = os.path.splitext(ds_name)[0]
     outfile = os.path.join(out_dir,ds_name+".arches")
     
-    with open(outfile,"wb") as arches:
-        arches.write(
-            "RESOURCEID|RESOURCETYPE|ATTRIBUTENAME|ATTRIBUTEVALUE|GROUPID\r\n")
-    return outfile
-
-def getCounts(arches_file):
-    """ gets the current resourceid and groupid for the input .arches file """
-
-    with open(arches_file,"r") as f:
-        lines = tuple(f)
-        long_resourceid = lines[-1].split("|")[0]
-        if long_resourceid == "RESOURCEID":
-            resourceid = 100000
-            groupid = 300000
-        else:
-            resourceid = long_resourceid.split("-")[1]
-            groupid = lines[-1].split("|")[-1].rstrip("\r\n")
-            
-    return (int(resourceid),int(groupid))
+    return ArchesWriter(outfile)
+
+def getCounts(arches):
+    """ gets the current resourceid and groupid for the input ArchesWriter """
+
+    counts = arches.counts()
+    if counts is None:
+        return (100000,300000)
+    return counts
 
 def checkForGeom(dataset):
     """ returns true if this is a spatial dataset, false if table """
@@ -265,8 +239,8 @@ def printSummary(input_dataset,config_file):
         shp_type = getShapeType(input_dataset)
 
     ## get config info
-    result = parseConfligFile(config_file)
-    res_type,config_fields,groups =  result[0],result[1],result[2]
+    plan = loadConflig(config_file)
+    res_type, groups = plan.resource_type, plan.groups
 
     ## print intro summary
     arcpy.AddMessage("""FROM: {0}
@@ -281,12 +255,29 @@ field mapping:
     cnt = 1
     for group in groups:
         arcpy.AddMessage("  ~ group" + str(cnt))
-        for k,v in group.iteritems():
+        for k,v in group:
             arcpy.AddMessage("      {0} --> {1}".format(k,v))
         cnt+=1
 
-def processLayer(input_data,arches_file,entity_auth_dict,relate_dict={}):
-    """ process the input shapefile """
+def indexRow(row,fields,long_resourceid,relate_key,relate_dict,key_index):
+    """ adds the resourceid of a row to the relate key index and to the index
+    of each relationship rule field """
+    if relate_key != "":
+        addToIndex(relate_dict,row[fields.index(relate_key)],
+                   long_resourceid)
+    for field, index in key_index.iteritems():
+        addToIndex(index,row[fields.index(field)],long_resourceid)
+
+def processLayer(input_data,arches,auth_registry,relate_dict=None,
+                 key_indexes=None,index_fields={},geometry_indexes=None):
+    """ process the input shapefile.  auth_registry is the AuthorityRegistry
+    of the run, shared by all datasets.  relate_dict is the RelateIndex
+    shared by all datasets for the relate key fields, and key_indexes
+    collects, per dataset, a RelateIndex for every field in index_fields that
+    is used by a relationship rule.  the geometries written for a dataset
+    are added to its GeometryIndex in geometry_indexes, if a spatial rule
+    uses it.  rows that can't be converted are set aside, with the reason,
+    in a DATASET_quarantine.csv file next to the .arches file. """
 
     inlayer = input_data[0]
     config = input_data[1]
@@ -295,84 +286,141 @@ def processLayer(input_data,arches_file,entity_auth_dict,relate_dict={}):
 
     arcpy.AddMessage("\nprocessing: "+inlayer)
 
-    ## get info from conflig file
-    result = parseConfligFile(config)
-    res_type,config_fields,groups =  result[0],result[1],result[2]
+    ## get info from the conflig plan, which was checked before starting
+    plan = loadConflig(config)
+    res_type, groups = plan.resource_type, plan.groups
+    config_fields = list(plan.fields)
 
     ## build field list
-    fc_fields = [f.name for f in arcpy.ListFields(inlayer)]
+    layer_fields = arcpy.ListFields(inlayer)
+    fc_fields = [f.name for f in layer_fields]
     if relate_key != "":
         fc_fields.append(relate_key)
         config_fields.append(relate_key)
 
+    ## fields that relationship rules join on
+    rule_fields = sorted(index_fields.get(dataset_name,()))
+    spill_dir = os.path.dirname(arches.path)
+    if relate_dict is None:
+        relate_dict = RelateIndex(spill_dir=spill_dir)
+    if key_indexes is None:
+        key_indexes = {}
+    key_index = key_indexes.setdefault(dataset_name,{})
+    for field in rule_fields:
+        if not field in key_index:
+            key_index[field] = RelateIndex(spill_dir=spill_dir)
+        if not field in config_fields:
+            config_fields.append(field)
+
     ## compare config and dataset fields
     checkFieldsInConfig(config_fields,fc_fields)
 
-    ## add geometry as WKT field if spatial
+    ## rows that can't be converted are quarantined with their values and
+    ## ObjectID, which the cursor reads after the fields
+    qt = Quarantine(os.path.join(spill_dir,dataset_name+"_quarantine"),
+                    config_fields)
+    config_fields.append("OID@")
+
+    ## add geometry as WKT field if spatial, or as a geometry object if the
+    ## coordinates are thinned before being written
     spatial = checkForGeom(inlayer)
+    out_sr = None
+    geom_options = getGeometryOptions(config)
+    thin = geom_options != (None,None,False)
     if spatial:    
-        config_fields.append("SHAPE@WKT")
-
-    ## dictionary of created authority document dictionaries
-    auth_dict_dict = {}              
+        out_sr = checkSpatialReference(inlayer)
+        if thin:
+            shp_type = getShapeType(inlayer)
+            config_fields.append("SHAPE@")
+        else:
+            config_fields.append("SHAPE@WKT")
+
+    ## the formatter of each mapped field is chosen once, from its type, and
+    ## constants are resolved to their conceptid once, here
+    field_types = dict([(f.name,f.type) for f in layer_fields])
+    columns = []
+    for offset, group in enumerate(groups,1):
+        for f_in, entity in group:
+            if isConstant(f_in):
+                value = constantValue(f_in)
+                if entity in auth_registry:
+                    value = convertTypeValue(value,auth_registry,entity,f_in,
+                                             inlayer)
+                columns.append((offset,f_in,0,entity,makeConstant(value),
+                                False))
+                continue
+            columns.append((offset,f_in,config_fields.index(f_in),entity,
+                makeFormatter(field_types[f_in],entity=entity,cursor=True),
+                entity in auth_registry))
+
+    ## the geometries of datasets used by spatial relationship rules
+    geometry_index = (geometry_indexes or {}).get(dataset_name)
 
     ## get current id counts from existing .arches file
-    counts = getCounts(arches_file)
+    counts = getCounts(arches)
     resourceid, groupid = counts[0]+1, counts[1]+1
 
     ## print first input dataset
-    with open(arches_file,"ab") as arches:
-        with arcpy.da.SearchCursor(inlayer,config_fields) as rows:
-            for row in rows:
+    ## the cursor projects the geometry to WGS84 as it is read, if needed
+    with arcpy.da.SearchCursor(inlayer,config_fields,
+                               spatial_reference=out_sr) as rows:
+        for row in rows:
                 
-                long_resourceid = dataset_name+"-"+str(resourceid)
+            long_resourceid = dataset_name+"-"+str(resourceid)
+            out_rows = []
+            f_in = None
 
-                #first, write geometry row
+            try:
+                #first, the geometry row
                 if spatial:
                     wkt = row[-1]
-                    arches.write("{0}|{1}|{2}|{3}|{4}\r\n".format(
-        long_resourceid,res_type,"SPATIAL_COORDINATES_GEOMETRY.E47",wkt,groupid))
+                    if thin:
+                        wkt = getGeometryWKT(wkt,shp_type,geom_options)
+                    if wkt is not None:
+                        out_rows.append(("SPATIAL_COORDINATES_GEOMETRY.E47",
+                                         wkt,0))
 
                 #next, loop through fields and add values
-                for group in groups:
-                    groupid+=1
-                    for f_in, entity in group.iteritems():
-
-                        raw_value = row[config_fields.index(f_in)]
-                        if raw_value == None:
-                            continue
-                        if raw_value.rstrip() == '':
-                            continue
-
-                        ## make it unicode?
-                        value = raw_value.encode('utf8')
-
-                        ## if it's a type, it may need translation
-                        if entity in entity_auth_dict.keys():
-
-                            auth_path = entity_auth_dict[entity]
-                            if not entity in auth_dict_dict.keys():
-                                auth_dict_dict[entity] = getAuthDict(auth_path)
-                            auth_dict = auth_dict_dict[entity]
-                            value = convertTypeValue(value,auth_dict,
-                                        f_in,inlayer)
-
-                        arches.write("{0}|{1}|{2}|{3}|{4}\r\n".format(
-                    long_resourceid,res_type,entity,value,groupid))
-
-                ## after writing rows, update relationship dictionary
-                if relate_key != "":
-                    key_val = row[config_fields.index(relate_key)]
-                    if not key_val in relate_dict.keys():
-                        relate_dict[key_val] = [long_resourceid]
-                    else:
-                        relate_dict[key_val].append(long_resourceid)                
-
-                ## advance groupid for geometry row
-                if spatial:
-                    groupid+=1
-                resourceid+=1
-
+                for offset, f_in, index, entity, formatter, typed in columns:
+
+                    value = formatter(row[index])
+                    if value is None:
+                        continue
+
+                    ## if it's a type, it may need translation
+                    if typed:
+                        value = convertTypeValue(value,auth_registry,entity,
+                                                 f_in,inlayer)
+
+                    out_rows.append((entity,value,offset))
+            except Exception as e:
+                kind, reason = describeError(e,f_in)
+                qt.add(row[len(qt.fields)],kind,reason,row[:len(qt.fields)])
+                out_rows = None
+
+            if out_rows is not None:
+                for entity, value, offset in out_rows:
+                    arches.writeRow(long_resourceid,res_type,entity,value,
+                                    groupid+offset)
+
+                ## after writing rows, update relationship dictionary and the
+                ## indexes of the values and geometries used by relationship
+                ## rules
+                indexRow(row,config_fields,long_resourceid,relate_key,
+                         relate_dict,key_index)
+                if geometry_index is not None:
+                    geometry_index.addRows(long_resourceid,out_rows)
+
+            ## the ids of a quarantined row are left unused, then advance
+            ## groupid past the groups and geometry row
+            groupid+=len(groups)
+            if spatial:
+                groupid+=1
+            resourceid+=1
+
+    qt.close()
+    if qt.count:
+        arcpy.AddWarning("\n".join(qt.summary()))
     arcpy.AddMessage("  finished")
     return relate_dict
 
@@ -396,18 +444,69 @@ out_dir = arcpy.GetParameterAsText(1)
 open_output = arcpy.GetParameterAsText(2)
 
 ## create empty arches file
-arches_file = createArchesFile(datasets[0][0], out_dir)
+arches = createArchesFile(datasets[0][0], out_dir)
+arches_file = arches.path
 
 ## make dictionary of entities and their corresponding authority documents
 entity_auth_dict = makeEntityAuthDocDict(auth_doc_directory)
 
-## iterate all input datasets, adding each to the output arches file
-relate_dict = {}
+## one authority registry for the whole run, each document is read once and
+## each distinct value reconciled once, however many datasets use them
+auth_registry = AuthorityRegistry(entity_auth_dict)
+
+## load the resource graphs found next to the authority documents
+graph_index = None
+graph_dir = findGraphDirectory(auth_doc_directory)
+if graph_dir:
+    graph_index = loadGraphIndex(graph_dir)
+else:
+    arcpy.AddWarning("resource graphs not found, entity names will not be "\
+                     "checked")
+
+## check every conflig file against its dataset, the authority documents and
+## the resource graphs before converting anything
 for dataset in datasets:
-    relate_dict = processLayer(dataset,arches_file,entity_auth_dict,relate_dict)
+    try:
+        validatePlan(loadConflig(dataset[1]),
+                     [f.name for f in arcpy.ListFields(dataset[0])],
+                     entity_auth_dict,graph_index,auth_registry)
+    except Exception as e:
+        arcpy.AddError(str(e))
+        exit()
 
-## use cumulative relationship dictionary to create relations file
-makeRelationsFile(arches_file, relate_dict)
+## gather the relationship rules declared in the conflig files
+rules = []
+spatial_rules = []
+for dataset in datasets:
+    dataset_name = os.path.splitext(os.path.basename(dataset[0]))[0]
+    rules += parseRelationRules(dataset[1],dataset_name)
+    spatial_rules += parseSpatialRules(dataset[1],dataset_name)
+index_fields = getIndexFields(rules)
+
+## the geometries of the datasets in this run that spatial rules relate
+spatial_datasets = getSpatialDatasets(spatial_rules)
+geometry_indexes = {}
+for dataset in datasets:
+    dataset_name = os.path.splitext(os.path.basename(dataset[0]))[0]
+    if dataset_name in spatial_datasets:
+        geometry_indexes[dataset_name] = GeometryIndex()
+
+## iterate all input datasets, adding each to the output arches file
+relate_dict = RelateIndex(spill_dir=out_dir)
+key_indexes = {}
+for dataset in datasets:
+    relate_dict = processLayer(dataset,arches,auth_registry,relate_dict,
+                               key_indexes,index_fields,geometry_indexes)
+arches.close()
+
+## use cumulative relationship dictionary and the rules to create relations file
+makeRelationsFile(arches,relate_dict,
+                  joinAllRules(rules,key_indexes,spatial_rules,
+                               geometry_indexes))
+relate_dict.close()
+for key_index in key_indexes.values():
+    for index in key_index.values():
+        index.close()
 
 if open_output:
     try:
@@ -415,4 +514,3 @@ if open_output:
     except:
         arcpy.AddWarning("Unable to find Notepad++. Please open this file "\
                          "manually:\n"+arches_file)
-
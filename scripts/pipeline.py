@@ -0,0 +1,152 @@
+import sys
+import Queue
+import threading
+
+## number of items handed between threads at a time, and the number of
+## batches a queue holds before the thread filling it has to wait
+BATCH_SIZE = 500
+QUEUE_BATCHES = 8
+
+_DONE = object()
+
+class _Failure(object):
+    """ carries an exception raised in a worker thread to the main thread """
+    def __init__(self,exc_info):
+        self.exc_info = exc_info
+
+    def reraise(self):
+        raise self.exc_info[0], self.exc_info[1], self.exc_info[2]
+
+def _put(queue,item,stop):
+    """ puts item on the queue, waiting while it is full unless stop is set.
+    returns False if the item was dropped because of stop. """
+    while not stop.is_set():
+        try:
+            queue.put(item,timeout=0.1)
+            return True
+        except Queue.Full:
+            pass
+    return False
+
+def iterPrefetched(iterable,batch_size=BATCH_SIZE,max_batches=QUEUE_BATCHES):
+    """ iterates iterable on a reader thread, which stays up to max_batches
+    batches of batch_size items ahead of the consumer.  the bounded queue
+    caps the memory used when reading is faster than what follows it.
+    exceptions raised while reading are raised again in the consumer. """
+
+    queue = Queue.Queue(max_batches)
+    stop = threading.Event()
+
+    def read():
+        try:
+            batch = []
+            for item in iterable:
+                batch.append(item)
+                if len(batch) >= batch_size:
+                    if not _put(queue,batch,stop):
+                        return
+                    batch = []
+            if batch:
+                _put(queue,batch,stop)
+            _put(queue,_DONE,stop)
+        except:
+            _put(queue,_Failure(sys.exc_info()),stop)
+
+    reader = threading.Thread(target=read)
+    reader.daemon = True
+    reader.start()
+    try:
+        while True:
+            batch = queue.get()
+            if batch is _DONE:
+                break
+            if isinstance(batch,_Failure):
+                batch.reraise()
+            for item in batch:
+                yield item
+    finally:
+        stop.set()
+        reader.join()
+
+class ThreadedWriter(object):
+    """ hands the rows for an ArchesWriter to a writer thread in batches, so
+    the rows of one record are written while the next is being converted.
+    writeRow blocks when max_batches batches are waiting, which keeps the
+    memory in use bounded.  errors from the writer thread are raised by the
+    next call to writeRow, flush or close. """
+    def __init__(self,arches,batch_size=BATCH_SIZE,max_batches=QUEUE_BATCHES):
+        self.arches = arches
+        self.batch_size = batch_size
+        self._batch = []
+        self._queue = Queue.Queue(max_batches)
+        self._failure = None
+        self._thread = threading.Thread(target=self._write)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _write(self):
+        while True:
+            batch = self._queue.get()
+            try:
+                if batch is _DONE:
+                    return
+                if self._failure is None:
+                    for row in batch:
+                        self.arches.writeRow(*row)
+            except:
+                self._failure = _Failure(sys.exc_info())
+            finally:
+                self._queue.task_done()
+
+    def _check(self):
+        if self._failure is not None:
+            self._failure.reraise()
+
+    def writeRow(self,resourceid,resource_type,attribute,value,groupid):
+        self._batch.append((resourceid,resource_type,attribute,value,groupid))
+        if len(self._batch) >= self.batch_size:
+            self._check()
+            self._queue.put(self._batch)
+            self._batch = []
+
+    def flush(self):
+        """ waits until every row so far has been written """
+        if self._batch:
+            self._queue.put(self._batch)
+            self._batch = []
+        self._queue.join()
+        self._check()
+
+    def checkpoint(self):
+        """ flushes the rows, then returns the ArchesWriter's checkpoint """
+        self.flush()
+        return self.arches.checkpoint()
+
+    def close(self):
+        """ writes the remaining rows and stops the writer thread.  the
+        ArchesWriter itself is left open. """
+        if self._thread.is_alive():
+            try:
+                self.flush()
+            finally:
+                self._queue.put(_DONE)
+                self._thread.join()
+
+    def abort(self):
+        """ stops the writer thread once the batches already queued are
+        done, without writing the rows not yet queued or raising the
+        thread's errors, for when the conversion has failed.  the
+        ArchesWriter can be closed safely after this. """
+        self._batch = []
+        if self._thread.is_alive():
+            self._queue.put(_DONE)
+            self._thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self,exc_type,*args):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
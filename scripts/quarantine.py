@@ -0,0 +1,175 @@
+import os
+import csv
+import shutil
+import collections
+
+## fields added to each quarantined record, named to fit in a dbf
+RECORD_FIELD = "QRECORD"
+REASON_FIELD = "QREASON"
+REASON_SIZE = 254
+
+def describeError(e,field=None):
+    """ returns the (kind, reason) of an error that kept a record from being
+    converted.  the kind groups errors in the summary, the reason is written
+    next to the record and names the field and value, if known.  the field
+    is taken from the error's field attribute if it isn't given. """
+    field = field or getattr(e,"field",None)
+    reason = getattr(e,"reason",None) or " ".join(str(e).split())
+    kind = getattr(e,"kind",None) or e.__class__.__name__
+    if field:
+        reason = "{0}: {1}".format(field,reason)
+        kind = "{0}: {1}".format(field,kind)
+    return kind, reason
+
+def _text(value):
+    """ returns a value as a utf-8 byte string """
+    if isinstance(value,unicode):
+        return value.encode("utf-8")
+    return str(value)
+
+def _dbfValue(value,field):
+    """ formats a value read from a dbf so it can be written back to one """
+    name, typ, size, decimal = field
+    if value is None or value == "":
+        return "?" if typ == "L" else ""
+    if isinstance(value,list) and len(value) == 3:
+        return "{0:04d}{1:02d}{2:02d}".format(*value)
+    if hasattr(value,"strftime"):
+        return value.strftime("%Y%m%d")
+    if isinstance(value,float) and typ in ("N","F"):
+        return "{0:.{1}f}".format(value,int(decimal))
+    return _text(value)[:int(size)]
+
+class Quarantine(object):
+    """ writes the records that could not be converted, with their original
+    attributes and the reason, so they can be fixed and converted again.
+    with a shape_type the records go to a shapefile that copies the source
+    fields (a list of dbf field tuples) and .prj, and records the codepage
+    of their text in a .cpg, otherwise to a csv file whose columns are fields
+    (a list of names).  keep is the number of
+    records to carry over from the quarantine of an earlier, interrupted run
+    of the same conversion.  the files are removed on close if nothing was
+    quarantined. """
+    def __init__(self,path,fields,shape_type=None,prj_path=None,keep=0,
+                 codepage=None):
+        self.path = os.path.splitext(path)[0]
+        self.fields = list(fields)
+        self.shape_type = shape_type
+        self.count = 0
+        self.kinds = collections.Counter()
+
+        old = None
+        if keep:
+            old = self._moveAside()
+
+        if shape_type:
+            import shapefile_local
+            self._files = [self.path+ext for ext in (".shp",".shx",".dbf")]
+            self._writer = shapefile_local.StreamWriter(self.path,shape_type)
+            for field in self.fields:
+                self._writer.field(*field)
+            self._writer.field(RECORD_FIELD,"N",10,0)
+            self._writer.field(REASON_FIELD,"C",REASON_SIZE,0)
+            if prj_path and os.path.isfile(prj_path):
+                shutil.copyfile(prj_path,self.path+".prj")
+                self._files.append(self.path+".prj")
+            if codepage:
+                with open(self.path+".cpg","wb") as f:
+                    f.write(codepage)
+                self._files.append(self.path+".cpg")
+        else:
+            self._files = [self.path+".csv"]
+            self._csv_file = open(self._files[0],"wb")
+            self._writer = csv.writer(self._csv_file)
+            self._writer.writerow([_text(f) for f in self.fields]+
+                                  [RECORD_FIELD,REASON_FIELD])
+
+        if old:
+            self._carryOver(old,keep)
+
+    def _moveAside(self):
+        """ renames the files of an earlier quarantine so they can be read
+        while the new one is written, returns the new base path """
+        old = self.path+"_previous"
+        found = False
+        for ext in (".shp",".shx",".dbf",".csv"):
+            if os.path.isfile(self.path+ext):
+                if os.path.isfile(old+ext):
+                    os.remove(old+ext)
+                os.rename(self.path+ext,old+ext)
+                found = True
+        return old if found else None
+
+    def _carryOver(self,old,keep):
+        """ copies the first keep records of the earlier quarantine """
+        if self.shape_type:
+            import shapefile_local
+            reader = shapefile_local.Reader(old)
+            for i in range(min(keep,reader.numRecords)):
+                self._writer.addShape(reader.shape(i))
+                self._writer.record(*[_dbfValue(v,f) for v, f in
+                    zip(reader.record(i),reader.fields[1:])])
+            for f in (reader.shp,reader.shx,reader.dbf):
+                f.close()
+            old_files = [old+ext for ext in (".shp",".shx",".dbf")]
+        else:
+            with open(old+".csv","rb") as f:
+                rows = csv.reader(f)
+                rows.next()
+                for num, row in enumerate(rows):
+                    if num >= keep:
+                        break
+                    self._writer.writerow(row)
+            old_files = [old+".csv"]
+        self.count = keep
+        self.kinds["quarantined before resuming"] += keep
+        for path in old_files:
+            os.remove(path)
+
+    def add(self,record_num,kind,reason,values,shape=None):
+        """ quarantines a record: its values (in the order of the fields),
+        the record number or ObjectID, and the reason it was skipped """
+        self.count += 1
+        self.kinds[kind] += 1
+        reason = _text(reason)[:REASON_SIZE]
+        if self.shape_type:
+            self._writer.addShape(shape)
+            self._writer.record(*[_dbfValue(v,f) for v, f in
+                zip(values,self.fields)]+[record_num,reason])
+        else:
+            self._writer.writerow([_text(v) if v is not None else ""
+                                   for v in values]+[record_num,reason])
+
+    def flush(self):
+        """ writes what has been quarantined so far to disk, as files that
+        can be read back if the conversion is resumed """
+        if self.shape_type:
+            self._writer.flush()
+        else:
+            self._csv_file.flush()
+
+    def summary(self):
+        """ lines that sum up the quarantined records by kind of problem """
+        if self.count == 0:
+            return ["no records quarantined"]
+        lines = ["{0} records quarantined in {1}".format(self.count,
+                 os.path.basename(self._files[0]))]
+        for kind, count in sorted(self.kinds.iteritems()):
+            lines.append("  {0} x {1}".format(count,kind))
+        return lines
+
+    def close(self):
+        if self.shape_type:
+            self._writer.close()
+        else:
+            self._csv_file.close()
+        if self.count == 0:
+            for path in self._files:
+                if os.path.isfile(path):
+                    os.remove(path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self,*args):
+        self.close()
@@ -0,0 +1,231 @@
+import os
+import tempfile
+import itertools
+
+from conflig import readConflig
+
+DEFAULT_RELATION_TYPE = "RELATIONSHIP_TYPE:1"
+
+## number of resourceids an index holds in memory before spilling to disk
+RELATE_INDEX_MEMORY = 1000000
+
+class RelateIndex(object):
+    """ an index of key value: list of resourceids, in the order they were
+    added.  up to max_entries resourceids are held in a dictionary; beyond
+    that the whole index is moved to a temporary sqlite database and the keys
+    are read back in sorted groups, so the index never has to fit in memory.
+    """
+    def __init__(self,max_entries=None,spill_dir=None):
+        if max_entries is None:
+            max_entries = RELATE_INDEX_MEMORY
+        self.max_entries = max_entries
+        self.spill_dir = spill_dir
+        self.db_path = None
+        self._memory = {}
+        self._pending = []
+        self._count = 0
+        self._db = None
+        self._indexed = False
+
+    def add(self,key,resourceid):
+        """ adds the resourceid to the bucket for key """
+        self._count += 1
+        if self._db is None:
+            if key in self._memory:
+                self._memory[key].append(resourceid)
+            else:
+                self._memory[key] = [resourceid]
+            if self._count > self.max_entries:
+                self._spill()
+        else:
+            self._pending.append((key,resourceid))
+            if len(self._pending) >= 10000:
+                self._flush()
+
+    def _spill(self):
+        """ moves the in-memory index to a new sqlite database """
+        handle, self.db_path = tempfile.mkstemp(suffix=".relate",
+                                                dir=self.spill_dir)
+        os.close(handle)
+        import sqlite3
+        self._db = sqlite3.connect(self.db_path)
+        ## keep dbf values as the byte strings they were read as
+        self._db.text_factory = str
+        self._db.execute("PRAGMA synchronous=OFF")
+        self._db.execute("PRAGMA journal_mode=OFF")
+        self._db.execute("CREATE TABLE relate (seq INTEGER PRIMARY KEY, "\
+                         "key, resourceid)")
+        for key in self._memory:
+            for resourceid in self._memory[key]:
+                self._pending.append((key,resourceid))
+        self._memory = {}
+        self._flush()
+
+    def _flush(self):
+        """ writes pending rows to the database """
+        if self._pending:
+            self._db.executemany("INSERT INTO relate (key, resourceid) "\
+                                 "VALUES (?,?)",self._pending)
+            self._pending = []
+            self._indexed = False
+
+    def _query(self,sql,params=()):
+        """ flushes pending rows, makes sure the key index exists and runs
+        the query against the database """
+        self._flush()
+        if not self._indexed:
+            self._db.execute("CREATE INDEX IF NOT EXISTS relate_key ON "\
+                             "relate (key, seq)")
+            self._indexed = True
+        return self._db.execute(sql,params)
+
+    def __len__(self):
+        if self._db is None:
+            return len(self._memory)
+        return self._query("SELECT COUNT(DISTINCT key) FROM relate")\
+               .fetchone()[0]
+
+    def __contains__(self,key):
+        if self._db is None:
+            return key in self._memory
+        return self._query("SELECT 1 FROM relate WHERE key = ? LIMIT 1",
+                           (key,)).fetchone() is not None
+
+    def __getitem__(self,key):
+        if self._db is None:
+            return self._memory[key]
+        return [r[0] for r in self._query("SELECT resourceid FROM relate "\
+                "WHERE key = ? ORDER BY seq",(key,))]
+
+    def __iter__(self):
+        """ iterates the keys in sorted order """
+        if self._db is None:
+            return iter(sorted(self._memory))
+        return (r[0] for r in self._query("SELECT DISTINCT key FROM relate "\
+                "ORDER BY key"))
+
+    def groups(self):
+        """ yields (key, [resourceids]) in key order, streaming from disk when
+        the index has been spilled so only one bucket is in memory at a time """
+        if self._db is None:
+            for key in sorted(self._memory):
+                yield key, self._memory[key]
+            return
+        rows = self._query("SELECT key, resourceid FROM relate "\
+                           "ORDER BY key, seq")
+        for key, group in itertools.groupby(rows,lambda r: r[0]):
+            yield key, [r[1] for r in group]
+
+    def close(self):
+        """ removes the temporary database, if one was created """
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+            os.remove(self.db_path)
+        self._memory = {}
+        self._pending = []
+
+def parseRelationRules(conflig_path,dataset_name):
+    """ reads the RELATIONS entries from a .conflig file, returns a list of
+    rule tuples: (source dataset, source field, target dataset, target field,
+    relation type).  each entry in the conflig looks like:
+        {
+            "FIELD": "plot_id",
+            "TARGET_DATASET": "grave_actors",
+            "TARGET_FIELD": "plot_id",
+            "RELATION_TYPE": "RELATIONSHIP_TYPE:1"
+        }
+    and the source dataset is always the one the conflig file belongs to.
+    SPATIAL entries are left to spatial.parseSpatialRules. """
+
+    config_json = readConflig(conflig_path)
+
+    rules = []
+    for entry in config_json.get("RELATIONS",[]):
+        if "SPATIAL" in entry:
+            continue
+        target_dataset = entry.get("TARGET_DATASET",dataset_name)
+        target_dataset = os.path.splitext(os.path.basename(target_dataset))[0]
+        rule = (
+            dataset_name,
+            entry["FIELD"],
+            target_dataset,
+            entry.get("TARGET_FIELD",entry["FIELD"]),
+            entry.get("RELATION_TYPE",DEFAULT_RELATION_TYPE)
+        )
+        rules.append(rule)
+
+    return rules
+
+def getIndexFields(rules):
+    """ returns a dictionary of dataset name: set of fields that must be
+    indexed while the dataset is converted, so the rules can be joined """
+
+    index_fields = {}
+    for src_ds,src_field,tgt_ds,tgt_field,rel_type in rules:
+        index_fields.setdefault(src_ds,set()).add(src_field)
+        index_fields.setdefault(tgt_ds,set()).add(tgt_field)
+    return index_fields
+
+def addToIndex(key_index,key_val,resourceid):
+    """ adds the resourceid to the bucket for key_val, blank keys are ignored """
+
+    if key_val is None:
+        return
+    if isinstance(key_val,basestring):
+        if key_val.strip() == "":
+            return
+        key_val = key_val.strip()
+    key_index.add(key_val,resourceid)
+
+def iterGroups(key_index):
+    """ yields (key, [resourceids]) in key order from a RelateIndex or a
+    plain dictionary """
+    if hasattr(key_index,"groups"):
+        return key_index.groups()
+    return ((k,key_index[k]) for k in sorted(key_index))
+
+def joinRelations(rule,key_indexes):
+    """ hash join between the key index of the source field and the key index
+    of the target field.  only the smaller of the two indexes is iterated, each
+    of its keys is probed in the other, so the cost is proportional to the
+    number of matches rather than the size of the buckets squared.  yields
+    (resourceid_from, resourceid_to, relation_type) tuples. """
+
+    src_ds,src_field,tgt_ds,tgt_field,rel_type = rule
+    src_index = key_indexes.get(src_ds,{}).get(src_field,{})
+    tgt_index = key_indexes.get(tgt_ds,{}).get(tgt_field,{})
+
+    ## a dataset joined to itself on the same field only needs each pair once
+    if (src_ds,src_field) == (tgt_ds,tgt_field):
+        for key, ids in iterGroups(src_index):
+            for a, b in itertools.combinations(ids,2):
+                yield (a,b,rel_type)
+        return
+
+    swap = len(tgt_index) < len(src_index)
+    build, probe = (tgt_index,src_index) if swap else (src_index,tgt_index)
+
+    for key, build_ids in iterGroups(build):
+        if not key in probe:
+            continue
+        src_ids, tgt_ids = build_ids, probe[key]
+        if swap:
+            src_ids, tgt_ids = tgt_ids, src_ids
+        for a in src_ids:
+            for b in tgt_ids:
+                if a == b:
+                    continue
+                yield (a,b,rel_type)
+
+def joinAllRelations(rules,key_indexes):
+    """ yields the relations for all rules, skipping (with a message) any rule
+    that targets a dataset that was not converted in this run """
+
+    for rule in rules:
+        if not rule[0] in key_indexes or not rule[2] in key_indexes:
+            print "skipping relationship {0}.{1} --> {2}.{3}: dataset not "\
+                "included in this conversion".format(*rule[:4])
+            continue
+        for relation in joinRelations(rule,key_indexes):
+            yield relation
@@ -0,0 +1,275 @@
+import os
+import re
+import math
+
+## numpy is optional, it lets whole coordinate arrays be projected at once.
+## it is only imported when a long list of points is first projected,
+## because loading it takes longer than many small conversions do
+numpy = None
+_numpy_checked = False
+
+def _loadNumpy():
+    """ imports numpy on first use, returns None if it isn't installed """
+    global numpy, _numpy_checked
+    if not _numpy_checked:
+        _numpy_checked = True
+        try:
+            import numpy as module
+            numpy = module
+        except ImportError:
+            pass
+    return numpy
+
+## below this many points the per call overhead of numpy outweighs its speed
+NUMPY_MIN_POINTS = 16
+
+## datums that are treated as WGS84 (within about a meter)
+WGS84_DATUMS = (
+    "D_WGS_1984",
+    "WGS_1984",
+    "D_North_American_1983",
+    "North_American_Datum_1983",
+    "D_North_American_1983_HARN",
+    "D_North_American_1983_CSRS",
+    "D_NAD_1983_2011",
+    "D_ETRS_1989",
+    "D_GRS_1980",
+)
+
+def parseWKT(text):
+    """ parses ESRI/OGC WKT (as found in a .prj file) into nested lists of
+    the form [KEYWORD, arg, arg, ...] where each arg is a string, a number or
+    another nested list """
+
+    tokens = re.findall(r'"[^"]*"|[\[\](),]|[^\s\[\](),"]+',text)
+    pos = [0]
+
+    def parseNode():
+        node = [tokens[pos[0]].upper()]
+        pos[0] += 1
+        if pos[0] < len(tokens) and tokens[pos[0]] in ("[","("):
+            pos[0] += 1
+            while tokens[pos[0]] not in ("]",")"):
+                tok = tokens[pos[0]]
+                if tok == ",":
+                    pos[0] += 1
+                    continue
+                if tok.startswith('"'):
+                    node.append(tok.strip('"'))
+                    pos[0] += 1
+                elif pos[0]+1 < len(tokens) and tokens[pos[0]+1] in ("[","("):
+                    node.append(parseNode())
+                else:
+                    try:
+                        node.append(float(tok))
+                    except ValueError:
+                        node.append(tok)
+                    pos[0] += 1
+            pos[0] += 1
+        return node
+
+    return parseNode()
+
+def findNodes(node,keyword):
+    """ returns all child nodes with the keyword """
+    return [n for n in node[1:] if isinstance(n,list) and n[0] == keyword]
+
+def findNode(node,keyword):
+    """ returns the first node with the keyword, searching depth first """
+    if node[0] == keyword:
+        return node
+    for child in node[1:]:
+        if isinstance(child,list):
+            found = findNode(child,keyword)
+            if found:
+                return found
+    return None
+
+class Projection(object):
+    """ the inverse of a projected coordinate system, built from the parsed
+    .prj.  supports Transverse Mercator (UTM, many State Plane zones),
+    Lambert Conformal Conic (most other State Plane zones) and Mercator,
+    including Web Mercator (Mercator_Auxiliary_Sphere). """
+    def __init__(self,wkt):
+        self.name = wkt[1]
+        projection = findNode(wkt,"PROJECTION")
+        if projection is None:
+            raise Exception("no PROJECTION found in {0}".format(self.name))
+        self.method = projection[1].lower()
+
+        spheroid = findNode(wkt,"SPHEROID")
+        self.a = spheroid[2]
+        inv_f = spheroid[3]
+        f = 1.0/inv_f if inv_f else 0.0
+        self.e2 = 2*f-f*f
+        self.e = math.sqrt(self.e2)
+
+        params = {}
+        for p in findNodes(wkt,"PARAMETER"):
+            params[p[1].lower()] = p[2]
+        self.params = params
+
+        ## the linear unit is the last UNIT of the PROJCS, false easting and
+        ## northing are given in that unit
+        units = findNodes(wkt,"UNIT")
+        self.unit = units[-1][2] if units else 1.0
+
+        self.fe = params.get("false_easting",0.0)
+        self.fn = params.get("false_northing",0.0)
+        self.lon0 = math.radians(params.get("central_meridian",
+                                 params.get("longitude_of_origin",0.0)))
+        self.lat0 = math.radians(params.get("latitude_of_origin",0.0))
+        self.k0 = params.get("scale_factor",1.0)
+
+        if self.method in ("transverse_mercator","gauss_kruger"):
+            self._inverse = self._inverseTM
+        elif self.method.startswith("lambert_conformal_conic"):
+            self._setupLCC()
+            self._inverse = self._inverseLCC
+        elif self.method in ("mercator_auxiliary_sphere",
+                             "popular_visualisation_pseudo_mercator"):
+            self.e2, self.e = 0.0, 0.0
+            self._inverse = self._inverseMercator
+        elif self.method in ("mercator","mercator_1sp","mercator_2sp"):
+            sp1 = math.radians(params.get("standard_parallel_1",0.0))
+            self.k0 = self._m(sp1) if "standard_parallel_1" in params \
+                      else self.k0
+            self._inverse = self._inverseMercator
+        else:
+            raise Exception("the {0} projection is not supported, project "\
+                "the dataset to EPSG 4326 (GCS WGS 1984) first".format(
+                projection[1]))
+
+    def _m(self,phi):
+        return math.cos(phi)/math.sqrt(1-self.e2*math.sin(phi)**2)
+
+    def _t(self,phi):
+        e = self.e
+        return math.tan(math.pi/4-phi/2)/\
+               ((1-e*math.sin(phi))/(1+e*math.sin(phi)))**(e/2)
+
+    def _latFromT(self,m,t):
+        """ solves the latitude for the isometric value t by iteration """
+        e = self.e
+        phi = math.pi/2-2*m.arctan(t) if m is numpy else math.pi/2-2*m.atan(t)
+        atan = m.arctan if m is numpy else m.atan
+        for i in range(8):
+            es = e*m.sin(phi)
+            phi = math.pi/2-2*atan(t*((1-es)/(1+es))**(e/2))
+        return phi
+
+    def _setupLCC(self):
+        p = self.params
+        sp1 = math.radians(p.get("standard_parallel_1",
+                                 math.degrees(self.lat0)))
+        sp2 = math.radians(p.get("standard_parallel_2",math.degrees(sp1)))
+        if abs(sp1-sp2) < 1e-10:
+            self.n = math.sin(sp1)
+        else:
+            self.n = (math.log(self._m(sp1))-math.log(self._m(sp2)))/\
+                     (math.log(self._t(sp1))-math.log(self._t(sp2)))
+        self.F = self._m(sp1)/(self.n*self._t(sp1)**self.n)
+        self.rho0 = self.a*self.F*self.k0*self._t(self.lat0)**self.n
+
+    def _inverseLCC(self,m,x,y):
+        n = self.n
+        sign = 1.0 if n > 0 else -1.0
+        dy = self.rho0-y
+        rho = sign*m.sqrt(x*x+dy*dy)
+        theta = m.arctan2(sign*x,sign*dy) if m is numpy else \
+                m.atan2(sign*x,sign*dy)
+        t = (rho/(self.a*self.F*self.k0))**(1.0/n)
+        return theta/n+self.lon0, self._latFromT(m,t)
+
+    def _inverseMercator(self,m,x,y):
+        ak = self.a*self.k0
+        t = m.exp(-y/ak)
+        if self.e == 0:
+            atan = m.arctan if m is numpy else m.atan
+            lat = math.pi/2-2*atan(t)
+        else:
+            lat = self._latFromT(m,t)
+        return x/ak+self.lon0, lat
+
+    def _inverseTM(self,m,x,y):
+        a, e2, k0 = self.a, self.e2, self.k0
+        e4, e6 = e2*e2, e2*e2*e2
+        ep2 = e2/(1-e2)
+
+        def meridianArc(phi):
+            return a*((1-e2/4-3*e4/64-5*e6/256)*phi
+                      -(3*e2/8+3*e4/32+45*e6/1024)*math.sin(2*phi)
+                      +(15*e4/256+45*e6/1024)*math.sin(4*phi)
+                      -(35*e6/3072)*math.sin(6*phi))
+
+        M = meridianArc(self.lat0)+y/k0
+        mu = M/(a*(1-e2/4-3*e4/64-5*e6/256))
+        e1 = (1-math.sqrt(1-e2))/(1+math.sqrt(1-e2))
+        phi1 = (mu+(3*e1/2-27*e1**3/32)*m.sin(2*mu)
+                +(21*e1**2/16-55*e1**4/32)*m.sin(4*mu)
+                +(151*e1**3/96)*m.sin(6*mu)
+                +(1097*e1**4/512)*m.sin(8*mu))
+
+        sin1, cos1, tan1 = m.sin(phi1), m.cos(phi1), m.tan(phi1)
+        C1 = ep2*cos1*cos1
+        T1 = tan1*tan1
+        N1 = a/m.sqrt(1-e2*sin1*sin1)
+        R1 = a*(1-e2)/(1-e2*sin1*sin1)**1.5
+        D = x/(N1*k0)
+
+        lat = phi1-(N1*tan1/R1)*(D**2/2
+            -(5+3*T1+10*C1-4*C1**2-9*ep2)*D**4/24
+            +(61+90*T1+298*C1+45*T1**2-252*ep2-3*C1**2)*D**6/720)
+        lon = self.lon0+(D-(1+2*T1+C1)*D**3/6
+            +(5-2*C1+28*T1-3*C1**2+8*ep2+24*T1**2)*D**5/120)/cos1
+        return lon, lat
+
+    def toWGS84(self,points):
+        """ returns the list of (x, y) points as (longitude, latitude) degrees.
+        with numpy, longer lists are projected as one array. """
+        if not points:
+            return []
+        if len(points) >= NUMPY_MIN_POINTS and _loadNumpy() is not None:
+            xy = numpy.array([(p[0],p[1]) for p in points],dtype=float)
+            x = (xy[:,0]-self.fe)*self.unit
+            y = (xy[:,1]-self.fn)*self.unit
+            lon, lat = self._inverse(numpy,x,y)
+            return list(zip(numpy.degrees(lon).tolist(),
+                            numpy.degrees(lat).tolist()))
+        result = []
+        for p in points:
+            lon, lat = self._inverse(math,(p[0]-self.fe)*self.unit,
+                                     (p[1]-self.fn)*self.unit)
+            result.append((math.degrees(lon),math.degrees(lat)))
+        return result
+
+def checkDatum(wkt):
+    """ makes sure the datum can be used as WGS84 without a datum shift """
+    datum = findNode(wkt,"DATUM")
+    name = datum[1] if datum else "unknown"
+    if not name in WGS84_DATUMS:
+        raise Exception("""
+  The {0} datum can't be converted to WGS 1984 without a datum
+  transformation.  Project the dataset to EPSG 4326 (GCS WGS 1984) before
+  continuing.""".format(name))
+
+def getProjection(prj_path):
+    """ reads the .prj file next to a dataset.  returns None if the data is
+    already geographic WGS84 (or has no .prj, in which case that is assumed),
+    otherwise a Projection whose toWGS84 method converts coordinates. """
+
+    if not os.path.isfile(prj_path):
+        return None
+    with open(prj_path) as f:
+        text = f.read().strip()
+    if text == "":
+        return None
+
+    wkt = parseWKT(text)
+    checkDatum(wkt)
+    if wkt[0] == "GEOGCS":
+        return None
+    if wkt[0] != "PROJCS":
+        raise Exception("unrecognized coordinate system in {0}".format(
+            prj_path))
+    return Projection(wkt)
@@ -0,0 +1,167 @@
+import os
+import csv
+import glob
+import json
+import hashlib
+
+## version of the cached index format, bump it when the format changes
+INDEX_VERSION = 2
+
+## name of the cached index, kept next to the graphs
+CACHE_NAME = ".graph_index.json"
+
+## indexes already loaded in this process, keyed by directory:
+## (signature, index)
+_cache = {}
+
+def findGraphDirectory(auth_doc_directory):
+    """ guesses the resource graph directory from the authority document
+    directory.  in an Arches v3 project they are source_data/resource_graphs
+    and source_data/concepts/authority_files.  returns None if not found. """
+    if not auth_doc_directory:
+        return None
+    guess = os.path.join(auth_doc_directory,"..","..","resource_graphs")
+    guess = os.path.normpath(guess)
+    if os.path.isdir(guess):
+        return guess
+    return None
+
+def parseGraph(nodes_path,edges_path):
+    """ parses one resource graph.  returns a dictionary of entity label:
+    (merge node, business table, parent label).  the merge node is the root
+    of the branch the entity belongs to, and the business table is None if
+    the nodes file doesn't say and "" for nodes that don't hold values. """
+
+    nodes = {}
+    labels = {}
+    with open(nodes_path,"rb") as f:
+        for row in csv.DictReader(f):
+            label = row["LABEL"].strip()
+            labels[row["ID"].strip()] = label
+            table = row.get("BUSINESSTABLE")
+            if table is not None:
+                table = table.strip()
+            nodes[label] = [row["MERGENODE"].strip(),table,None]
+
+    if os.path.isfile(edges_path):
+        with open(edges_path,"rb") as f:
+            for row in csv.DictReader(f):
+                source = labels.get(row["SOURCE"].strip())
+                target = labels.get(row["TARGET"].strip())
+                if source and target in nodes:
+                    nodes[target][2] = source
+
+    return dict([(k,tuple(v)) for k,v in nodes.iteritems()])
+
+def _graphFiles(graph_dir):
+    """ returns {resource type: (nodes path, edges path)} for a directory """
+    graphs = {}
+    for nodes_path in sorted(glob.glob(os.path.join(graph_dir,"*_nodes.csv"))):
+        resource_type = os.path.basename(nodes_path)[:-len("_nodes.csv")]
+        edges_path = nodes_path[:-len("_nodes.csv")]+"_edges.csv"
+        graphs[resource_type] = (nodes_path,edges_path)
+    return graphs
+
+def _signature(graphs):
+    """ identifies the current version of all graph files """
+    parts = [str(INDEX_VERSION)]
+    for resource_type in sorted(graphs):
+        for path in graphs[resource_type]:
+            if os.path.isfile(path):
+                st = os.stat(path)
+                parts.append("{0}|{1}|{2}".format(path,st.st_mtime,
+                                                  st.st_size))
+    return hashlib.md5("\n".join(parts)).hexdigest()
+
+def _cachePath(graph_dir):
+    """ the index is cached next to the graphs, or in a cache directory of
+    the user's own if the graph directory can't be written to """
+    if os.access(graph_dir,os.W_OK):
+        return os.path.join(graph_dir,CACHE_NAME)
+    cache_dir = os.path.join(os.path.expanduser("~"),".arc2arches")
+    if not os.path.isdir(cache_dir):
+        try:
+            os.makedirs(cache_dir,0700)
+        except OSError:
+            return None
+    name = hashlib.md5(os.path.abspath(graph_dir)).hexdigest()
+    return os.path.join(cache_dir,"graph_index_"+name+".json")
+
+def _readCache(cache_path,signature):
+    """ returns the index cached in cache_path, or None if there is none or
+    it was made from other versions of the graph files.  the cache is plain
+    json, so reading it never runs any code. """
+    if not cache_path or not os.path.isfile(cache_path):
+        return None
+    try:
+        with open(cache_path,"rb") as f:
+            cached = json.load(f)
+        if cached["SIGNATURE"] != signature:
+            return None
+        return dict([(resource_type,dict([(label,tuple(node))
+                     for label, node in graph.iteritems()]))
+                     for resource_type, graph in cached["INDEX"].iteritems()])
+    except (IOError,OSError,ValueError,KeyError,TypeError,AttributeError):
+        return None
+
+def loadGraphIndex(graph_dir):
+    """ returns the index of every resource graph in graph_dir:
+    {resource type: {entity label: (merge node, business table, parent)}}.
+    the parsed index is cached on disk and in memory, and reused until a
+    graph file is added, removed or changed. """
+
+    if not graph_dir or not os.path.isdir(graph_dir):
+        raise Exception("resource graph directory not found: {0}".format(
+            graph_dir))
+    graphs = _graphFiles(graph_dir)
+    if not graphs:
+        raise Exception("no *_nodes.csv resource graphs in {0}".format(
+            graph_dir))
+
+    signature = _signature(graphs)
+    key = os.path.abspath(graph_dir)
+    if key in _cache and _cache[key][0] == signature:
+        return _cache[key][1]
+    cache_path = _cachePath(graph_dir)
+    index = _readCache(cache_path,signature)
+    if index is not None:
+        _cache[key] = (signature,index)
+        return index
+
+    index = {}
+    for resource_type, (nodes_path,edges_path) in graphs.iteritems():
+        index[resource_type] = parseGraph(nodes_path,edges_path)
+
+    if cache_path:
+        try:
+            with open(cache_path,"wb") as f:
+                json.dump({"SIGNATURE":signature,"INDEX":index},f)
+        except (IOError,OSError):
+            pass
+    _cache[key] = (signature,index)
+    return index
+
+def checkGroups(graph,groups):
+    """ checks the groups of a conflig plan against one resource graph, and
+    returns a list of problems.  each entity must be in the graph and able to
+    hold a value, and all entities of a group must be on the same branch,
+    because a group becomes one branch instance in Arches. """
+
+    problems = []
+    for num, group in enumerate(groups):
+        branches = {}
+        for field, entity in group:
+            node = graph.get(entity)
+            if node is None:
+                problems.append("{0} (field {1}) is not in the graph".format(
+                    entity,field))
+                continue
+            if node[1] == "":
+                problems.append("{0} (field {1}) can't hold values".format(
+                    entity,field))
+            branches.setdefault(node[0],[]).append(entity)
+        if len(branches) > 1:
+            problems.append("group {0} mixes branches: {1}".format(num+1,
+                "; ".join(["{0} ({1})".format(b,", ".join(e))
+                           for b, e in sorted(branches.iteritems())])))
+    return problems
@@ -703,14 +703,20 @@ class Writer:
         Several of the shapefile formats are so similar that a single generic
         method to read or write them is warranted."""
         f = self.__getFileObj(fileObj)
+        if headerType == 'shp':
+            fileLength = self.__shpFileLength()
+        else:
+            fileLength = (100 + (len(self._shapes) * 8)) // 2
+        self._writeHeader(f, fileLength)
+
+    def _writeHeader(self, f, fileLength):
+        """Writes a shp or shx header with the given file length, in 16-bit
+        words, and the current bounding boxes."""
         f.seek(0)
         # File code, Unused bytes
         f.write(pack(">6i", 9994,0,0,0,0,0))
         # File length (Bytes / 2 = 16-bit words)
-        if headerType == 'shp':
-            f.write(pack(">i", self.__shpFileLength()))
-        elif headerType == 'shx':
-            f.write(pack('>i', ((100 + (len(self._shapes) * 8)) // 2)))
+        f.write(pack(">i", fileLength))
         # Version, Shape type
         f.write(pack("<2i", 1000, self.shapeType))
         # The shapefile's bounding box (lower left, upper right)
@@ -732,7 +738,10 @@ class Writer:
 
     def __dbfHeader(self):
         """Writes the dbf header and field descriptors."""
-        f = self.__getFileObj(self.dbf)
+        self._writeDbfHeader(self.__getFileObj(self.dbf), len(self.records))
+
+    def _writeDbfHeader(self, f, numRecs):
+        """Writes the dbf header for numRecs records."""
         f.seek(0)
         version = 3
         year, month, day = time.localtime()[:3]
@@ -741,7 +750,6 @@ class Writer:
         for field in self.fields:
             if field[0].startswith("Deletion"):
                 self.fields.remove(field)
-        numRecs = len(self.records)
         numFields = len(self.fields)
         headerLength = numFields * 32 + 33
         recordLength = sum([int(field[2]) for field in self.fields]) + 1
@@ -767,115 +775,121 @@ class Writer:
         f.seek(100)
         recNum = 1
         for s in self._shapes:
-            self._offsets.append(f.tell())
-            # Record number, Content length place holder
-            f.write(pack(">2i", recNum, 0))
+            self._writeShape(f, s, recNum)
             recNum += 1
-            start = f.tell()
-            # Shape Type
-            if self.shapeType != 31:
-                s.shapeType = self.shapeType
-            f.write(pack("<i", s.shapeType))
-            # All shape types capable of having a bounding box
-            if s.shapeType in (3,5,8,13,15,18,23,25,28,31):
-                try:
-                    f.write(pack("<4d", *self.__bbox([s])))
-                except error:
-                    raise ShapefileException("Falied to write bounding box for record %s. Expected floats." % recNum)
-            # Shape types with parts
-            if s.shapeType in (3,5,13,15,23,25,31):
-                # Number of parts
-                f.write(pack("<i", len(s.parts)))
-            # Shape types with multiple points per record
-            if s.shapeType in (3,5,8,13,15,23,25,31):
-                # Number of points
-                f.write(pack("<i", len(s.points)))
-            # Write part indexes
-            if s.shapeType in (3,5,13,15,23,25,31):
-                for p in s.parts:
-                    f.write(pack("<i", p))
-            # Part types for Multipatch (31)
-            if s.shapeType == 31:
-                for pt in s.partTypes:
-                    f.write(pack("<i", pt))
-            # Write points for multiple-point records
-            if s.shapeType in (3,5,8,13,15,23,25,31):
-                try:
-                    [f.write(pack("<2d", *p[:2])) for p in s.points]
-                except error:
-                    raise ShapefileException("Failed to write points for record %s. Expected floats." % recNum)
-            # Write z extremes and values
-            if s.shapeType in (13,15,18,31):
-                try:
-                    f.write(pack("<2d", *self.__zbox([s])))
-                except error:
-                    raise ShapefileException("Failed to write elevation extremes for record %s. Expected floats." % recNum)
+
+    def _writeShape(self, f, s, recNum):
+        """Writes one shp record at the current position of f, and keeps its
+        offset and length for the shx file."""
+        self._offsets.append(f.tell())
+        # Record number, Content length place holder
+        f.write(pack(">2i", recNum, 0))
+        recNum += 1
+        start = f.tell()
+        # Shape Type (null shapes keep theirs, they have no content)
+        if self.shapeType != 31 and s.shapeType != NULL:
+            s.shapeType = self.shapeType
+        f.write(pack("<i", s.shapeType))
+        # All shape types capable of having a bounding box
+        if s.shapeType in (3,5,8,13,15,18,23,25,28,31):
+            try:
+                f.write(pack("<4d", *self.__bbox([s])))
+            except error:
+                raise ShapefileException("Falied to write bounding box for record %s. Expected floats." % recNum)
+        # Shape types with parts
+        if s.shapeType in (3,5,13,15,23,25,31):
+            # Number of parts
+            f.write(pack("<i", len(s.parts)))
+        # Shape types with multiple points per record
+        if s.shapeType in (3,5,8,13,15,23,25,31):
+            # Number of points
+            f.write(pack("<i", len(s.points)))
+        # Write part indexes
+        if s.shapeType in (3,5,13,15,23,25,31):
+            for p in s.parts:
+                f.write(pack("<i", p))
+        # Part types for Multipatch (31)
+        if s.shapeType == 31:
+            for pt in s.partTypes:
+                f.write(pack("<i", pt))
+        # Write points for multiple-point records
+        if s.shapeType in (3,5,8,13,15,23,25,31):
+            try:
+                [f.write(pack("<2d", *p[:2])) for p in s.points]
+            except error:
+                raise ShapefileException("Failed to write points for record %s. Expected floats." % recNum)
+        # Write z extremes and values
+        if s.shapeType in (13,15,18,31):
+            try:
+                f.write(pack("<2d", *self.__zbox([s])))
+            except error:
+                raise ShapefileException("Failed to write elevation extremes for record %s. Expected floats." % recNum)
+            try:
+                if hasattr(s,"z"):
+                    f.write(pack("<%sd" % len(s.z), *s.z))
+                else:
+                    [f.write(pack("<d", p[2])) for p in s.points]  
+            except error:
+                raise ShapefileException("Failed to write elevation values for record %s. Expected floats." % recNum)
+        # Write m extremes and values
+        if s.shapeType in (13,15,18,23,25,28,31):
+            try:
+                if hasattr(s,"m"):
+                    f.write(pack("<%sd" % len(s.m), *s.m))
+                else:
+                    f.write(pack("<2d", *self.__mbox([s])))
+            except error:
+                raise ShapefileException("Failed to write measure extremes for record %s. Expected floats" % recNum)
+            try:
+                [f.write(pack("<d", p[3])) for p in s.points]
+            except error:
+                raise ShapefileException("Failed to write measure values for record %s. Expected floats" % recNum)
+        # Write a single point
+        if s.shapeType in (1,11,21):
+            try:
+                f.write(pack("<2d", s.points[0][0], s.points[0][1]))
+            except error:
+                raise ShapefileException("Failed to write point for record %s. Expected floats." % recNum)
+        # Write a single Z value
+        if s.shapeType == 11:
+            if hasattr(s, "z"):
                 try:
-                    if hasattr(s,"z"):
-                        f.write(pack("<%sd" % len(s.z), *s.z))
-                    else:
-                        [f.write(pack("<d", p[2])) for p in s.points]  
+                    if not s.z:
+                        s.z = (0,)    
+                    f.write(pack("<d", s.z[0]))
                 except error:
-                    raise ShapefileException("Failed to write elevation values for record %s. Expected floats." % recNum)
-            # Write m extremes and values
-            if s.shapeType in (13,15,18,23,25,28,31):
+                    raise ShapefileException("Failed to write elevation value for record %s. Expected floats." % recNum)
+            else:
                 try:
-                    if hasattr(s,"m"):
-                        f.write(pack("<%sd" % len(s.m), *s.m))
-                    else:
-                        f.write(pack("<2d", *self.__mbox([s])))
+                    if len(s.points[0])<3:
+                        s.points[0].append(0)
+                    f.write(pack("<d", s.points[0][2]))
                 except error:
-                    raise ShapefileException("Failed to write measure extremes for record %s. Expected floats" % recNum)
+                    raise ShapefileException("Failed to write elevation value for record %s. Expected floats." % recNum)
+        # Write a single M value
+        if s.shapeType in (11,21):
+            if hasattr(s, "m"):
                 try:
-                    [f.write(pack("<d", p[3])) for p in s.points]
+                    if not s.m:
+                        s.m = (0,) 
+                    f.write(pack("<1d", s.m[0]))
                 except error:
-                    raise ShapefileException("Failed to write measure values for record %s. Expected floats" % recNum)
-            # Write a single point
-            if s.shapeType in (1,11,21):
+                    raise ShapefileException("Failed to write measure value for record %s. Expected floats." % recNum)    
+            else:                                
                 try:
-                    f.write(pack("<2d", s.points[0][0], s.points[0][1]))
+                    if len(s.points[0])<4:
+                        s.points[0].append(0)
+                    f.write(pack("<1d", s.points[0][3]))
                 except error:
-                    raise ShapefileException("Failed to write point for record %s. Expected floats." % recNum)
-            # Write a single Z value
-            if s.shapeType == 11:
-                if hasattr(s, "z"):
-                    try:
-                        if not s.z:
-                            s.z = (0,)    
-                        f.write(pack("<d", s.z[0]))
-                    except error:
-                        raise ShapefileException("Failed to write elevation value for record %s. Expected floats." % recNum)
-                else:
-                    try:
-                        if len(s.points[0])<3:
-                            s.points[0].append(0)
-                        f.write(pack("<d", s.points[0][2]))
-                    except error:
-                        raise ShapefileException("Failed to write elevation value for record %s. Expected floats." % recNum)
-            # Write a single M value
-            if s.shapeType in (11,21):
-                if hasattr(s, "m"):
-                    try:
-                        if not s.m:
-                            s.m = (0,) 
-                        f.write(pack("<1d", s.m[0]))
-                    except error:
-                        raise ShapefileException("Failed to write measure value for record %s. Expected floats." % recNum)    
-                else:                                
-                    try:
-                        if len(s.points[0])<4:
-                            s.points[0].append(0)
-                        f.write(pack("<1d", s.points[0][3]))
-                    except error:
-                        raise ShapefileException("Failed to write measure value for record %s. Expected floats." % recNum)
-            # Finalize record length as 16-bit words
-            finish = f.tell()
-            length = (finish - start) // 2
-            self._lengths.append(length)
-            # start - 4 bytes is the content length field
-            f.seek(start-4)
-            f.write(pack(">i", length))
-            f.seek(finish)
+                    raise ShapefileException("Failed to write measure value for record %s. Expected floats." % recNum)
+        # Finalize record length as 16-bit words
+        finish = f.tell()
+        length = (finish - start) // 2
+        self._lengths.append(length)
+        # start - 4 bytes is the content length field
+        f.seek(start-4)
+        f.write(pack(">i", length))
+        f.seek(finish)
 
     def __shxRecords(self):
         """Writes the shx records."""
@@ -889,30 +903,34 @@ class Writer:
         """Writes the dbf records."""
         f = self.__getFileObj(self.dbf)
         for record in self.records:
-            if not self.fields[0][0].startswith("Deletion"):
-                f.write(b(' ')) # deletion flag
-            for (fieldName, fieldType, size, dec), value in zip(self.fields, record):
-                fieldType = fieldType.upper()
-                size = int(size)
-                if fieldType.upper() == "N":
-                    value = str(value).rjust(size)
-                elif fieldType == 'L':
-                    value = str(value)[0].upper()
-                else:
-                    value = str(value)[:size].ljust(size)
-                assert len(value) == size
-                value = b(value)
-                f.write(value)
+            self._writeRecord(f, record)
+
+    def _writeRecord(self, f, record):
+        """Writes one dbf record at the current position of f."""
+        if not self.fields[0][0].startswith("Deletion"):
+            f.write(b(' ')) # deletion flag
+        for (fieldName, fieldType, size, dec), value in zip(self.fields, record):
+            fieldType = fieldType.upper()
+            size = int(size)
+            if fieldType.upper() == "N":
+                value = str(value).rjust(size)
+            elif fieldType == 'L':
+                value = str(value)[0].upper()
+            else:
+                value = str(value)[:size].ljust(size)
+            assert len(value) == size
+            value = b(value)
+            f.write(value)
 
     def null(self):
         """Creates a null shape."""
-        self._shapes.append(_Shape(NULL))
+        self._addShape(_Shape(NULL))
 
     def point(self, x, y, z=0, m=0):
         """Creates a point shape."""
         pointShape = _Shape(self.shapeType)
         pointShape.points.append([x, y, z, m])
-        self._shapes.append(pointShape)
+        self._addShape(pointShape)
 
     def line(self, parts=[], shapeType=POLYLINE):
         """Creates a line shape. This method is just a convienience method
@@ -949,7 +967,7 @@ class Writer:
                 for part in parts:
                     partTypes.append(polyShape.shapeType)
             polyShape.partTypes = partTypes
-        self._shapes.append(polyShape)
+        self._addShape(polyShape)
 
     def field(self, name, fieldType="C", size="50", decimal=0):
         """Adds a dbf field descriptor to the shapefile."""
@@ -978,7 +996,19 @@ class Writer:
                     else:
                         record.append(val)
         if record:
-            self.records.append(record)
+            self._addRecord(record)
+
+    def addShape(self, shape):
+        """Adds an existing shape, such as one read with a Reader."""
+        self._addShape(shape)
+
+    def _addShape(self, shape):
+        """Keeps a new shape until the shapefile is saved."""
+        self._shapes.append(shape)
+
+    def _addRecord(self, record):
+        """Keeps a new record until the shapefile is saved."""
+        self.records.append(record)
 
     def shape(self, i):
         return self._shapes[i]
@@ -1045,6 +1075,118 @@ class Writer:
             self.dbf.close()
             if generated:
                 return target
+class StreamWriter(Writer):
+    """Writes a shapefile as its shapes and records are added, instead of
+    holding them in memory until save(), so very large shapefiles can be
+    written. The bounding boxes and file lengths are kept up to date as
+    shapes are written, and flush() and close() write the headers. Fields must
+    be added before the first record. If no shape type is given, the type
+    of the first (non-null) shape is used."""
+    def __init__(self, target, shapeType=None):
+        Writer.__init__(self, shapeType)
+        target = os.path.splitext(target)[0]
+        pth = os.path.split(target)[0]
+        if pth and not os.path.exists(pth):
+            os.makedirs(pth)
+        self.shp = open(target + ".shp", "wb")
+        self.shx = open(target + ".shx", "wb")
+        self.dbf = open(target + ".dbf", "wb")
+        # Header place holders, written again by close()
+        self.shp.write(b("\x00") * 100)
+        self.shx.write(b("\x00") * 100)
+        self.shapeCount = 0
+        self.recordCount = 0
+        self._extent = None
+        self._zRange = None
+        self._mRange = [0, 0]
+
+    def _addShape(self, shape):
+        """Writes a new shape and its index entry."""
+        if not self.shapeType and shape.shapeType != NULL:
+            self.shapeType = shape.shapeType
+        self.shapeCount += 1
+        self._writeShape(self.shp, shape, self.shapeCount)
+        self.shx.write(pack(">i", self._offsets.pop() // 2))
+        self.shx.write(pack(">i", self._lengths.pop()))
+        self._updateBoxes(shape)
+
+    def _addRecord(self, record):
+        """Writes a new record, after the header if it is the first."""
+        if self.recordCount == 0:
+            self._writeDbfHeader(self.dbf, 0)
+        self._writeRecord(self.dbf, record)
+        self.recordCount += 1
+
+    def _updateBoxes(self, shape):
+        """Widens the bounding box and z and m ranges to include a shape."""
+        if shape.shapeType == NULL or not shape.points:
+            return
+        xs = [p[0] for p in shape.points]
+        ys = [p[1] for p in shape.points]
+        box = [min(xs), min(ys), max(xs), max(ys)]
+        if self._extent is None:
+            self._extent = box
+        else:
+            e = self._extent
+            self._extent = [min(e[0], box[0]), min(e[1], box[1]),
+                            max(e[2], box[2]), max(e[3], box[3])]
+        zs = [p[2] for p in shape.points if len(p) > 2]
+        if zs:
+            if self._zRange is None:
+                self._zRange = [min(zs), max(zs)]
+            else:
+                self._zRange = [min(self._zRange[0], min(zs)),
+                                max(self._zRange[1], max(zs))]
+        ms = [p[3] for p in shape.points if len(p) > 3]
+        if ms:
+            self._mRange = [min(self._mRange[0], min(ms)),
+                            max(self._mRange[1], max(ms))]
+
+    def bbox(self):
+        """Returns the bounding box of the shapes written so far."""
+        return self._extent or [0, 0, 0, 0]
+
+    def zbox(self):
+        """Returns the z extremes of the shapes written so far."""
+        return self._zRange or [0, 0]
+
+    def mbox(self):
+        """Returns the m extremes of the shapes written so far."""
+        return self._mRange
+
+    def flush(self):
+        """Writes the headers for the shapes and records so far, so the
+        files can be read as they are, and flushes them."""
+        shapeType = self.shapeType
+        if not self.shapeType:
+            self.shapeType = NULL
+        self.shp.seek(0, 2)
+        self._writeHeader(self.shp, self.shp.tell() // 2)
+        self._writeHeader(self.shx, (100 + self.shapeCount * 8) // 2)
+        self._writeDbfHeader(self.dbf, self.recordCount)
+        self.shapeType = shapeType
+        for f in (self.shp, self.shx, self.dbf):
+            f.seek(0, 2)
+            f.flush()
+
+    def close(self):
+        """Writes the final headers and closes the files."""
+        if self.shp.closed:
+            return
+        self.flush()
+        for f in (self.shp, self.shx, self.dbf):
+            f.close()
+
+    def save(self, *args, **kwargs):
+        """The shapefile is already written, save() just closes it."""
+        self.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
 class Editor(Writer):
     def __init__(self, shapefile=None, shapeType=POINT, autoBalance=1):
         self.autoBalance = autoBalance
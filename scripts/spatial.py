@@ -0,0 +1,268 @@
+import os
+import re
+
+from conflig import readConflig
+from geometry import BoxGrid, ringBounds, boxContains, pointInRing
+from relations import DEFAULT_RELATION_TYPE, joinAllRelations
+
+## the spatial relationships a rule can ask for: every vertex of the source
+## feature inside a target polygon, or the two features touching at all
+SPATIAL_PREDICATES = ("WITHIN","INTERSECTS")
+
+_WKT_TOKENS = re.compile(r"\(|\)|[^(),]+")
+
+def parseSpatialRules(conflig_path,dataset_name):
+    """ reads the spatial RELATIONS entries from a .conflig file, returns a
+    list of rule tuples: (source dataset, predicate, target dataset, relation
+    type).  each entry in the conflig looks like:
+        {
+            "SPATIAL": "WITHIN",
+            "TARGET_DATASET": "historic_districts",
+            "RELATION_TYPE": "RELATIONSHIP_TYPE:1"
+        }
+    relating each feature of this dataset to the target features it lies
+    within (WITHIN, which needs polygon targets) or touches or overlaps
+    (INTERSECTS). """
+
+    config_json = readConflig(conflig_path)
+
+    rules = []
+    for entry in config_json.get("RELATIONS",[]):
+        if not "SPATIAL" in entry:
+            continue
+        predicate = str(entry["SPATIAL"]).upper()
+        if not predicate in SPATIAL_PREDICATES:
+            raise Exception("""
+  This spatial relationship is not supported.
+    CONFLIG: {0}
+    SPATIAL: {1} (use {2})""".format(conflig_path,entry["SPATIAL"],
+                " or ".join(SPATIAL_PREDICATES)))
+        target_dataset = entry.get("TARGET_DATASET",dataset_name)
+        target_dataset = os.path.splitext(os.path.basename(target_dataset))[0]
+        rules.append((dataset_name,predicate,target_dataset,
+                      entry.get("RELATION_TYPE",DEFAULT_RELATION_TYPE)))
+
+    return rules
+
+def getSpatialDatasets(rules):
+    """ the names of the datasets whose geometries the rules need """
+    datasets = set()
+    for src_ds, predicate, tgt_ds, rel_type in rules:
+        datasets.add(src_ds)
+        datasets.add(tgt_ds)
+    return datasets
+
+def parseWKT(wkt):
+    """ reads the WKT written for a resource back into the nested form that
+    partsToWKT takes, returns (shape type, parts).  only x and y are kept. """
+
+    head, paren, body = wkt.partition("(")
+    kind = head.split()[0].upper()
+    if not paren:
+        ## an EMPTY geometry
+        return kind, []
+    stack = [[]]
+    for token in _WKT_TOKENS.findall("("+body):
+        if token == "(":
+            stack.append([])
+        elif token == ")":
+            item = stack.pop()
+            stack[-1].append(item)
+        elif token.strip():
+            numbers = token.split()
+            stack[-1].append((float(numbers[0]),float(numbers[1])))
+    nested = stack[0][0]
+
+    if kind == "POINT":
+        return "POINT", nested
+    if kind == "MULTIPOINT":
+        ## the points may or may not have parentheses of their own
+        return "POINT", [p[0] if isinstance(p,list) else p for p in nested]
+    if kind == "LINESTRING":
+        return "POLYLINE", [nested]
+    if kind == "MULTILINESTRING":
+        return "POLYLINE", nested
+    if kind == "POLYGON":
+        return "POLYGON", [nested]
+    if kind == "MULTIPOLYGON":
+        return "POLYGON", nested
+    raise Exception("{0} geometries can not be related spatially".format(
+        kind))
+
+def vertices(shp_type,parts):
+    """ every vertex of a geometry, in one list """
+    if shp_type == "POINT":
+        return parts
+    if shp_type == "POLYLINE":
+        return [p for path in parts for p in path]
+    return [p for polygon in parts for ring in polygon for p in ring]
+
+def segments(shp_type,parts):
+    """ the (start, end) segments of a geometry's paths and rings, points
+    being segments of no length """
+    if shp_type == "POINT":
+        return [(p,p) for p in parts]
+    if shp_type == "POLYLINE":
+        paths = parts
+    else:
+        paths = [ring for polygon in parts for ring in polygon]
+    return [(path[i],path[i+1]) for path in paths
+            for i in xrange(len(path)-1)]
+
+def pointInPolygons(x,y,polygons):
+    """ whether x, y is inside one of the polygons, and not in its holes """
+    for polygon in polygons:
+        if pointInRing(x,y,polygon[0]):
+            for hole in polygon[1:]:
+                if pointInRing(x,y,hole):
+                    break
+            else:
+                return True
+    return False
+
+def _orientation(a,b,c):
+    value = (b[0]-a[0])*(c[1]-a[1])-(b[1]-a[1])*(c[0]-a[0])
+    return (value > 0)-(value < 0)
+
+def _onSegment(a,b,p):
+    """ whether p, known to be in line with a and b, lies between them """
+    return min(a[0],b[0]) <= p[0] <= max(a[0],b[0]) and \
+           min(a[1],b[1]) <= p[1] <= max(a[1],b[1])
+
+def segmentsCross(a,b,c,d):
+    """ whether segment a-b touches or crosses segment c-d """
+    o1, o2 = _orientation(a,b,c), _orientation(a,b,d)
+    o3, o4 = _orientation(c,d,a), _orientation(c,d,b)
+    if o1 != o2 and o3 != o4:
+        return True
+    return (o1 == 0 and _onSegment(a,b,c)) or \
+           (o2 == 0 and _onSegment(a,b,d)) or \
+           (o3 == 0 and _onSegment(c,d,a)) or \
+           (o4 == 0 and _onSegment(c,d,b))
+
+def boxesOverlap(a,b):
+    """ whether two bounding boxes share any point """
+    return a[0] <= b[2] and b[0] <= a[2] and a[1] <= b[3] and b[1] <= a[3]
+
+def isWithin(a_type,a_parts,b_type,b_parts):
+    """ whether every vertex of geometry a is inside polygon geometry b """
+    return b_type == "POLYGON" and all([pointInPolygons(p[0],p[1],b_parts)
+        for p in vertices(a_type,a_parts)])
+
+def isIntersecting(a_type,a_parts,b_type,b_parts,a_box,b_box):
+    """ whether geometries a and b touch or overlap: a vertex of one inside
+    the other, which catches one polygon holding the other, or a pair of
+    crossing segments.  only the segments of b that reach a's bounding box
+    are tested against those of a. """
+    if b_type == "POLYGON":
+        for p in vertices(a_type,a_parts):
+            if pointInPolygons(p[0],p[1],b_parts):
+                return True
+    if a_type == "POLYGON":
+        for p in vertices(b_type,b_parts):
+            if pointInPolygons(p[0],p[1],a_parts):
+                return True
+    near = [s for s in segments(b_type,b_parts)
+            if boxesOverlap(a_box,ringBounds(s))]
+    if not near:
+        return False
+    for a, b in segments(a_type,a_parts):
+        if not boxesOverlap(b_box,ringBounds((a,b))):
+            continue
+        for c, d in near:
+            if segmentsCross(a,b,c,d):
+                return True
+    return False
+
+class GeometryIndex(object):
+    """ the geometries of one dataset's resources, kept while the dataset is
+    converted so its spatial relationship rules can be joined afterwards.
+    geometries are added as the WKT written for them, so they are compared
+    in the output coordinate system, after any thinning. """
+    def __init__(self):
+        self.ids = []
+        self.types = []
+        self.parts = []
+        self.bounds = []
+
+    def add(self,resourceid,wkt):
+        shp_type, parts = parseWKT(wkt)
+        points = vertices(shp_type,parts)
+        if not points:
+            return
+        self.ids.append(resourceid)
+        self.types.append(shp_type)
+        self.parts.append(parts)
+        self.bounds.append(ringBounds(points))
+
+    def addRows(self,resourceid,rows):
+        """ adds the geometry among the converted rows of a resource """
+        for entity, value, offset in rows:
+            if offset == 0:
+                self.add(resourceid,value)
+
+    def __len__(self):
+        return len(self.ids)
+
+def joinSpatial(rule,geometry_indexes):
+    """ spatial join of the source dataset's geometries to the target's.  the
+    target bounding boxes go in a grid, so each source feature is only
+    compared with the targets in the grid cells its own box covers, those
+    whose boxes don't hold (WITHIN) or overlap (INTERSECTS) it are passed
+    over, and the exact test is only run on the rest.  yields
+    (resourceid_from, resourceid_to, relation_type) tuples. """
+
+    src_ds,predicate,tgt_ds,rel_type = rule
+    src, tgt = geometry_indexes[src_ds], geometry_indexes[tgt_ds]
+    if not len(src) or not len(tgt):
+        return
+
+    grid = BoxGrid(tgt.bounds)
+    same = src is tgt
+    for i, a_box in enumerate(src.bounds):
+        a_type, a_parts = src.types[i], src.parts[i]
+        for j in sorted(grid.queryBox(a_box)):
+            ## a dataset related to itself skips each feature's own
+            ## geometry, and only needs each intersecting pair once
+            if same and (j == i or (j < i and predicate == "INTERSECTS")):
+                continue
+            b_box = tgt.bounds[j]
+            if predicate == "WITHIN":
+                if not boxContains(b_box,a_box) or not isWithin(
+                        a_type,a_parts,tgt.types[j],tgt.parts[j]):
+                    continue
+            elif not boxesOverlap(a_box,b_box) or not isIntersecting(
+                    a_type,a_parts,tgt.types[j],tgt.parts[j],a_box,b_box):
+                continue
+            yield (src.ids[i],tgt.ids[j],rel_type)
+
+def joinAllSpatial(rules,geometry_indexes):
+    """ yields the relations for all spatial rules, skipping (with a message)
+    any rule that involves a dataset that was not converted in this run """
+
+    for rule in rules:
+        if not rule[0] in geometry_indexes or \
+           not rule[2] in geometry_indexes:
+            print "skipping relationship {0} {1} {2}: dataset not included "\
+                "in this conversion".format(*rule[:3])
+            continue
+        for relation in joinSpatial(rule,geometry_indexes):
+            yield relation
+
+def joinAllRules(rules,key_indexes,spatial_rules,geometry_indexes):
+    """ yields the relations of the relationship rules and then those of the
+    spatial rules, leaving out any the spatial rules already made, so a field
+    rule and a spatial rule between the same datasets don't write the same
+    (from, to, type) twice.  the spatial relations, the smaller set, are
+    joined first and kept in a set. """
+    spatial = []
+    seen = set()
+    for relation in joinAllSpatial(spatial_rules,geometry_indexes):
+        if not relation in seen:
+            seen.add(relation)
+            spatial.append(relation)
+    for relation in joinAllRelations(rules,key_indexes):
+        if not relation in seen:
+            yield relation
+    for relation in spatial:
+        yield relation
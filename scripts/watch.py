@@ -0,0 +1,144 @@
+import os
+import sys
+import glob
+import time
+import Queue
+import threading
+import traceback
+
+from checkpoint import readCheckpoint, writeCheckpoint
+
+## seconds between looks at the inbox
+POLL_INTERVAL = 5.0
+
+## the files that must be next to a .shp before it is converted
+REQUIRED_EXTENSIONS = (".shx",".dbf",".conflig")
+
+def fileSignature(shp_path):
+    """ the sizes and modification times of a shapefile and the files it
+    needs, or None while one of them is missing """
+    parts = []
+    for ext in (".shp",)+REQUIRED_EXTENSIONS:
+        path = os.path.splitext(shp_path)[0]+ext
+        if not os.path.isfile(path):
+            return None
+        st = os.stat(path)
+        parts.append("{0}:{1}".format(st.st_size,st.st_mtime))
+    return "|".join(parts)
+
+def _timestamp():
+    return time.strftime("%Y-%m-%d %H:%M:%S")
+
+class JobStatus(object):
+    """ the state (queued, running, done or failed) of every job the watcher
+    has seen, written to a json status file after every change so other
+    programs can follow along.  the file is read back on start up. """
+    def __init__(self,path):
+        self.path = path
+        self.jobs = {}
+        self._lock = threading.Lock()
+        saved = readCheckpoint(path)
+        if saved:
+            self.jobs = saved.get("JOBS",{})
+
+    def update(self,name,**values):
+        with self._lock:
+            job = self.jobs.setdefault(name,{})
+            job.update(values)
+            job["UPDATED"] = _timestamp()
+            writeCheckpoint(self.path,{"PID":os.getpid(),"JOBS":self.jobs})
+
+def _runTask(args):
+    """ runs convert(task) and returns ("done", result) or ("failed", error),
+    so a failed job doesn't stop the worker it ran on """
+    convert, task = args
+    try:
+        return "done", convert(task)
+    except:
+        return "failed", "".join(traceback.format_exception_only(
+            *sys.exc_info()[:2])).strip()
+
+def watchInbox(inbox,convert,makeTask,status_path,workers=1,
+               poll_interval=POLL_INTERVAL,polls=None):
+    """ converts the shapefiles that appear in the inbox directory.  a
+    shapefile is queued once its .shx, .dbf and .conflig are present and
+    none of its files changed since the previous poll, so files still being
+    copied are left alone.  makeTask(shp_path, resume) returns the task that
+    convert(task) runs.  with more than one worker the tasks run on a pool
+    of worker processes that stay up between jobs, so each keeps the
+    conflig plans, authority indexes and resource graphs it has loaded.
+
+    a shapefile is converted again only if its files change.  jobs that were
+    queued or running when the watcher last stopped are resumed from their
+    checkpoints.  polls limits the number of polls, after which the watcher
+    waits for the queued jobs and returns; by default it runs until it is
+    interrupted. """
+
+    status = JobStatus(status_path)
+    interrupted = set([name for name, job in status.jobs.iteritems()
+                       if job.get("STATE") in ("queued","running")])
+
+    pool = None
+    if workers > 1:
+        import multiprocessing
+        pool = multiprocessing.Pool(workers)
+
+    queue = Queue.Queue()
+    active = set()
+
+    def work():
+        while True:
+            item = queue.get()
+            if item is None:
+                return
+            name, task = item
+            status.update(name,STATE="running",STARTED=_timestamp())
+            if pool:
+                state, result = pool.apply(_runTask,((convert,task),))
+            else:
+                state, result = _runTask((convert,task))
+            if state == "done":
+                status.update(name,STATE=state,OUTPUT=result,
+                              FINISHED=_timestamp())
+            else:
+                status.update(name,STATE=state,ERROR=result,
+                              FINISHED=_timestamp())
+            print "{0}: {1}".format(name,state)
+            active.discard(name)
+            queue.task_done()
+
+    threads = [threading.Thread(target=work) for i in range(workers)]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+
+    seen = {}
+    count = 0
+    try:
+        while polls is None or count < polls:
+            if count:
+                time.sleep(poll_interval)
+            count += 1
+            for shp_path in sorted(glob.glob(os.path.join(inbox,"*.shp"))):
+                name = os.path.basename(shp_path)
+                signature = fileSignature(shp_path)
+                last, seen[name] = seen.get(name), signature
+                if name in active or signature is None or signature != last:
+                    continue
+                job = status.jobs.get(name,{})
+                same = job.get("SIGNATURE") == signature
+                if same and not name in interrupted:
+                    continue
+                resume = same and name in interrupted
+                interrupted.discard(name)
+                active.add(name)
+                status.update(name,STATE="queued",SIGNATURE=signature,
+                              QUEUED=_timestamp(),ERROR=None)
+                queue.put((name,makeTask(shp_path,resume)))
+        queue.join()
+    finally:
+        for thread in threads:
+            queue.put(None)
+        if pool:
+            pool.terminate()
+            pool.join()
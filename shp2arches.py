@@ -1,21 +1,37 @@
 import os
-import argparse
-import shapefile
-import json
-import subprocess
-import csv
 import sys
-import unicodecsv
 import itertools
+import collections
 
-## try to get the path to the authority docs with the settings
-## otherwise, hardcode path to likely location
+## the shared modules (and local copies of pyshp/unicodecsv) live in scripts
+sys.path.insert(0,os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                               "scripts"))
+
+## prefer site-packages modules, use local ones if necessary
 try:
-    from crip import settings
-    auth_doc_directory = settings.CONCEPT_SCHEME_LOCATIONS
+    import shapefile
 except:
-    thisdir = os.path.dirname(sys.argv[0])
-    auth_doc_directory = \
+    import shapefile_local as shapefile
+
+from conflig import loadConflig, validatePlan, isConstant, constantValue
+from authority import AuthorityRegistry, ReconcileError
+from archesio import ArchesWriter, checkCompression, compressedPath, \
+    stripCompression, relationsPath, ARCHES_HEADER, RELATIONS_HEADER
+from formatters import makeFormatter, makeConstant
+from codepage import getCodepage
+from geometry import getGeometryOptions, thinPoints, splitParts, groupRings, \
+    partsToWKT, ringBounds
+from reproject import getProjection
+from jobs import FIRST_RESOURCEID, FIRST_GROUPID
+from checkpoint import CHECKPOINT_INTERVAL, checkpointPath, readCheckpoint, \
+    writeCheckpoint, removeCheckpoint, checkpointDue
+from relations import RelateIndex, parseRelationRules, getIndexFields, \
+    addToIndex, iterGroups
+from spatial import GeometryIndex, parseSpatialRules, getSpatialDatasets, \
+    joinAllRules
+
+## likely location of the authority docs, if --authority-dir isn't used
+DEFAULT_AUTHORITY_DIR = \
     r"E:\CRNHA_archesproject\repo\crip\crip\source_data\concepts\authority_files"
 
 def getShapeType(reader):
@@ -44,12 +60,73 @@ def getShapeType(reader):
             shp_type))
     return shp_type   
 
-def getWKT(shape,shp_type):
-    """ converts a shape from the shapefile libary to WKT""" 
-   
-    pointlist = [" ".join([str(i) for i in coord]) for coord in shape.points]
-    wkt = "{0} ({1})".format(shp_type,", ".join(pointlist))
-    return wkt
+def getWKT(shape,shp_type,geom_options=(None,None,False),projection=None):
+    """ converts a shape from the shapefile libary to WKT, thinning the
+    coordinates of each part with the (precision, tolerance, dedupe) options.
+    if a projection is given, each part is converted to WGS84 after it is
+    simplified (the tolerance is in the units of the shapefile) and before it
+    is rounded.  lines with several parts are written as a MULTILINESTRING,
+    and the rings of a polygon are grouped into outer rings and their holes,
+    making a POLYGON or MULTIPOLYGON.  returns None for a null shape. """ 
+
+    if not shape.points:
+        return None
+    precision, tolerance, dedupe = geom_options
+    ring = shp_type == "POLYGON"
+
+    def thin(part):
+        if projection:
+            part = thinPoints(part,None,tolerance,dedupe,ring)
+            part = projection.toWGS84(part)
+            return thinPoints(part,precision,None,dedupe,ring)
+        return thinPoints(part,precision,tolerance,dedupe,ring)
+
+    if shp_type == "POINT":
+        return partsToWKT(shp_type,thin(shape.points[:1]),precision)
+    if shp_type == "POLYLINE":
+        return partsToWKT(shp_type,[thin(part) for part in splitParts(shape)],
+                          precision)
+    polygons = groupRings(splitParts(shape))
+    return partsToWKT(shp_type,[[thin(r) for r in rings]
+                                for rings in polygons],precision)
+
+def shapeBounds(shape,projection=None):
+    """ the WGS84 bounding box of a shape, from its point or the corners of
+    its box, or None for a null shape """
+    if not shape.points:
+        return None
+    if not hasattr(shape,"bbox"):
+        points = shape.points[:1]
+    else:
+        x0, y0, x1, y1 = shape.bbox
+        points = [(x0,y0),(x0,y1),(x1,y0),(x1,y1)]
+    if projection:
+        points = projection.toWGS84(points)
+    return ringBounds(points)
+
+def findDuplicates(shapefiles,tolerance,report_path):
+    """ looks through the shapes of every shapefile, in order, for features
+    that duplicate an earlier one (see dedupe.DuplicateIndex), writes them to
+    a csv report and returns the set of duplicate record numbers of each
+    shapefile.  only the .shp is read, in one pass. """
+    from dedupe import DuplicateIndex
+    index = DuplicateIndex(tolerance)
+    duplicates = []
+    for infile in shapefiles:
+        dataset_name = os.path.splitext(os.path.basename(infile))[0]
+        shp = shapefile.Reader(infile)
+        shp_type = getShapeType(shp)
+        projection = getProjection(os.path.splitext(infile)[0]+".prj")
+        found = set()
+        for num, shape in enumerate(shp.iterShapes(),1):
+            box = shapeBounds(shape,projection)
+            if box is not None and \
+               index.check((dataset_name,num),shp_type,box) is not None:
+                found.add(num)
+        duplicates.append(found)
+    index.writeReport(report_path)
+    print "\n".join(index.summary())
+    return duplicates
 
 def getFieldNames(reader):
     """ return list of field names """
@@ -71,86 +148,39 @@ def makeFieldIndex(fields,reader):
             f_index[field[0]] = i-1
     return f_index
 
-def parseFieldMap(field_map_full):
-    """ take field map from json to list of group dictionaries """
-    groups = []
-    for item in field_map_full:
-        for k,v in item.iteritems():
-            groups.append(v)
-    return groups
-
-def parseConfligFile(conflig_path):
-    """ parses the input .conflig (augmented .config) file, return info set """
-    ## access config (conflig) file
-    with open(conflig_path) as con:
-        config_contents = con.read()
-    config_json = json.loads(config_contents)
-    
-    resource_type = config_json["RESOURCE_TYPE"]
-    full_field_map = config_json["FIELD_MAP"]
-    groups = parseFieldMap(full_field_map)
-    fields = []
-    for group in groups:
-        for k, v in group.iteritems():
-            fields.append(k)
-
-    return resource_type, fields, groups
-
 def notepadOpen(inputfile):
     """ opens the input file with notepad++ """
     ## path to notepad executable
     notepad = r"C:\Program Files (x86)\Notepad++\notepad++.exe"     
+    import subprocess
     subprocess.call([notepad,inputfile])
     return
 
-def convertTypeValue(input_value,auth_dict):
+def convertTypeValue(input_value,auth_registry,entity):
     """ takes the input value, and compares it with the authority document
-    dictionary.  if the value is a Preflabel, the corresponding conceptid
-    is returned.  if it is already a conceptid, that id is returned."""
-
-    if auth_dict.values().count(input_value) > 1:
-        raise Exception("""
-  There are two or more corresponding concept ids for this Preflabel.
-  You'll have to find the correct conceptid and apply it to the original
-  dataset.""")
+    of the entity.  if the value is a conceptid, that id is returned;
+    otherwise it is matched with the Preflabels, then the altlabels, and then
+    with both ignoring case, accents and extra whitespace."""
 
-    conceptid = False
-    if input_value in auth_dict.keys():
-        conceptid = input_value
+    conceptids = auth_registry.lookup(entity,input_value)
 
-    else:
-        for k,v in auth_dict.iteritems():
-            if v == input_value:
-                conceptid = k
-                break
+    if len(conceptids) > 1:
+        raise ReconcileError("""
+  There are two or more corresponding concept ids for this label.
+  You'll have to find the correct conceptid and apply it to the original
+  dataset.
+    PROBLEM: {0}
+    CONCEPTIDS: {1}""".format(input_value,", ".join(conceptids)),
+            input_value,conceptids)
 
-    if not conceptid:
-        raise Exception("""
-  The value listed below can not be reconciled with the Preflabels or
-  conceptids that are available for this entity type.  Double-check your
+    if not conceptids:
+        raise ReconcileError("""
+  The value listed below can not be reconciled with the Preflabels, altlabels
+  or conceptids that are available for this entity type.  Double-check your
   original data before trying again.
-    PROBLEM: {0}""".format(input_value))
+    PROBLEM: {0}""".format(input_value),input_value)
                         
-    return conceptid
-
-def getAuthDict(auth_doc_path):
-    """ makes a dictionary for the accepted values present in an autority
-    document """
-
-    auth_dict = {}
-    with open(auth_doc_path, 'rU') as f:
-        fields = ['conceptid','Preflabel','altlabels','ParentConceptid',
-                      'ConceptType','Provider']
-        rows = unicodecsv.DictReader(f, fieldnames=fields,
-            encoding='utf-8-sig', delimiter=',', restkey='ADDITIONAL',
-                                     restval='MISSING')
-        rows.next()
-        rownum = 2
-        for row in rows:
-            auth_dict[row['conceptid']] = row['Preflabel']
-            rownum += 1
-
-    return auth_dict
+    return conceptids[0]
 
 def checkForAuthDoc(entity_name,auth_doc_directory):
     """ checks the entity name against the authority documents, returns path
@@ -161,59 +191,234 @@ def checkForAuthDoc(entity_name,auth_doc_directory):
     if not os.path.isfile(doc_path):
         raise Exception("""
   This entity seems to need an authority document, yet no document was found.
-  Double check settings.CONCEPT_SCHEME_LOCATIONS and make sure an authority
-  document exists named:\n    {0}""".format(doc_name))
+  Double check the authority document directory (--authority-dir) and make
+  sure an authority document exists named:\n    {0}""".format(doc_name))
 
     return doc_path
 
-def makeRelationsFile(arches_file,relationship_dict,relation_type):
-    """ makes an empty relations file to match the given arches file """
+def iterShapeRecords(reader,start=0):
+    """ iterates the (shape, record) pairs of the reader from record number
+    start.  when resuming, shape(i) seeks straight to each shape with the .shx
+    offsets, so the records before start are never read. """
+    if start == 0:
+        for pair in itertools.izip(reader.iterShapes(),reader.iterRecords()):
+            yield pair
+        return
+    for i in xrange(start,reader.numRecords):
+        yield reader.shape(i), reader.record(i)
+
+def indexRecord(record,resourceid,f_index,relation_field,relation_dict,
+                key_index):
+    """ adds the resourceid of a record to the relate key index and to the
+    index of each relationship rule field """
+    if relation_field:
+        addToIndex(relation_dict,record[f_index[relation_field]],resourceid)
+    for field, index in key_index.iteritems():
+        addToIndex(index,record[f_index[field]],resourceid)
+
+def compileColumns(groups,reader,auth_registry,codepage=None):
+    """ returns a (groupid offset, field name, record index, entity,
+    formatter, is a type) tuple for every mapped field, in group order.  the
+    formatter is chosen once from the field's .dbf type, the codepage of the
+    .dbf and the entity, so each value only goes through that one function,
+    and only mapped text is ever decoded.  constants are resolved
+    to their conceptid here, once, and get a formatter that always writes
+    it. """
+    fields = dict([(f[0],(i-1,f[1],f[3]))
+                   for i, f in enumerate(reader.fields)])
+    columns = []
+    for offset, group in enumerate(groups,1):
+        for f_in, entity in group:
+            if isConstant(f_in):
+                value = constantValue(f_in)
+                if entity in auth_registry:
+                    value = convertTypeValue(value,auth_registry,entity)
+                columns.append((offset,f_in,0,entity,makeConstant(value),
+                                False))
+                continue
+            index, field_type, decimal = fields[f_in]
+            columns.append((offset,f_in,index,entity,
+                            makeFormatter(field_type,decimal,entity,
+                                          codepage=codepage),
+                            entity in auth_registry))
+    return columns
+
+def convertRecord(shape,record,shp_type,geom_options,projection,columns,
+                  auth_registry):
+    """ converts one shapefile record to the rows it becomes in the .arches
+    file, as (entity, value, groupid offset) tuples: the geometry row (if
+    the shape isn't null), then the rows of each group, from the columns
+    made by compileColumns.  if a
+    value or the geometry can't be converted, the exception raised has a
+    field attribute that names what failed. """
+    try:
+        wkt = getWKT(shape,shp_type,geom_options,projection)
+    except Exception as e:
+        e.field = "geometry"
+        raise
+    rows = []
+    if wkt is not None:
+        rows.append(("SPATIAL_COORDINATES_GEOMETRY.E47",wkt,0))
+
+    for offset, f_in, index, entity, formatter, typed in columns:
+
+        value = formatter(record[index])
+        if value is None:
+            continue
+
+        ## if it's a type, it may need translation
+        if typed:
+            try:
+                value = convertTypeValue(value,auth_registry,entity)
+            except ReconcileError as e:
+                e.field = f_in
+                raise
+
+        rows.append((entity,value,offset))
+    return rows
+
+def makeRelationsFile(arches,relationship_dict,relation_type,
+                      joined_relations=()):
+    """ makes the relations file(s) to match the given ArchesWriter, relating
+    all resources that share a key, plus the relations produced by the rules """
 
     if not relation_type:
         relation_type = "RELATIONSHIP_TYPE:1"
 
-    relations = os.path.splitext(arches_file)[0]+".relations"
-    with open(relations,"wb") as rel:
-        rel.write("RESOURCEID_FROM|RESOURCEID_TO|START_DATE"\
-            "|END_DATE|RELATION_TYPE|NOTES\r\n")
+    with arches.openRelations() as rel:
 
-        if len(relationship_dict.keys()) == 0:
-            print "no relationships to write"
-            return
-
-        for k, v in relationship_dict.iteritems():
+        for k, v in iterGroups(relationship_dict):
             for a, b in itertools.combinations(v,2):
-                rel.write("{0}|{1}|||{2}|\r\n".format(
-                a,b,relation_type,""))
+                rel.writeRelation(a,b,relation_type)
+
+        for a, b, rule_type in joined_relations:
+            rel.writeRelation(a,b,rule_type)
+
+    if rel.count == 0:
+        print "no relationships to write"
                 
     return
 
-def processSHP(infile,relation_info):
-    """ process the input shapefile """
+def processSHP(infile,relation_info,relate_memory=None,compression=None,
+               max_resources=None,max_bytes=None,precision=None,
+               tolerance=None,resume=False,
+               checkpoint_interval=CHECKPOINT_INTERVAL,pipelined=False,
+               graph_dir=None,config=None,outfile=None,first_ids=None,
+               auth_dir=DEFAULT_AUTHORITY_DIR,quarantine=False,
+               auth_registry=None,duplicates=(),key_indexes=None,
+               index_fields=None,geometry_indexes=None):
+    """ process the input shapefile.  relate_memory is the number of related
+    resourceids each relate index holds in memory before spilling to disk,
+    compression ("gzip" or "zstd") compresses the output as it is written,
+    max_resources/max_bytes split the output into shards, and precision and
+    tolerance override the GEOMETRY options of the conflig file.  a checkpoint
+    is saved every checkpoint_interval records, and resume carries on from
+    the last one instead of starting over.  pipelined reads the shapefile
+    and writes the output on their own threads, overlapping disk access with
+    the conversion of each record.  the field mapping is checked against the
+    resource graphs in graph_dir before anything is converted.  config and
+    outfile default to the .conflig and .arches files next to the shapefile,
+    and first_ids is the (resourceid, groupid) to start numbering from.
+    authority documents are read from auth_dir, through auth_registry if
+    one is shared by the run.  with quarantine, records that can't be
+    converted are written with the reason to a NAME_quarantine shapefile
+    next to the output, and the rest carry on.  the records numbered in
+    duplicates, found by findDuplicates, are left out.  key_indexes,
+    index_fields and geometry_indexes are shared by the datasets of a job
+    file: the dataset's fields in index_fields are indexed into key_indexes,
+    and its geometries into its GeometryIndex, if it has one, so the caller
+    can join the rules between datasets once all of them are converted, and
+    close the indexes.  only the rules within the dataset are joined here. """
 
-    outfile = os.path.splitext(infile)[0]+".arches"
-    config = os.path.splitext(infile)[0]+".conflig"
+    if not outfile:
+        outfile = os.path.splitext(infile)[0]+".arches"
+    outfile = compressedPath(outfile,checkCompression(compression))
+    if not config:
+        config = os.path.splitext(infile)[0]+".conflig"
+    cp_path = checkpointPath(outfile)
     
     if not os.path.isfile(config):
         raise Exception("no conflig file")
-    if os.path.isfile(outfile):
-        os.remove(outfile)
 
     ## access shapefile
     shp = shapefile.Reader(infile)
     shp_fields = getFieldNames(shp)
     shp_type = getShapeType(shp)
 
+    ## find the checkpoint to resume from, or start over
+    state = None
+    if resume:
+        state = readCheckpoint(cp_path)
+        if state is None:
+            print "no checkpoint found, starting from the beginning"
+        elif state["INPUT"] != os.path.basename(infile) or \
+             state["RECORDS"] != shp.numRecords:
+            raise Exception("""
+  The checkpoint does not match this shapefile.  Run again without resuming.
+    CHECKPOINT: {0}""".format(cp_path))
+    if state is None:
+        removeCheckpoint(cp_path)
+        if os.path.isfile(outfile):
+            os.remove(outfile)
+
+    ## coordinates that aren't WGS84 are projected as they are read
+    projection = getProjection(os.path.splitext(infile)[0]+".prj")
+
     ## access conflig file
-    result = parseConfligFile(config)
-    res_type,config_fields,groups =  result[0],result[1],result[2]
+    plan = loadConflig(config)
+    res_type, groups = plan.resource_type, plan.groups
+    config_fields = list(plan.fields)
+
+    ## check the field mapping and entities before converting anything
+    graph_index = None
+    if graph_dir:
+        from resourcegraph import loadGraphIndex
+        graph_index = loadGraphIndex(graph_dir)
+    else:
+        print "resource graphs not found, entity names will not be checked"
+    entity_auth = dict([(entity,checkForAuthDoc(entity,auth_dir))
+                        for entity in plan.entities if ".E55" in entity])
+    if auth_registry is None:
+        auth_registry = AuthorityRegistry()
+    for entity, path in entity_auth.iteritems():
+        auth_registry.add(entity,path)
+    validatePlan(plan,shp_fields,entity_auth,graph_index,auth_registry)
+
+    ## coordinate precision and thinning, from the conflig or the arguments
+    geom_options = getGeometryOptions(config,precision,tolerance)
+
+    ## relationship rules declared in the conflig file, and spatial rules,
+    ## of which only those relating the dataset to itself can be joined by a
+    ## single conversion
+    dataset_name = os.path.splitext(os.path.basename(infile))[0]
+    rules = parseRelationRules(config,dataset_name)
+    spatial_rules = parseSpatialRules(config,dataset_name)
+    shared = key_indexes is not None
+    if shared:
+        rules = [rule for rule in rules if rule[2] == dataset_name]
+        spatial_rules = [rule for rule in spatial_rules
+                         if rule[2] == dataset_name]
+    else:
+        key_indexes, geometry_indexes = {}, {}
+        index_fields = getIndexFields(rules)
+        if [rule for rule in spatial_rules if rule[2] == dataset_name]:
+            geometry_indexes[dataset_name] = GeometryIndex()
+    rule_fields = sorted((index_fields or {}).get(dataset_name,()))
+    out_dir = os.path.dirname(os.path.abspath(outfile))
+    key_index = dict([(field,RelateIndex(relate_memory,out_dir))
+                      for field in rule_fields])
+    key_indexes[dataset_name] = key_index
+    geometry_index = (geometry_indexes or {}).get(dataset_name)
 
     ## compare config and shp information
     relation_field = relation_info[0]
     if relation_field:
         config_fields.append(relation_field)
+    config_fields += rule_fields
     checkFieldsInConfig(config_fields,shp_fields)
     f_index = makeFieldIndex(config_fields,shp)
+    codepage = getCodepage(infile)
+    columns = compileColumns(groups,shp,auth_registry,codepage)
 
     ## print intro summary
     print """FROM: {0}
@@ -222,94 +427,710 @@ CONFLIGURATION: {2}
 
 resource type: {3}
 shape type: {4}
+coordinate system: {5}
 field mapping:
   (shape field --> arches entity)""".format(os.path.basename(infile),
-    os.path.basename(outfile),os.path.basename(config),res_type,shp_type)
+    os.path.basename(outfile),os.path.basename(config),res_type,shp_type,
+    projection.name+" --> WGS 1984" if projection else "WGS 1984")
     cnt = 1
     for group in groups:
         print "  ~ group", cnt
-        for k,v in group.iteritems():
+        for k,v in group:
             print "      {0} --> {1}".format(k,v)
         cnt+=1
 
-    ## dictionary of created authority document dictionaries
-    auth_dict_dict = {}
-
     ## dictionary of related resources
-    relation_dict = {}
+    relation_dict = RelateIndex(relate_memory,out_dir)
 
-    resourceid = 100000
-    groupid = 300000
+    resourceid, groupid = first_ids or (FIRST_RESOURCEID,FIRST_GROUPID)
+    start = 0
 
-    ## print file
-    with open(outfile,"wb") as arches:
-        arches.write("RESOURCEID|RESOURCETYPE|ATTRIBUTENAME|ATTRIBUTEVALUE|GROUPID\r\n")
-        for rec in shp.shapeRecords()[:8]:
-
-            ## get relationship key if necessary
-            if relation_field:
-                key = rec.record[f_index[relation_field]]
-                if not key.strip() == "":
-                    if key in relation_dict.keys():
-                        relation_dict[key].append(resourceid)
-                    else:
-                        relation_dict[key] = [resourceid]
-
-            ## write geometry row
-            wkt = getWKT(rec.shape,shp_type)
-            arches.write("{0}|{1}|{2}|{3}|{4}\r\n".format(
-                resourceid,res_type,"SPATIAL_COORDINATES_GEOMETRY.E47",wkt,groupid))
-                
-            for group in groups:
-                groupid+=1
-                for f_in, entity in group.iteritems():
-
-                    value = rec.record[f_index[f_in]]
-                    if value.rstrip() == '':
-                        continue
-
-                    ## if it's a type, it may need translation
-                    if ".E55" in entity:
-
-                        auth_path = checkForAuthDoc(entity,auth_doc_directory)
-                        if not entity in auth_dict_dict.keys():
-                            auth_dict_dict[entity] = getAuthDict(auth_path)
-                        auth_dict = auth_dict_dict[entity]
-                        value = convertTypeValue(value,auth_dict)
-
-                    arches.write("{0}|{1}|{2}|{3}|{4}\r\n".format(
-                        resourceid,res_type,entity,value,groupid))
-            groupid+=1
+    ## when resuming, rebuild the relate indexes from the attributes of the
+    ## records that were already converted, which only reads the .dbf unless
+    ## a spatial rule needs the geometries too (quarantined records were not
+    ## converted, so they aren't related)
+    skipped = set()
+    duplicates = set(duplicates)
+    if state:
+        start = state["RECORD"]
+        skipped = set(state.get("QUARANTINED",[]))
+        print "\nresuming at record", start
+        shapes = itertools.repeat(None)
+        if geometry_index is not None:
+            shapes = shp.iterShapes()
+        for num, (record, shape) in enumerate(itertools.islice(
+                itertools.izip(shp.iterRecords(),shapes),start),1):
+            if not num in skipped and not num in duplicates:
+                indexRecord(record,resourceid,f_index,relation_field,
+                            relation_dict,key_index)
+                if shape is not None:
+                    wkt = getWKT(shape,shp_type,geom_options,projection)
+                    if wkt is not None:
+                        geometry_index.add(resourceid,wkt)
             resourceid+=1
+        resourceid, groupid = state["RESOURCEID"], state["GROUPID"]
 
-    makeRelationsFile(outfile,relation_dict,relation_info[1])
+    ## records that can't be converted are set aside, instead of stopping
+    ## the conversion, if quarantine is on
+    qt = None
+    if quarantine:
+        from quarantine import Quarantine, describeError
+        qt = Quarantine(os.path.splitext(stripCompression(outfile))[0]+
+                        "_quarantine",shp.fields[1:],shp.shapeType,
+                        os.path.splitext(infile)[0]+".prj",len(skipped),
+                        codepage)
+
+    ## print file
+    arches = ArchesWriter(outfile,max_resources,max_bytes,
+                          state and state["WRITER"])
+    with arches:
+        out = arches
+        records = iterShapeRecords(shp,start)
+        if pipelined:
+            from pipeline import iterPrefetched, ThreadedWriter
+            out = ThreadedWriter(arches)
+            records = iterPrefetched(records)
+
+        ## the writer thread is always stopped before the output is closed,
+        ## including when a record fails to convert
+        try:
+            for num, (shape, record) in enumerate(records,start+1):
+                ## duplicates of an earlier resource aren't converted at all
+                rows = None
+                if not num in duplicates:
+                    try:
+                        rows = convertRecord(shape,record,shp_type,
+                                             geom_options,projection,columns,
+                                             auth_registry)
+                    except Exception as e:
+                        if qt is None:
+                            raise
+                        kind, reason = describeError(e)
+                        qt.add(num,kind,reason,record,shape)
+                        skipped.add(num)
+
+                if rows is not None:
+                    ## get relationship keys if necessary
+                    indexRecord(record,resourceid,f_index,relation_field,
+                                relation_dict,key_index)
+                    if geometry_index is not None:
+                        geometry_index.addRows(resourceid,rows)
+                    for entity, value, offset in rows:
+                        out.writeRow(resourceid,res_type,entity,value,
+                                     groupid+offset)
+
+                ## the ids of a quarantined or duplicate record are left
+                ## unused
+                groupid+=len(groups)+1
+                resourceid+=1
+
+                ## save progress every so often, and after the last record so
+                ## a failure while relating resources doesn't redo the
+                ## conversion
+                if checkpoint_interval and (num == shp.numRecords or
+                    checkpointDue(num,checkpoint_interval)):
+                    if qt:
+                        qt.flush()
+                    writeCheckpoint(cp_path,{
+                        "INPUT":os.path.basename(infile),
+                        "RECORDS":shp.numRecords,
+                        "RECORD":num,
+                        "RESOURCEID":resourceid,
+                        "GROUPID":groupid,
+                        "QUARANTINED":sorted(skipped),
+                        "WRITER":out.checkpoint()
+                    })
+        except:
+            if pipelined:
+                out.abort()
+            raise
+        if pipelined:
+            out.close()
+
+    if qt:
+        qt.close()
+        print "\n"+"\n".join(qt.summary())
+
+    makeRelationsFile(arches,relation_dict,relation_info[1],
+                      joinAllRules(rules,key_indexes,spatial_rules,
+                                   geometry_indexes or {}))
+    relation_dict.close()
+    if not shared:
+        for index in key_index.values():
+            index.close()
+    removeCheckpoint(cp_path)
 
     return outfile    
-    
-parser = argparse.ArgumentParser(description=
-        """Converts a shapefile into a .arches file, used to load data into
+
+def estimateSHP(infile,relation_info,precision=None,tolerance=None,
+                config=None,first_ids=None,auth_dir=DEFAULT_AUTHORITY_DIR,
+                sample_size=None,auth_registry=None):
+    """ predicts the size of the output of processSHP without converting the
+    shapefile.  the record count comes from the .shx header, the rows and
+    bytes per resource from converting a sample of records spread through
+    the file (sample_size, 1000 by default), leaving out the share of them
+    that fail to convert, and the relation counts are exact but for those
+    failures: only the key fields are read from the .dbf, and the resources
+    in each key's bucket counted, including those of records that would
+    fail.  prints a report and returns its figures. """
+    import time
+    from estimate import SAMPLE_SIZE, readShxCount, readDbfHeader, \
+        iterDbfColumns, bucketHistogram, pairCount, joinCount, \
+        histogramBins, formatBytes
+    started = time.time()
+    if sample_size is None:
+        sample_size = SAMPLE_SIZE
+
+    base = os.path.splitext(infile)[0]
+    if not config:
+        config = base+".conflig"
+    records = readShxCount(base+".shx")
+    dbf_records = readDbfHeader(base+".dbf")[0]
+
+    shp = shapefile.Reader(infile)
+    shp_type = getShapeType(shp)
+    projection = getProjection(base+".prj")
+    plan = loadConflig(config)
+    res_type, groups = plan.resource_type, plan.groups
+    if auth_registry is None:
+        auth_registry = AuthorityRegistry()
+    for entity in plan.entities:
+        if ".E55" in entity:
+            auth_registry.add(entity,checkForAuthDoc(entity,auth_dir))
+    validatePlan(plan,getFieldNames(shp),auth_registry=auth_registry)
+    geom_options = getGeometryOptions(config,precision,tolerance)
+    columns = compileColumns(groups,shp,auth_registry,getCodepage(infile))
+    resourceid, groupid = first_ids or (FIRST_RESOURCEID,FIRST_GROUPID)
+
+    ## convert a sample of records, evenly spread, to measure the rows and
+    ## bytes each resource becomes, with the ids it would really be given
+    step = max(1.0,float(records)/sample_size)
+    sample = sorted(set([int(i*step) for i in xrange(min(records,
+                                                          sample_size))]))
+    rows = row_bytes = wkt_bytes = sampled = failed = 0
+    for i in sample:
+        record = shp.record(i)
+        if record is None:
+            continue
+        sampled += 1
+        try:
+            out_rows = convertRecord(shp.shape(i),record,shp_type,
+                                     geom_options,projection,columns,
+                                     auth_registry)
+        except Exception:
+            failed += 1
+            continue
+        first_group = groupid+i*(len(groups)+1)
+        for entity, value, offset in out_rows:
+            row_bytes += len("{0}|{1}|{2}|{3}|{4}\r\n".format(resourceid+i,
+                res_type,entity,value,first_group+offset))
+        rows += len(out_rows)
+        wkt_bytes += sum([len(value) for entity, value, offset in out_rows
+                          if offset == 0])
+    converted = max(sampled-failed,1)
+
+    ## sampled records that fail give no rows, as they would be quarantined,
+    ## so the totals only count the share of records that convert
+    scale = float(records)/max(sampled,1)
+    result = {
+        "RECORDS":records,
+        "SAMPLED":sampled,
+        "FAILED":failed,
+        "ROWS":int(round(rows*scale)),
+        "BYTES":len(ARCHES_HEADER)+int(round(row_bytes*scale)),
+        "RELATIONS":0,
+        "RELATIONS_BYTES":len(RELATIONS_HEADER),
+    }
+
+    ## count the keys of the relate field and the rule fields, in one pass
+    ## over just those columns of the .dbf
+    relation_field, relation_type = relation_info
+    dataset_name = os.path.basename(base)
+    rules = parseRelationRules(config,dataset_name)
+    local_rules = [r for r in rules if r[0] == r[2]]
+    key_fields = []
+    for field in ([relation_field] if relation_field else [])+\
+                 [r[1] for r in local_rules]+[r[3] for r in local_rules]:
+        if not field in key_fields:
+            key_fields.append(field)
+    key_counts = dict([(field,collections.Counter()) for field in key_fields])
+    same_record = collections.Counter()
+    for keys in iterDbfColumns(base+".dbf",key_fields):
+        values = dict(zip(key_fields,keys))
+        for field, key in values.iteritems():
+            if key is not None:
+                key_counts[field][key] += 1
+        for rule in local_rules:
+            key = values[rule[1]]
+            if key is not None and key == values[rule[3]]:
+                same_record[rule] += 1
+
+    id_length = len(str(resourceid+records-1))
+    relations = []
+    if relation_field:
+        histogram = bucketHistogram(key_counts[relation_field])
+        relations.append((relation_field+" (relate field)",
+            relation_type or "RELATIONSHIP_TYPE:1",histogram,
+            pairCount(histogram)))
+    for rule in rules:
+        name = "{1} --> {2}.{3}".format(*rule)
+        if not rule in local_rules:
+            relations.append((name,rule[4],None,None))
+            continue
+        if rule[1] == rule[3]:
+            histogram = bucketHistogram(key_counts[rule[1]])
+            relations.append((name,rule[4],histogram,pairCount(histogram)))
+        else:
+            relations.append((name,rule[4],{},joinCount(key_counts[rule[1]],
+                key_counts[rule[3]],same_record[rule])))
+    for name, rel_type, histogram, count in relations:
+        if count:
+            result["RELATIONS"] += count
+            result["RELATIONS_BYTES"] += count*(2*id_length+len(rel_type)+7)
+
+    ## print the report
+    print """ESTIMATE: {0}
+records: {1} (.shx header){2}
+sampled: {3} records, {4:.1f} rows per resource, {5:.0f} bytes of WKT per
+  geometry""".format(os.path.basename(infile),records,
+    "" if dbf_records == records else
+    ", the .dbf header says {0}".format(dbf_records),
+    sampled,float(rows)/converted,float(wkt_bytes)/converted)
+    if failed:
+        print "  {0} sampled records could not be converted (see -q), the "\
+            ".arches\n  figures leave out that share of the records".format(
+            failed)
+    print ".arches: {0} rows, {1}".format(result["ROWS"],
+                                         formatBytes(result["BYTES"]))
+    for name, rel_type, histogram, count in relations:
+        print "relationship {0}:".format(name)
+        if histogram is None:
+            print "  not estimated, the target is another dataset"
+            continue
+        print "  {0} relations".format(count)
+        if not histogram:
+            continue
+        print "  {0} keys, the largest shared by {1} resources".format(
+            sum(histogram.values()),max(histogram.keys()))
+        print "  bucket size     keys  resources  relations"
+        for low, high, keys, resources, pairs in histogramBins(histogram):
+            size = str(low) if low == high else "{0}-{1}".format(low,high)
+            print "  {0:<11} {1:>8} {2:>10} {3:>10}".format(size,keys,
+                resources,pairs)
+    print ".relations: {0} rows, {1}".format(result["RELATIONS"],
+        formatBytes(result["RELATIONS_BYTES"]))
+    if failed and result["RELATIONS"]:
+        print "  the keys of records that can't be converted are counted "\
+            "too, so this may be\n  more than are written"
+    print "estimated in {0:.2f} seconds\n".format(time.time()-started)
+
+    return result
+
+def estimateJobFile(job_path,auth_dir=DEFAULT_AUTHORITY_DIR,
+                    auth_registry=None):
+    """ estimates the output of every job in a job file, with the ids each
+    job would be given, and prints the totals """
+    from estimate import readShxCount, formatBytes
+    from jobs import loadJobFile, assignIdRanges
+    jobs = loadJobFile(job_path)
+    sizes = []
+    for job in jobs:
+        config = job.get("CONFLIG") or \
+                 os.path.splitext(job["SHAPEFILE"])[0]+".conflig"
+        sizes.append((readShxCount(os.path.splitext(job["SHAPEFILE"])[0]+
+            ".shx"),len(loadConflig(config).groups)))
+
+    totals = collections.Counter()
+    for job, first_ids in zip(jobs,assignIdRanges(sizes)):
+        totals.update(estimateSHP(job["SHAPEFILE"],
+            (job.get("RELATE_FIELD"),job.get("RELATION_TYPE")),
+            job.get("PRECISION"),job.get("TOLERANCE"),job.get("CONFLIG"),
+            first_ids,auth_dir,auth_registry=auth_registry))
+    print """TOTAL: {0} jobs, {1} records
+.arches: {2} rows, {3}
+.relations: {4} rows, {5}""".format(len(jobs),totals["RECORDS"],
+        totals["ROWS"],formatBytes(totals["BYTES"]),totals["RELATIONS"],
+        formatBytes(totals["RELATIONS_BYTES"]))
+    return totals
+
+def makeJobRelationsFile(job_path,rules,spatial_rules,key_indexes,
+                         geometry_indexes):
+    """ joins the relationship rules between the datasets of a job file, once
+    all of them are converted, into a JOBFILE_cross.relations file.  their
+    resources are in the .arches files of the jobs, so it goes with an empty
+    JOBFILE_cross.arches, loaded after them.  the indexes are closed.
+    returns the path of the .arches file, or None if nothing was related. """
+
+    arches = ArchesWriter(os.path.splitext(job_path)[0]+"_cross.arches")
+    arches.close()
+    with arches.openRelations() as rel:
+        for a, b, rel_type in joinAllRules(rules,key_indexes,spatial_rules,
+                                           geometry_indexes):
+            rel.writeRelation(a,b,rel_type)
+    for key_index in key_indexes.values():
+        for index in key_index.values():
+            index.close()
+
+    if rel.count == 0:
+        print "no relationships between the datasets of the job"
+        os.remove(relationsPath(arches.path))
+        os.remove(arches.path)
+        return None
+    print "{0} relationships between the datasets of the job written to "\
+        "{1}".format(rel.count,os.path.basename(relationsPath(arches.path)))
+    return arches.path
+
+## the authority registry of the run, given to every job by _runJob.  the
+## worker processes of a job file or --watch are forked with it loaded.
+_registry = None
+
+def _runJob(kwargs):
+    """ runs one job of a job file, in this process or a worker process """
+    if _registry is not None:
+        _registry.refresh()
+    return processSHP(auth_registry=_registry,**kwargs)
+
+def makeJobTask(job,resume=False,checkpoint_interval=CHECKPOINT_INTERVAL,
+                graph_dir=None,first_ids=None,auth_dir=DEFAULT_AUTHORITY_DIR):
+    """ turns the settings of a job (see jobs.JOB_SETTINGS) into the keyword
+    arguments of processSHP """
+    shard_bytes = None
+    if job.get("SHARD_MB"):
+        shard_bytes = int(job["SHARD_MB"]*1024*1024)
+    return {
+        "infile":job["SHAPEFILE"],
+        "relation_info":(job.get("RELATE_FIELD"),job.get("RELATION_TYPE")),
+        "relate_memory":job.get("RELATE_MEMORY"),
+        "compression":job.get("COMPRESSION"),
+        "max_resources":job.get("SHARD_RESOURCES"),
+        "max_bytes":shard_bytes,
+        "precision":job.get("PRECISION"),
+        "tolerance":job.get("TOLERANCE"),
+        "resume":resume,
+        "checkpoint_interval":checkpoint_interval,
+        "pipelined":bool(job.get("PIPELINED")),
+        "graph_dir":graph_dir,
+        "config":job.get("CONFLIG"),
+        "outfile":job.get("OUTPUT"),
+        "first_ids":first_ids,
+        "auth_dir":auth_dir,
+        "quarantine":bool(job.get("QUARANTINE")),
+    }
+
+def runJobFile(job_path,workers=1,resume=False,
+               checkpoint_interval=CHECKPOINT_INTERVAL,graph_dir=None,
+               auth_dir=DEFAULT_AUTHORITY_DIR,auth_registry=None,
+               dedupe=None):
+    """ converts every shapefile listed in a job file.  the conflig plans,
+    resource graphs and authority documents of all jobs are loaded once, up
+    front, and each job gets its own range of resource and group ids, so the
+    outputs are the same whether the jobs run one after another or on
+    several worker processes.  dedupe is a (tolerance in meters, drop) pair:
+    features that duplicate one earlier in the job file are reported in a
+    JOBFILE_duplicates.csv file, and left out if drop is set.  the rules
+    relating one job's dataset to another's are joined after the last job,
+    see makeJobRelationsFile.  returns the output files in job order. """
+
+    global _registry
+    from jobs import loadJobFile, assignIdRanges
+    _registry = auth_registry or AuthorityRegistry()
+    jobs = loadJobFile(job_path)
+    if graph_dir:
+        from resourcegraph import loadGraphIndex
+        loadGraphIndex(graph_dir)
+
+    sizes, rules, spatial_rules, datasets = [], [], [], set()
+    for job in jobs:
+        infile = job["SHAPEFILE"]
+        config = job.get("CONFLIG") or os.path.splitext(infile)[0]+".conflig"
+        plan = loadConflig(config)
+        dataset_name = os.path.splitext(os.path.basename(infile))[0]
+        rules += parseRelationRules(config,dataset_name)
+        spatial_rules += parseSpatialRules(config,dataset_name)
+        datasets.add(dataset_name)
+        for entity in plan.entities:
+            if ".E55" in entity:
+                _registry.add(entity,checkForAuthDoc(entity,auth_dir))
+        sizes.append((shapefile.Reader(infile).numRecords,len(plan.groups)))
+    _registry.load()
+
+    tasks = [makeJobTask(job,resume,checkpoint_interval,graph_dir,first_ids,
+                         auth_dir)
+             for job, first_ids in zip(jobs,assignIdRanges(sizes))]
+
+    ## duplicates are found across all the jobs before any is converted
+    if dedupe:
+        tolerance, drop = dedupe
+        duplicates = findDuplicates([job["SHAPEFILE"] for job in jobs],
+            tolerance,os.path.splitext(job_path)[0]+"_duplicates.csv")
+        if drop:
+            for task, found in zip(tasks,duplicates):
+                task["duplicates"] = found
+
+    ## the datasets of the job share their indexes when a rule relates two
+    ## of them, which keeps those jobs in this process
+    cross_rules = [rule for rule in rules if rule[0] != rule[2]]
+    cross_spatial = [rule for rule in spatial_rules if rule[0] != rule[2]]
+    if cross_rules or cross_spatial:
+        key_indexes, index_fields = {}, getIndexFields(rules)
+        geometry_indexes = dict([(name,GeometryIndex()) for name in
+            getSpatialDatasets(spatial_rules) if name in datasets])
+        for task in tasks:
+            task.update(key_indexes=key_indexes,index_fields=index_fields,
+                        geometry_indexes=geometry_indexes)
+        if workers > 1:
+            print "the job relates its datasets to each other, so they are "\
+                "converted one at a time"
+        outputs = [_runJob(task) for task in tasks]
+        makeJobRelationsFile(job_path,cross_rules,cross_spatial,key_indexes,
+                             geometry_indexes)
+        return outputs
+
+    if workers > 1 and len(tasks) > 1:
+        ## the workers are forked after the loading above, so on linux they
+        ## start with everything loaded; elsewhere each loads what it uses
+        import multiprocessing
+        pool = multiprocessing.Pool(min(workers,len(tasks)))
+        try:
+            return pool.map(_runJob,tasks,1)
+        finally:
+            pool.close()
+            pool.join()
+    return [_runJob(task) for task in tasks]
+
+def watchDirectory(inbox,settings,out_dir=None,workers=1,poll_interval=None,
+                   checkpoint_interval=CHECKPOINT_INTERVAL,graph_dir=None,
+                   auth_dir=DEFAULT_AUTHORITY_DIR,auth_registry=None):
+    """ keeps converting the shapefiles dropped into the inbox directory,
+    with the same settings (a job dictionary without SHAPEFILE) for all.
+    the output, checkpoints and the status.json file that lists every job
+    are written to out_dir, inbox/converted by default.  the authority
+    registry is kept for the life of the watcher, and a document is read
+    again when it changes. """
+    global _registry
+    from watch import POLL_INTERVAL, watchInbox
+    _registry = auth_registry or AuthorityRegistry()
+    if poll_interval is None:
+        poll_interval = POLL_INTERVAL
+    if not out_dir:
+        out_dir = os.path.join(inbox,"converted")
+    if not os.path.isdir(out_dir):
+        os.makedirs(out_dir)
+    if graph_dir:
+        from resourcegraph import loadGraphIndex
+        loadGraphIndex(graph_dir)
+
+    def makeTask(shp_path,resume):
+        job = dict(settings)
+        job["SHAPEFILE"] = shp_path
+        job["OUTPUT"] = os.path.join(out_dir,os.path.splitext(
+            os.path.basename(shp_path))[0]+".arches")
+        return makeJobTask(job,resume,checkpoint_interval,graph_dir,
+                           auth_dir=auth_dir)
+
+    print "watching", inbox
+    watchInbox(inbox,_runJob,makeTask,os.path.join(out_dir,"status.json"),
+               workers,poll_interval)
+
+def makeParser():
+    """ builds the command line parser """
+    import argparse
+    parser = argparse.ArgumentParser(description=
+            """Converts a shapefile into a .arches file, used to load data into
 an Arches (v3.0) installation.  Requires an accompanying .conflig file (an
 augmented version of the original .config  format) to handle field mapping.""",
-                                 epilog="get ready to go!")
+                                     epilog="get ready to go!")
+
+    parser.add_argument("shapefile",nargs="?",help="path to shapefile")
+
+    parser.add_argument("-j",dest="job_file",
+                        help="convert every shapefile listed in this .json "\
+                        "or .yaml job file instead of a single shapefile")
+
+    parser.add_argument("--watch",dest="inbox",
+                        help="keep converting the shapefiles that are put in "\
+                        "this directory, until interrupted")
+
+    parser.add_argument("-od",dest="out_dir",
+                        help="directory for the output of --watch "\
+                        "(default=INBOX/converted)")
+
+    parser.add_argument("-pi",dest="poll_interval",type=float,
+                        help="seconds between looks at the --watch directory "\
+                        "(default=5)")
+
+    parser.add_argument("-w",dest="workers",type=int,default=1,
+                        help="number of job file or --watch conversions to "\
+                        "run at the same time (default=1)")
+
+    parser.add_argument("--estimate",action="store_true",
+                        help="only predict the size of the output and the "\
+                        "number of relations, from the file headers, a "\
+                        "sample of records and the relate key fields")
+
+    parser.add_argument("-of",dest="openup",action="store_true",
+                        help="open output file on completion (default=TRUE)")
+
+    parser.add_argument("-rf",dest="relation_field",
+                        help="indicate a field that holds keys for related "\
+                        "resources within this dataset")
+
+    parser.add_argument("-rt",dest="relation_type",
+                        help="indicate the relationship type to be applied "\
+                        "to all relationships")
+
+    parser.add_argument("-rm",dest="relate_memory",type=int,
+                        help="number of related resource ids to hold in "\
+                        "memory before the relate index is moved to a "\
+                        "temporary file (default=1000000)")
+
+    parser.add_argument("-z",dest="compression",choices=("gzip","zstd"),
+                        help="compress the .arches and .relations files as "\
+                        "they are written")
+
+    parser.add_argument("-sr",dest="shard_resources",type=int,
+                        help="split the output into shards of at most this "\
+                        "many resources, described by a .manifest file")
+
+    parser.add_argument("-sb",dest="shard_mb",type=float,
+                        help="split the output into shards of at most this "\
+                        "many megabytes (uncompressed), described by a "\
+                        ".manifest file")
+
+    parser.add_argument("-gp",dest="precision",type=int,
+                        help="number of decimal places written for "\
+                        "coordinates (default=full precision)")
+
+    parser.add_argument("-gt",dest="tolerance",type=float,
+                        help="simplify geometries with this Douglas-Peucker "\
+                        "tolerance, in map units")
+
+    parser.add_argument("-ci",dest="checkpoint_interval",type=int,
+                        default=CHECKPOINT_INTERVAL,
+                        help="number of records converted between "\
+                        "checkpoints (default={0}, 0 turns checkpoints "\
+                        "off)".format(
+                        CHECKPOINT_INTERVAL))
+
+    parser.add_argument("--resume",action="store_true",
+                        help="carry on from the last checkpoint of an "\
+                        "interrupted conversion instead of starting over")
+
+    parser.add_argument("-pl",dest="pipelined",action="store_true",
+                        help="read the shapefile and write the output on "\
+                        "separate threads, which helps most when the files "\
+                        "are on a slow disk or network share")
+
+    parser.add_argument("-q",dest="quarantine",action="store_true",
+                        help="skip the records that can't be converted and "\
+                        "write them, with the reason, to a NAME_quarantine "\
+                        "shapefile instead of stopping")
+
+    parser.add_argument("-dt",dest="dedupe_tolerance",type=float,
+                        help="report features within this many meters of "\
+                        "an earlier one (in this shapefile, or any of the "\
+                        "job file) in a NAME_duplicates.csv file")
+
+    parser.add_argument("-dd",dest="drop_duplicates",action="store_true",
+                        help="leave the duplicates found with -dt out of the "\
+                        "output, instead of only reporting them")
+
+    parser.add_argument("-ad","--authority-dir",dest="auth_dir",
+                        default=DEFAULT_AUTHORITY_DIR,
+                        help="directory of the authority documents "\
+                        "(default={0})".format(DEFAULT_AUTHORITY_DIR))
+
+    parser.add_argument("-gd",dest="graph_dir",
+                        help="directory of the resource graph (*_nodes.csv "\
+                        "and *_edges.csv) files that the field mapping is "\
+                        "checked against "\
+                        "(default=source_data/resource_graphs, found from "\
+                        "the authority document directory)")
+
+    return parser
+
+def main(argv=None):
+    """ runs the command line tool """
+    parser = makeParser()
+    args = parser.parse_args(argv)
+    graph_dir = args.graph_dir
+    if not graph_dir:
+        from resourcegraph import findGraphDirectory
+        graph_dir = findGraphDirectory(args.auth_dir)
 
-parser.add_argument("shapefile",help="path to shapefile")
+    ## one authority registry for everything converted in this run
+    auth_registry = AuthorityRegistry()
 
-parser.add_argument("-of",dest="openup",action="store_true",
-                    help="open output file on completion (default=TRUE)")
+    if args.estimate:
+        if args.job_file:
+            estimateJobFile(args.job_file,args.auth_dir,auth_registry)
+        elif args.shapefile:
+            estimateSHP(args.shapefile,(args.relation_field,
+                        args.relation_type),args.precision,args.tolerance,
+                        auth_dir=args.auth_dir,auth_registry=auth_registry)
+        else:
+            parser.error("give a shapefile or a job file (-j) to estimate")
+        return
+    dedupe = None
+    if args.dedupe_tolerance:
+        dedupe = (args.dedupe_tolerance,args.drop_duplicates)
+    elif args.drop_duplicates:
+        parser.error("-dd needs a duplicate tolerance (-dt)")
+    if args.job_file:
+        runJobFile(args.job_file,args.workers,args.resume,
+                   args.checkpoint_interval,graph_dir,args.auth_dir,
+                   auth_registry,dedupe)
+        return
+    if args.inbox:
+        if dedupe:
+            parser.error("duplicates (-dt) can't be found while watching a "\
+                         "directory")
+        settings = {
+            "RELATE_FIELD":args.relation_field,
+            "RELATION_TYPE":args.relation_type,
+            "RELATE_MEMORY":args.relate_memory,
+            "COMPRESSION":args.compression,
+            "SHARD_RESOURCES":args.shard_resources,
+            "SHARD_MB":args.shard_mb,
+            "PRECISION":args.precision,
+            "TOLERANCE":args.tolerance,
+            "PIPELINED":args.pipelined,
+            "QUARANTINE":args.quarantine,
+        }
+        try:
+            watchDirectory(args.inbox,settings,args.out_dir,args.workers,
+                           args.poll_interval,args.checkpoint_interval,
+                           graph_dir,args.auth_dir,auth_registry)
+        except KeyboardInterrupt:
+            print "stopped watching", args.inbox
+        return
+    if not args.shapefile:
+        parser.error("give a shapefile, a job file (-j) or a directory to "\
+                     "watch (--watch)")
 
-parser.add_argument("-rf",dest="relation_field",
-                    help="indicate a field that holds keys for related "\
-                    "resources within this dataset")
+    relation_info = (args.relation_field,args.relation_type)
 
-parser.add_argument("-rt",dest="relation_type",
-                    help="indicate the relationship type to be applied to "\
-                    "all relationships")
+    shard_bytes = None
+    if args.shard_mb:
+        shard_bytes = int(args.shard_mb*1024*1024)
 
-args = parser.parse_args()
+    duplicates = ()
+    if dedupe:
+        duplicates = findDuplicates([args.shapefile],args.dedupe_tolerance,
+            os.path.splitext(args.shapefile)[0]+"_duplicates.csv")[0]
+        if not args.drop_duplicates:
+            duplicates = ()
 
-relation_info = (args.relation_field,args.relation_type)
+    file_path = processSHP(args.shapefile,relation_info,args.relate_memory,
+                           args.compression,args.shard_resources,shard_bytes,
+                           args.precision,args.tolerance,args.resume,
+                           args.checkpoint_interval,args.pipelined,
+                           graph_dir,auth_dir=args.auth_dir,
+                           quarantine=args.quarantine,
+                           auth_registry=auth_registry,
+                           duplicates=duplicates)
+    if args.openup and not args.compression and os.path.isfile(file_path):
+        notepadOpen(file_path)
 
-file_path = processSHP(args.shapefile,relation_info)
-if args.openup:
-    notepadOpen(file_path)
- 
+if __name__ == "__main__":
+    main()